@@ -0,0 +1,61 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+import timeit
+
+from src import benchmark_stl
+from src.async_simulation import STLSimulation, run_episodes
+from src.generator import TrafficGenerator
+from src.utils import import_test_configuration, set_sumo
+
+
+def cpu_time():
+    """
+    Cpu time of the process and of its finished sumo processes
+    """
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+if __name__ == "__main__":
+    # evaluation episodes of the STL benchmark per second, blocking TraCI one episode after the other
+    # against the asyncio driver with 1, 8 and 32 concurrent sumo instances
+    config = import_test_configuration(config_file='settings/testing_settings.ini')
+    sumo_cmd = set_sumo(False, config['sumocfg_file_name'], config['max_steps'])
+    traffic_gen = TrafficGenerator(config['max_steps'], config['n_cars_generated'])
+    route_dir = tempfile.mkdtemp(prefix='async_routes_')
+    os.makedirs('benchmark', exist_ok=True)
+
+    with open(os.path.join('benchmark', 'async_driver.txt'), 'a') as f:
+        for n_instances in [1, 8, 32]:
+            episodes = [config['episode_seed'] + i for i in range(n_instances)]
+
+            start_time, start_cpu = timeit.default_timer(), cpu_time()
+            delays = []
+            for episode in episodes:
+                simulation = benchmark_stl.Simulation(traffic_gen, sumo_cmd, config['max_steps'],
+                                                      config['green_duration'], config['yellow_duration'],
+                                                      config['num_states'], config['num_actions'])
+                simulation.run(episode)
+                delays.append(simulation.cumulative_total_wait())
+            blocking_time, blocking_cpu = timeit.default_timer() - start_time, cpu_time() - start_cpu
+
+            start_time, start_cpu = timeit.default_timer(), cpu_time()
+            simulations = [STLSimulation(traffic_gen, sumo_cmd, config['max_steps'], config['green_duration'],
+                                         config['yellow_duration'], config['num_states'], config['num_actions'],
+                                         os.path.join(route_dir, 'routes_{}.rou.xml'.format(i)))
+                           for i in range(n_instances)]
+            queue_lengths = run_episodes(simulations, episodes)
+            async_time, async_cpu = timeit.default_timer() - start_time, cpu_time() - start_cpu
+            same = delays == [sum(queue_lengths[episode]) for episode in episodes]
+
+            line = "{} cars, {} instances on {} cores: blocking {:.2f} episodes/s ({:.2f} per cpu-second), " \
+                   "asyncio {:.2f} episodes/s ({:.2f} per cpu-second), same delays: {}".format(
+                       config['n_cars_generated'], n_instances, os.cpu_count(), n_instances / blocking_time,
+                       n_instances / blocking_cpu, n_instances / async_time, n_instances / async_cpu, same)
+            print(line)
+            f.write(line + "\n")
+    shutil.rmtree(route_dir, ignore_errors=True)
@@ -1,14 +1,153 @@
 from __future__ import absolute_import
 from __future__ import print_function
 
+import timeit
+
 from src.testing_simulation import Simulation
 from src.generator import TrafficGenerator
-from src.model import TestModel
+from src.model_registry import get_registry
+from src.observation import ObservationSpec
+from src.detectors import DetectorMeter
+from src.snapshot import SnapshotCache
+from src.eval_cache import EvaluationCache
+from src.sequential import SequentialComparison
+from src.q_cache import QValueCache
 from src.visualization import Visualization
 from src.utils import import_test_configuration, set_sumo
 from src.benchmark_stl import make_benchmark
 
 
+class _Evaluator:
+    """
+    Runs the evaluation episodes of the models on 'n_cars' scenarios, reading back the cached ones
+    """
+    def __init__(self, config, n_cars, route_file=None):
+        self._config = config
+        self._traffic_gen = TrafficGenerator(
+            config['max_steps'],
+            n_cars,
+            route_file
+        )
+
+        self._observation = ObservationSpec(config['net_file'], config['cell_edges'], config['channels'])
+        self._detectors = DetectorMeter(self._observation.network) if config['detectors'] else None
+        self._sumo_cmd = set_sumo(config['gui'], config['sumocfg_file_name'], config['max_steps'], route_file,
+                                  self._detectors.path if self._detectors else None)
+        self._snapshots = None
+        if config['warmup_steps'] > 0:  # every model starts from the same warmed-up network of an episode
+            self._snapshots = SnapshotCache(config['snapshot_path'], config['snapshot_disk_mb'] * 2**20,
+                                            config['snapshot_memory_mb'] * 2**20)
+        # episodes already evaluated for a model file and a scenario are read back instead of simulated
+        self._cache = EvaluationCache()
+        self._scenario = dict(n_cars=n_cars, max_steps=config['max_steps'], green_duration=config['green_duration'],
+                              yellow_duration=config['yellow_duration'], num_states=config['num_states'],
+                              num_actions=config['num_actions'], channels=config['channels'],
+                              cell_edges=config['cell_edges'], detectors=config['detectors'],
+                              warmup_steps=config['warmup_steps'], native_stl=config['native_stl'],
+                              trip_output=config['trip_output'], sparse_input=config['sparse_input'])
+        # models stay loaded across calls of the process, a model is loaded on its first episode missing from the cache
+        self._registry = get_registry(config['model_cache_mb'] * 2**20, config['sparse_input'],
+                                      self._observation.is_binary)
+        self._q_caches = {}  # model id -> q-values of the states it has seen, kept across its episodes
+        self._warmup_time = 0
+        self._simulated_episodes = 0
+        self._simulation_seconds = 0
+        self._trip_stats = []  # per-vehicle delays of the simulated episodes, with trip_output
+
+    def run(self, model_id, seed):
+        """
+        Returns the queue length series and the total delay of model 'model_id' on the episode of 'seed'
+        """
+        model_path = "models/model_" + model_id
+        model_hash = self._registry.hash(model_path)
+        episode_key = self._cache.scenario_key(seed=seed, **self._scenario)
+        cached = self._cache.get(model_hash, episode_key)
+        if cached is not None:
+            return cached
+        model = self._registry.get(model_path, self._config['num_states'])
+        if self._config['q_cache_size'] > 0 and model_id not in self._q_caches:
+            self._q_caches[model_id] = QValueCache(self._config['q_cache_size'], self._observation.is_binary)
+        simulation = Simulation(
+            model,
+            self._traffic_gen,
+            self._sumo_cmd,
+            self._config['max_steps'],
+            self._config['green_duration'],
+            self._config['yellow_duration'],
+            self._config['num_states'],
+            self._config['num_actions'],
+            self._observation,
+            self._detectors,
+            self._config['native_stl'],
+            self._snapshots,
+            self._config['warmup_steps'],
+            self._q_caches.get(model_id),
+            self._config['trip_output']
+        )
+
+        start_time = timeit.default_timer()
+        total_reward, simulation_time, car_timings = simulation.run(seed)
+        self._simulation_seconds += timeit.default_timer() - start_time
+        self._simulated_episodes += 1
+        queue_lengths = simulation.queue_length_episode
+        delay = simulation.cumulative_total_wait()
+        self._warmup_time += simulation.warmup_time
+        if simulation.trip_stats:
+            self._trip_stats.append(simulation.trip_stats)
+        self._cache.put(model_hash, episode_key, queue_lengths, delay)
+        return queue_lengths, delay
+
+    def print_stats(self):
+        if self._snapshots is not None:
+            print("warm-up time: {:.1f} s, snapshots loaded: {}, simulated: {}".format(
+                self._warmup_time, self._snapshots.hits, self._snapshots.misses))
+        print(self._registry.stats())
+        for model_id, q_cache in self._q_caches.items():
+            print("model {} {}".format(model_id, q_cache.stats()))
+        print("episodes read from the evaluation cache: {}, simulated: {}".format(self._cache.hits, self._cache.misses))
+        if self._trip_stats:
+            print("trips of the simulated episodes, averaged: {}".format(
+                {key: round(sum(stats[key] for stats in self._trip_stats) / len(self._trip_stats), 2)
+                 for key in self._trip_stats[0]}))
+
+    def close(self):
+        self._cache.close()
+        if self._snapshots is not None:
+            self._snapshots.close()
+
+    @property
+    def episode_seconds(self):
+        """
+        Average wall time of a simulated episode, 0 if every episode was read from the cache
+        """
+        return self._simulation_seconds / max(self._simulated_episodes, 1)
+
+
+def _plot_aql(model_id, n_cars, raw_data):
+    """
+    Plots the queue length averaged over 100 steps and over the episodes of 'raw_data'
+    """
+    visualization = Visualization(
+        "models/model_" + model_id,
+        dpi=96
+    )
+    episode_count = len(raw_data)
+    to_graph_raw = []
+    for i in range(episode_count):
+        s = 0
+        tmp = []
+        for j in range(len(raw_data[i]) - 100):
+            s = sum(raw_data[i][j:j + 100]) / 100
+            tmp.append(s)
+        to_graph_raw.append(tmp)
+    to_graph = [0] * (len(to_graph_raw[0]) - 100)
+    for i in range(episode_count):
+        for j in range(len(to_graph_raw[i]) - 100):
+            to_graph[j] += to_graph_raw[i][j] / episode_count
+    visualization.save_data_and_plot(data=to_graph, filename='AQL_' + str(n_cars), xlabel='Step',
+                                     ylabel='avg queue length over 100 steps')
+
+
 def test(models_to_test_str, n_cars, episode_count, seed_shift, filename):
     """
     Runs testing procedure for models specified in 'models_to_test_str',
@@ -17,75 +156,74 @@ def test(models_to_test_str, n_cars, episode_count, seed_shift, filename):
     """
     with open("test_results/"+filename, 'a') as out:
         config = import_test_configuration(config_file='settings/testing_settings.ini')
-        sumo_cmd = set_sumo(config['gui'], config['sumocfg_file_name'], config['max_steps'])
-
-        traffic_gen = TrafficGenerator(
-            config['max_steps'],
-            n_cars
-        )
+        evaluator = _Evaluator(config, n_cars)
 
         models_to_test = models_to_test_str.split()
         for model_id in models_to_test:
             model_path = "models/model_" + model_id
-            plot_path = "models/model_" + model_id
-
-            visualization = Visualization(
-                plot_path,
-                dpi=96
-            )
-            model = TestModel(
-                input_dim=config['num_states'],
-                model_path=model_path
-            )
-
-            simulation = Simulation(
-                model,
-                traffic_gen,
-                sumo_cmd,
-                config['max_steps'],
-                config['green_duration'],
-                config['yellow_duration'],
-                config['num_states'] + (model_id == 12),
-                config['num_actions'],
-            )
             avg_delay = 0
             raw_data = []
             for i in range(episode_count):
-                simulation = Simulation(
-                    model,
-                    traffic_gen,
-                    sumo_cmd,
-                    config['max_steps'],
-                    config['green_duration'],
-                    config['yellow_duration'],
-                    config['num_states'],
-                    config['num_actions'],
-                )
-
+                seed = config['episode_seed'] + i + seed_shift
                 # print("Episode: {} of {}. Model id: {}".format(i + 1, episode_count, model_id))
-                total_reward, simulation_time, car_timings = simulation.run(config['episode_seed']+i+seed_shift)
-                raw_data.append(simulation.queue_length_episode)
-                delay = simulation.cumulative_total_wait()
+                queue_lengths, delay = evaluator.run(model_id, seed)
+                raw_data.append(queue_lengths)
                 print(delay)
                 avg_delay += delay / episode_count
-            to_graph_raw = []
-            for i in range(episode_count):
-                s = 0
-                tmp = []
-                for j in range(len(raw_data[i]) - 100):
-                    s = sum(raw_data[i][j:j + 100]) / 100
-                    tmp.append(s)
-                to_graph_raw.append(tmp)
-            to_graph = [0] * (len(to_graph_raw[0]) - 100)
-            for i in range(episode_count):
-                for j in range(len(to_graph_raw[i]) - 100):
-                    to_graph[j] += to_graph_raw[i][j] / episode_count
-            visualization.save_data_and_plot(data=to_graph, filename='AQL_' + str(n_cars), xlabel='Step',
-                                             ylabel='avg queue length over 100 steps')
+            _plot_aql(model_id, n_cars, raw_data)
             with open(model_path+"/total_delay.txt", 'a') as f:
                 f.write("{}, {}, {}, resulted: {} \n".format(n_cars, episode_count, seed_shift, avg_delay))
             out.write('Model: {}; n_cars: {} ;Average total delay: {}\n'.format(model_id, n_cars, avg_delay))
             print("finished model {}".format(model_id))
+        evaluator.print_stats()
+        evaluator.close()
+        print("-" * 250)
+
+
+def test_sequential(models_to_test_str, n_cars, max_episodes, seed_shift, filename):
+    """
+    Runs the models specified in 'models_to_test_str' episode by episode on the same seeds,
+    until the ranking of their total delay, or the confidence interval of every average, meets the precision
+    of the [evaluation] settings, or 'max_episodes' are run
+    outputs the average total delay with its confidence interval and the episodes saved
+    """
+    with open("test_results/"+filename, 'a') as out:
+        config = import_test_configuration(config_file='settings/testing_settings.ini')
+        evaluator = _Evaluator(config, n_cars)
+
+        models_to_test = models_to_test_str.split()
+        comparison = SequentialComparison(models_to_test, config['confidence'], config['precision'],
+                                          config['min_episodes'])
+        raw_data = {model_id: [] for model_id in models_to_test}
+        for i in range(max_episodes):
+            seed = config['episode_seed'] + i + seed_shift
+            for model_id in models_to_test:  # common random numbers: every model runs the same seed
+                queue_lengths, delay = evaluator.run(model_id, seed)
+                raw_data[model_id].append(queue_lengths)
+                comparison.add(model_id, delay)
+            print("episode {}: {}".format(i + 1, ", ".join("model {}: {:.0f} +- {:.0f}".format(
+                model_id, comparison.mean(model_id), comparison.half_width(model_id)) for model_id in models_to_test)))
+            if comparison.done():
+                break
+
+        episode_count = comparison.episodes
+        for model_id in comparison.ranking():
+            _plot_aql(model_id, n_cars, raw_data[model_id])
+            avg_delay = comparison.mean(model_id)
+            with open("models/model_" + model_id + "/total_delay.txt", 'a') as f:
+                f.write("{}, {}, {}, resulted: {} \n".format(n_cars, episode_count, seed_shift, avg_delay))
+            out.write('Model: {}; n_cars: {} ;Average total delay: {} +- {}\n'.format(
+                model_id, n_cars, avg_delay, comparison.half_width(model_id)))
+        saved_episodes = (max_episodes - episode_count) * len(models_to_test)
+        summary = "stopped after {} of {} episodes ({}), ranking: {}; episodes saved: {}, simulator-seconds saved: {:.0f}".format(
+            episode_count, max_episodes,
+            "ranking settled" if comparison.ranking_settled() else
+            "precision reached" if comparison.precision_reached() else "budget exhausted",
+            " < ".join(comparison.ranking()), saved_episodes, saved_episodes * evaluator.episode_seconds)
+        print(summary)
+        out.write(summary + '\n')
+        evaluator.print_stats()
+        evaluator.close()
         print("-" * 250)
 
 
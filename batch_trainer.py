@@ -9,74 +9,144 @@ from shutil import copyfile
 from src.training_simulation import Simulation
 from src.generator import TrafficGenerator
 from src.memory import Memory
+from src.experience import open_for_training
+from src.checkpoint import Checkpointer
+from src.detectors import DetectorMeter
+from src.episode_pipeline import EpisodePipeline
 from src.model import TrainModel
+from src.q_cache import QValueCache
+from src.observation import ObservationSpec
 from src.visualization import Visualization
 from src.utils import import_train_configuration, set_sumo, set_train_path
 
+
+def train(config_file, path, model_name, route_file=None, episodes=None):
+    """
+    Trains a model with the settings of 'config_file', saves it to 'path'
+    and returns the reward and delay of every episode
+
+    With 'episodes', trains that many more episodes from the checkpoint in 'path', if there is one,
+    and checkpoints the session at the end, so that it is trained in intervals
+    """
+    config = import_train_configuration(config_file=config_file)
+    if route_file is None:
+        route_file = os.path.join('tlcs', 'episode_routes.rou.xml')
+
+    observation = ObservationSpec(config['net_file'], config['cell_edges'], config['channels'])
+
+    model = TrainModel(
+        config['num_layers'],
+        config['width_layers'],
+        config['batch_size'],
+        config['learning_rate'],
+        config['num_states'],
+        config['num_actions'],
+        config['optimizer'],
+        config['jit_compile'],
+        config['sparse_input'],
+        observation.is_binary
+    )
+
+    detectors = DetectorMeter(observation.network) if config['detectors'] else None
+    sumo_cmd = set_sumo(config['gui'], config['sumocfg_file_name'], config['max_steps'], route_file,
+                        detectors.path if detectors else None)
+
+    memory = Memory(
+        config['memory_size_max'],
+        config['memory_size_min'],
+        observation.is_binary
+    )
+
+    resume = episodes is not None and os.path.isfile(os.path.join(path, 'checkpoint', 'state.pkl'))
+    experience = open_for_training(config, model, memory, resume)
+
+    checkpointer = None
+    if episodes is not None:
+        checkpointer = Checkpointer(path, model, memory, config['num_states'], config['memory_size_max'],
+                                    observation.is_binary, experience)
+
+    traffic_gen = TrafficGenerator(
+        config['max_steps'],
+        config['n_cars_generated'],
+        route_file
+    )
+
+    visualization = Visualization(
+        path,
+        dpi=96
+    )
+
+    pipeline = None
+    if config['prefetch']:  # the next episode is generated and its sumo started while the current one runs
+        pipeline = EpisodePipeline(config['total_episodes'], route_file)
+
+    simulation = Simulation(
+        model,
+        memory,
+        traffic_gen,
+        sumo_cmd,
+        config['gamma'],
+        config['max_steps'],
+        config['green_duration'],
+        config['yellow_duration'],
+        config['num_states'],
+        config['num_actions'],
+        config['training_epochs'],
+        config['is_greedy'],
+        config['replay_chunk'],
+        experience,
+        observation,
+        detectors,
+        config['native_stl'],
+        QValueCache(config['q_cache_size'], observation.is_binary) if config['q_cache_size'] > 0 else None,
+        pipeline,
+        config['stl_threshold']
+    )
+
+    episode = 0
+    reward_store = []
+    cumulative_wait_store = []
+    last_episode = config['total_episodes']
+    if checkpointer is not None:
+        episode = checkpointer.restore(reward_store, cumulative_wait_store)
+        model.set_learning_rate(config['learning_rate'])  # the config may have changed since the checkpoint
+        last_episode = min(last_episode, episode + episodes)
+    timestamp_start = datetime.datetime.now()
+
+    if config['is_greedy']:
+        while episode < last_episode:
+            print("Episode: {} of {}. Model id: {}".format(episode + 1, config['total_episodes'], model_name))
+            epsilon = 1.0 - (episode / config[
+                'total_episodes'])  # set the epsilon for this episode according to epsilon-greedy policy
+            simulation_time, training_time = simulation.run(episode, epsilon)  # run the simulation
+            episode += 1
+    else:
+        while episode < last_episode:
+            print("Episode: {} of {}. Model id: {}".format(episode + 1, config['total_episodes'], model_name))
+            simulation_time, training_time = simulation.run(episode, 0)  # run the simulation
+            episode += 1
+
+    copyfile(src=config_file, dst=os.path.join(path, 'training_settings.ini'))
+    model.save_model(path)
+    if experience is not None:
+        experience.close()
+    if pipeline is not None:
+        pipeline.close()
+
+    reward_store += simulation.reward_store
+    cumulative_wait_store += simulation.cumulative_wait_store
+    if checkpointer is not None:
+        checkpointer.save(episode, reward_store, cumulative_wait_store)
+        checkpointer.close()
+
+    return {'reward': reward_store, 'delay': cumulative_wait_store}
+
+
 if __name__ == "__main__":
 
     for file in os.listdir("training_batch"):
         print(file)
         config = import_train_configuration(config_file="training_batch/" + file)
-        sumo_cmd = set_sumo(config['gui'], config['sumocfg_file_name'], config['max_steps'])
         path = set_train_path(config['models_path_name'])
-
-        model = TrainModel(
-            config['num_layers'],
-            config['width_layers'],
-            config['batch_size'],
-            config['learning_rate'],
-            config['num_states'],
-            config['num_actions'],
-            config['optimizer']
-        )
-
-        memory = Memory(
-            config['memory_size_max'],
-            config['memory_size_min']
-        )
-
-        traffic_gen = TrafficGenerator(
-            config['max_steps'],
-            config['n_cars_generated']
-        )
-
-        visualization = Visualization(
-            path,
-            dpi=96
-        )
-
-        simulation = Simulation(
-            model,
-            memory,
-            traffic_gen,
-            sumo_cmd,
-            config['gamma'],
-            config['max_steps'],
-            config['green_duration'],
-            config['yellow_duration'],
-            config['num_states'],
-            config['num_actions'],
-            config['training_epochs'],
-            config['is_greedy']
-        )
-
-        episode = 0
-        timestamp_start = datetime.datetime.now()
         file_postfix = re.match(r'\w+_\w+_(.*)\.\w+', file).groups()[0]
-
-        if config['is_greedy']:
-            while episode < config['total_episodes']:
-                print("Episode: {} of {}. Model id: {}".format(episode + 1, config['total_episodes'], file_postfix))
-                epsilon = 1.0 - (episode / config[
-                    'total_episodes'])  # set the epsilon for this episode according to epsilon-greedy policy
-                simulation_time, training_time = simulation.run(episode, epsilon)  # run the simulation
-                episode += 1
-        else:
-            while episode < config['total_episodes']:
-                print("Episode: {} of {}. Model id: {}".format(episode + 1, config['total_episodes'], file_postfix))
-                simulation_time, training_time = simulation.run(episode, 0)  # run the simulation
-                episode += 1
-
-        copyfile(src="training_batch/" + file, dst=os.path.join(path, 'training_settings.ini'))
-        model.save_model(path)
+        train("training_batch/" + file, path, file_postfix)
@@ -0,0 +1,49 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import timeit
+
+from src.collector import Simulation
+from src.experience import ExperienceStore
+from src.generator import TrafficGenerator
+from src.observation import ObservationSpec
+from src.utils import import_train_configuration, set_sumo
+
+
+if __name__ == "__main__":
+    # fills the experience store of settings/training_settings.ini with STL episodes,
+    # training runs may then warm-start or pretrain from it instead of re-simulating
+    config = import_train_configuration(config_file='settings/training_settings.ini')
+    if not config['experience_path']:
+        raise SystemExit("set experience_path in the [memory] section of settings/training_settings.ini")
+    sumo_cmd = set_sumo(config['gui'], config['sumocfg_file_name'], config['max_steps'])
+
+    observation = ObservationSpec(config['net_file'], config['cell_edges'], config['channels'])
+    store = ExperienceStore(config['experience_path'], mode='a', num_states=config['num_states'],
+                            binary=observation.is_binary)
+
+    traffic_gen = TrafficGenerator(
+        config['max_steps'],
+        config['n_cars_generated']
+    )
+
+    simulation = Simulation(
+        store,
+        observation,
+        traffic_gen,
+        sumo_cmd,
+        config['max_steps'],
+        config['green_duration'],
+        config['yellow_duration'],
+        config['num_states'],
+        config['num_actions'],
+    )
+
+    for episode in range(config['total_episodes']):
+        start_time = timeit.default_timer()
+        n_samples = simulation.run(episode)
+        print("Episode: {} of {}. Stored {} transitions in {} s".format(
+            episode + 1, config['total_episodes'], n_samples, round(timeit.default_timer() - start_time, 1)))
+
+    print("Experience store {} holds {} transitions".format(config['experience_path'], len(store)))
+    store.close()
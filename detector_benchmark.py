@@ -0,0 +1,127 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import timeit
+
+import numpy as np
+import traci
+
+from src import benchmark_stl
+from src.detectors import DetectorMeter
+from src.generator import TrafficGenerator
+from src.observation import ObservationSpec
+from src.utils import import_test_configuration, set_sumo
+
+
+class Simulation(benchmark_stl.Simulation):
+    """
+    STL simulation computing the queue and waiting metrics both by polling TraCI and from the E2 detectors,
+    timing each of them
+    """
+    def __init__(self, Detectors, traffic_gen, sumo_cmd, max_steps, green_duration, yellow_duration, num_states,
+                 num_actions):
+        super().__init__(traffic_gen, sumo_cmd, max_steps, green_duration, yellow_duration, num_states, num_actions)
+        self._Detectors = Detectors
+        self._polling_time = 0
+        self._detector_time = 0
+        self._queue_error = 0
+        self._waits = []
+
+    def run(self, episode):
+        """
+        Runs a single episode of the simulation with STL, returns the polling and detector time per step
+        """
+        self._polling_time = 0
+        self._detector_time = 0
+        self._queue_error = 0
+        self._waits = []
+        self._TrafficGen.generate_routefile(seed=episode)
+        traci.start(self._sumo_cmd)
+        self._Detectors.start()
+
+        self._step = 0
+        self._waiting_times = {}
+        self._queue_length_episode = []
+        old_action = -1
+        while self._step < self._max_steps:
+            action = self._choose_action(self._step, old_action)
+            if self._step != 0 and old_action != action:
+                self._set_yellow_phase(old_action)
+                self._simulate(self._yellow_duration)
+            self._set_green_phase(action)
+            self._simulate(self._green_duration)
+            old_action = action
+
+        traci.close()
+        return self._polling_time / self._max_steps, self._detector_time / self._max_steps
+
+    def _simulate(self, steps_todo):
+        """
+        Simulates 'steps_todo' steps, metering the queue and the waiting time of every step both ways
+        """
+        if (self._step + steps_todo) >= self._max_steps:
+            steps_todo = self._max_steps - self._step
+
+        while steps_todo > 0:
+            traci.simulationStep()  # simulate 1 step in sumo
+            self._step += 1
+            steps_todo -= 1
+
+            polling_start = timeit.default_timer()
+            queue_length = self._get_queue_length()
+            total_wait = self._collect_waiting_times()
+            detector_start = timeit.default_timer()
+            self._Detectors.step()
+            detector_queue_length = self._Detectors.queue_length()
+            detector_total_wait = self._Detectors.total_wait()
+            self._detector_time += timeit.default_timer() - detector_start
+            self._polling_time += detector_start - polling_start
+
+            self._queue_length_episode.append(queue_length)
+            self._queue_error += abs(queue_length - detector_queue_length)
+            self._waits.append((total_wait, detector_total_wait))
+
+    @property
+    def queue_error(self):
+        """
+        Mean absolute difference of the polled and the detector queue length per step
+        """
+        return self._queue_error / max(self._step, 1)
+
+    @property
+    def wait_correlation(self):
+        """
+        Correlation of the polled waiting time and its detector estimate over the episode
+        """
+        waits = np.array(self._waits)
+        return np.corrcoef(waits[:, 0], waits[:, 1])[0, 1]
+
+
+if __name__ == "__main__":
+    # cost of the reward and queue metrics per simulation step: per-vehicle polling against E2 detectors
+    config = import_test_configuration(config_file='settings/testing_settings.ini')
+    observation = ObservationSpec(config['net_file'])
+    detectors = DetectorMeter(observation.network)
+    sumo_cmd = set_sumo(False, config['sumocfg_file_name'], config['max_steps'], additional_file=detectors.path)
+    os.makedirs('benchmark', exist_ok=True)
+
+    with open(os.path.join('benchmark', 'detector_metering.txt'), 'a') as f:
+        for n_cars in [1000, 2500, 4000]:
+            simulation = Simulation(
+                detectors,
+                TrafficGenerator(config['max_steps'], n_cars),
+                sumo_cmd,
+                config['max_steps'],
+                config['green_duration'],
+                config['yellow_duration'],
+                config['num_states'],
+                config['num_actions']
+            )
+            polling_time, detector_time = simulation.run(config['episode_seed'])
+            line = "{} cars: {:.3f} ms polling, {:.3f} ms detectors per step ({:.1f}x), " \
+                   "queue difference {:.2f} vehicles, waiting time correlation {:.3f}".format(
+                       n_cars, polling_time * 1000, detector_time * 1000, polling_time / detector_time,
+                       simulation.queue_error, simulation.wait_correlation)
+            print(line)
+            f.write(line + "\n")
@@ -0,0 +1,23 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import datetime
+import os
+from shutil import copyfile
+
+from src.actor_learner import train
+from src.utils import import_train_configuration, set_train_path
+
+if __name__ == "__main__":
+    # the episodes of settings/training_settings.ini simulated by 'actors' processes, the model trained by this one
+    config = import_train_configuration(config_file='settings/training_settings.ini')
+    path = set_train_path(config['models_path_name'])
+    copyfile(src='settings/training_settings.ini', dst=os.path.join(path, 'training_settings.ini'))
+
+    timestamp_start = datetime.datetime.now()
+    model = train(config, path, config['actors'])
+    model.save_model(path)
+
+    print("\n----- Start time:", timestamp_start)
+    print("----- End time:", datetime.datetime.now())
+    print("----- Session info saved at:", path)
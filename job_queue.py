@@ -0,0 +1,144 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import io
+import os
+import signal
+import sys
+from collections import defaultdict
+
+from src.job_queue import Coordinator, CoordinatorClient, Worker
+from src.sweep import expand_grid
+from src.utils import import_test_configuration
+
+_evaluators = {}  # n_cars -> evaluator kept by the worker process across its jobs
+
+
+def run_training(worker, payload):
+    """
+    Trains the sweep trial of the job in a local work directory, uploads the model to the central store
+    """
+    from batch_trainer import train  # tensorflow is only needed by the workers that train
+
+    path = os.path.join('jobs_work', payload['name'], '')
+    os.makedirs(path, exist_ok=True)
+    config_file = os.path.join(path, 'job_settings.ini')
+    with open(config_file, 'w') as f:
+        f.write(payload['config'])
+    stores = train(config_file, path, payload['name'], route_file=os.path.join(path, 'episode_routes.rou.xml'))
+
+    result = {'final_reward': stores['reward'][-1] if stores['reward'] else None,
+              'final_delay': stores['delay'][-1] if stores['delay'] else None,
+              'best_delay': min(stores['delay']) if stores['delay'] else None,
+              'delay': [float(delay) for delay in stores['delay']]}
+    stored = os.path.join('models', 'model_' + payload['name'])
+    files = {os.path.join(stored, name): os.path.join(path, name)
+             for name in ['trained_model.h5', 'training_settings.ini']}
+    return result, files
+
+
+def run_evaluation(worker, payload):
+    """
+    Runs one (model, scenario, seed) episode, the model downloaded from the central store, 'stl' for the benchmark
+    """
+    n_cars, seed = payload['n_cars'], payload['seed']
+    os.makedirs('jobs_work', exist_ok=True)
+    route_file = os.path.join('jobs_work', worker.name + '.rou.xml')  # the workers of a node run concurrently
+    if payload['model'] == 'stl':
+        from src.benchmark_stl import Simulation
+        from src.generator import TrafficGenerator
+        from src.utils import set_sumo
+        config = import_test_configuration(config_file='settings/testing_settings.ini')
+        simulation = Simulation(TrafficGenerator(config['max_steps'], n_cars, route_file),
+                                set_sumo(config['gui'], config['sumocfg_file_name'], config['max_steps'], route_file),
+                                config['max_steps'], config['green_duration'], config['yellow_duration'],
+                                config['num_states'], config['num_actions'], config['native_stl'])
+        simulation.run(seed)
+        queue_lengths, delay = simulation.queue_length_episode, simulation.cumulative_total_wait()
+    else:
+        from batch_tester import _Evaluator  # tensorflow is only needed by the workers that evaluate models
+        worker.fetch(os.path.join('models', 'model_' + payload['model']))
+        if n_cars not in _evaluators:
+            _evaluators[n_cars] = _Evaluator(import_test_configuration(config_file='settings/testing_settings.ini'),
+                                             n_cars, route_file)
+        queue_lengths, delay = _evaluators[n_cars].run(payload['model'], seed)
+    return {'delay': float(delay), 'queue_lengths': [int(q) for q in queue_lengths]}, {}
+
+
+RUNNERS = {'train': run_training, 'evaluate': run_evaluation}
+
+
+def submit_sweep(client, config_file):
+    """
+    Queues a training job for every trial of a sweep config
+    """
+    settings, trials = expand_grid(config_file)
+    jobs = []
+    for key, params, content in trials:
+        config = io.StringIO()
+        content.write(config)
+        jobs.append(('train', {'name': key, 'sweep': settings['name'], 'params': params, 'config': config.getvalue()}))
+    return client.submit(jobs)
+
+
+def submit_evaluation(client, models_to_test_str, n_cars, episode_count, seed_shift):
+    """
+    Queues an evaluation job for every model and episode, on the seeds batch_tester.test would use
+    """
+    config = import_test_configuration(config_file='settings/testing_settings.ini')
+    return client.submit([('evaluate', {'model': model_id, 'n_cars': n_cars,
+                                        'seed': config['episode_seed'] + i + seed_shift})
+                          for model_id in models_to_test_str.split() for i in range(episode_count)])
+
+
+def print_results(client):
+    """
+    Prints the trained trials and the average total delay of every evaluated model and scenario
+    """
+    delays = defaultdict(list)
+    for job_id, kind, payload, status, worker, attempts, result, error in client.results():
+        if kind == 'train':
+            print("trial {} {} {} final delay: {} (attempts: {})".format(
+                payload['name'], status, payload['params'], result['final_delay'] if result else None, attempts))
+        elif status == 'done':
+            delays[(payload['model'], payload['n_cars'])].append(result['delay'])
+    for (model_id, n_cars), model_delays in sorted(delays.items()):
+        print('Model: {}; n_cars: {}; episodes: {}; Average total delay: {}'.format(
+            model_id, n_cars, len(model_delays), sum(model_delays) / len(model_delays)))
+    print(client.status())
+
+
+if __name__ == "__main__":
+    # python job_queue.py coordinator - serves the jobs of the store of the [jobs] settings
+    # python job_queue.py worker [name] - runs jobs until stopped, --exit-when-empty stops once the queue is empty
+    # python job_queue.py submit-sweep settings/sweep_settings.ini
+    # python job_queue.py submit-eval "<model ids>" <n_cars> <episodes> <seed shift>
+    # python job_queue.py results
+    config = import_test_configuration(config_file='settings/testing_settings.ini')
+    address = config['jobs_address']
+    command = sys.argv[1] if len(sys.argv) > 1 else 'results'
+    if command == 'coordinator':
+        coordinator = Coordinator(address, config['jobs_store_path'], config['lease_seconds'], config['max_attempts'])
+        signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+        print("Coordinator on {}, store {}".format(address, config['jobs_store_path']))
+        try:
+            coordinator.serve_forever()
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        finally:
+            coordinator.close()
+    elif command == 'worker':
+        names = [arg for arg in sys.argv[2:] if not arg.startswith('--')]
+        worker = Worker(address, RUNNERS, names[0] if names else None)
+        print("Worker {}: {} jobs done".format(worker.name, worker.run(exit_when_empty='--exit-when-empty' in sys.argv)))
+        worker.close()
+    else:
+        client = CoordinatorClient(address)
+        if command == 'submit-sweep':
+            print("queued jobs", submit_sweep(client, sys.argv[2]))
+        elif command == 'submit-eval':
+            print("queued jobs", submit_evaluation(client, sys.argv[2], int(sys.argv[3]), int(sys.argv[4]),
+                                                   int(sys.argv[5])))
+        else:
+            print_results(client)
+        client.close()
@@ -0,0 +1,106 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import multiprocessing
+import os
+import shutil
+import signal
+import tempfile
+import time
+import timeit
+
+from job_queue import RUNNERS
+from src.job_queue import Coordinator, CoordinatorClient, Worker
+
+
+def sleep_job(worker, payload):
+    """
+    Job of a fixed duration that does not use the cpu, to measure the overhead of the queue alone
+    """
+    time.sleep(payload['seconds'])
+    return {'slept': payload['seconds']}, {}
+
+
+def serve(address, store_path, lease_seconds):
+    coordinator = Coordinator(address, store_path, lease_seconds)
+    signal.signal(signal.SIGTERM, lambda *args: coordinator.close())
+    coordinator.serve_forever()
+
+
+def work(address, name):
+    Worker(address, dict(RUNNERS, sleep=sleep_job), name).run(exit_when_empty=True, poll_interval=0.1)
+
+
+def wait_done(client, n_jobs):
+    while client.status().get('done', 0) + client.status().get('failed', 0) < n_jobs:
+        time.sleep(0.05)
+
+
+def measure(jobs, n_workers, lease_seconds=60):
+    """
+    Runs 'jobs' on a new coordinator with 'n_workers' local worker processes, returns jobs per second
+    """
+    store_path = tempfile.mkdtemp(prefix='jobs_')
+    address = os.path.join(store_path, 'coordinator.sock')
+    coordinator = multiprocessing.Process(target=serve, args=(address, store_path, lease_seconds))
+    coordinator.start()
+    client = CoordinatorClient(address)
+    client.submit(jobs)
+    start_time = timeit.default_timer()
+    workers = [multiprocessing.Process(target=work, args=(address, 'worker_{}'.format(i))) for i in range(n_workers)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = timeit.default_timer() - start_time
+    client.close()
+    coordinator.terminate()
+    coordinator.join()
+    shutil.rmtree(store_path)
+    return len(jobs) / elapsed
+
+
+def measure_worker_death(lease_seconds=2):
+    """
+    Kills a worker in the middle of its job, returns the seconds until another worker completed it and its attempts
+    """
+    store_path = tempfile.mkdtemp(prefix='jobs_')
+    address = os.path.join(store_path, 'coordinator.sock')
+    coordinator = multiprocessing.Process(target=serve, args=(address, store_path, lease_seconds))
+    coordinator.start()
+    client = CoordinatorClient(address)
+    job_id = client.submit([('sleep', {'seconds': 1.0})])[0]
+    doomed = multiprocessing.Process(target=work, args=(address, 'doomed'))
+    doomed.start()
+    while client.status().get('leased', 0) == 0:
+        time.sleep(0.01)
+    os.kill(doomed.pid, signal.SIGKILL)
+    doomed.join()
+    start_time = timeit.default_timer()
+    survivor = multiprocessing.Process(target=work, args=(address, 'survivor'))
+    survivor.start()
+    wait_done(client, 1)
+    recovery = timeit.default_timer() - start_time
+    survivor.join()
+    job = [job for job in client.results() if job[0] == job_id][0]
+    client.close()
+    coordinator.terminate()
+    coordinator.join()
+    shutil.rmtree(store_path)
+    return recovery, job[3], job[4], job[5]
+
+
+if __name__ == "__main__":
+    os.makedirs('benchmark', exist_ok=True)
+    with open("benchmark/job_queue.txt", 'a') as f:
+        for name, jobs in [("sleep 0.2 s", [('sleep', {'seconds': 0.2})] * 32),
+                           ("stl episode", [('evaluate', {'model': 'stl', 'n_cars': 1000, 'seed': 10000 + i})
+                                            for i in range(8)])]:
+            for n_workers in [1, 2, 4, 8]:
+                speed = measure(jobs, n_workers)
+                print("{}, {} workers: {:.2f} jobs/s".format(name, n_workers, speed))
+                f.write("{}, {} workers: {:.2f} jobs/s\n".format(name, n_workers, speed))
+        recovery, status, worker, attempts = measure_worker_death()
+        print("worker killed during its job: {} by {} after {} attempts, {:.1f} s after the kill".format(
+            status, worker, attempts, recovery))
+        f.write("worker killed: {} by {} after {} attempts in {:.1f} s\n".format(status, worker, attempts, recovery))
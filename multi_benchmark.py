@@ -0,0 +1,82 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import subprocess
+import sys
+
+from sumolib import checkBinary
+
+from src.generator import TrafficGenerator
+from src.multi_simulation import Simulation
+from src.observation import ObservationSpec
+from src.model import TrainModel
+from src.utils import import_test_configuration, import_train_configuration, set_sumo
+
+
+def generate_grid(size, path, max_steps, cars_per_intersection):
+    """
+    Generates a 'size' x 'size' grid of signalized intersections and its random routes,
+    returns the net-file and route-file paths
+    """
+    net_file = os.path.join(path, 'grid_{}.net.xml'.format(size))
+    route_file = os.path.join(path, 'grid_{}.rou.xml'.format(size))
+    subprocess.check_call([checkBinary('netgenerate'), '--grid', '--grid.number', str(size),
+                           '--grid.length', '300', '--grid.attach-length', '300', '--default.lanenumber', '2',
+                           '--default-junction-type', 'traffic_light', '--no-turnarounds', 'true',
+                           '-o', net_file])
+    period = max_steps / (cars_per_intersection * size * size)
+    subprocess.check_call([sys.executable, os.path.join(os.environ['SUMO_HOME'], 'tools', 'randomTrips.py'),
+                           '-n', net_file, '-r', route_file, '-e', str(max_steps), '--period', str(period),
+                           '--fringe-factor', '10', '--seed', '42', '-o', os.path.join(path, 'grid_trips.xml')])
+    return net_file, route_file
+
+
+if __name__ == "__main__":
+    # scaling of the batched multi-intersection controller from the single junction of tlcs/ to an 8 x 8 grid
+    train_config = import_train_configuration(config_file='settings/training_settings.ini')
+    config = import_test_configuration(config_file='settings/testing_settings.ini')
+    path = os.path.join('benchmark', 'grids')
+    os.makedirs(path, exist_ok=True)
+
+    with open(os.path.join('benchmark', 'multi_intersection.txt'), 'a') as f:
+        for size in [1, 2, 4, 8]:
+            if size == 1:
+                net_file = os.path.join('tlcs', 'environment.net.xml')
+                sumo_cmd = set_sumo(False, config['sumocfg_file_name'], config['max_steps'])
+                traffic_gen = TrafficGenerator(config['max_steps'], config['n_cars_generated'])
+            else:
+                net_file, route_file = generate_grid(size, path, config['max_steps'], config['n_cars_generated'] // 4)
+                sumo_cmd = [checkBinary('sumo'), '-n', net_file, '-r', route_file, '--no-step-log', 'true',
+                            '--waiting-time-memory', str(config['max_steps']), '--time-to-teleport', '-1']
+                traffic_gen = None  # randomTrips routes are fixed
+            observation = ObservationSpec(net_file)
+
+            # untrained weights: the benchmark measures the cost of a decision, not its quality
+            model = TrainModel(
+                train_config['num_layers'],
+                train_config['width_layers'],
+                train_config['batch_size'],
+                train_config['learning_rate'],
+                observation.num_states,
+                train_config['num_actions'],
+                train_config['optimizer']
+            )
+
+            simulation = Simulation(
+                model,
+                traffic_gen,
+                sumo_cmd,
+                observation,
+                config['max_steps'],
+                config['green_duration'],
+                config['yellow_duration']
+            )
+            simulation_time = simulation.run(config['episode_seed'])
+            observation_time, inference_time = simulation.decision_timings
+            line = "{} intersections: {} s per episode, {:.0f} steps/s, {:.2f} ms observation, " \
+                   "{:.2f} ms inference per decision tick".format(
+                       len(observation.network.intersections), simulation_time, config['max_steps'] / simulation_time,
+                       observation_time * 1000, inference_time * 1000)
+            print(line)
+            f.write(line + "\n")
@@ -0,0 +1,79 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import timeit
+
+import numpy as np
+
+from src.policy_server import PolicyClient
+from src.utils import import_test_configuration
+
+
+def connect(address, model_id, input_dim, authkey='', timeout=60):
+    """
+    Returns a client once the server accepts connections
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return PolicyClient(address, model_id, input_dim, authkey)
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def run_client(address, model_id, input_dim, authkey, seconds, latencies):
+    """
+    Sends random binary states one at a time for 'seconds', appending the latency of every request
+    """
+    client = connect(address, model_id, input_dim, authkey)
+    states = np.random.randint(0, 2, (256, input_dim))
+    end_time = time.monotonic() + seconds
+    i = 0
+    while time.monotonic() < end_time:
+        start_time = timeit.default_timer()
+        client.predict_one(states[i % len(states)])
+        latencies.append(timeit.default_timer() - start_time)
+        i += 1
+    client.close()
+
+
+if __name__ == "__main__":
+    # throughput and latency of the policy server as the number of concurrent clients grows
+    config = import_test_configuration(config_file='settings/testing_settings.ini')
+    address = config['server_address']
+    model_id = str(config['model_to_test'])
+    seconds = 5
+    server = subprocess.Popen([sys.executable, 'policy_server.py', address])
+    os.makedirs('benchmark', exist_ok=True)
+    try:
+        authkey = config['server_authkey']
+        # loads the model before the clients are timed
+        connect(address, model_id, config['num_states'], authkey).predict_one(np.zeros(config['num_states']))
+        with open(os.path.join('benchmark', 'policy_server.txt'), 'a') as f:
+            for n_clients in [1, 4, 16, 64, 256]:
+                latencies = []
+                threads = [threading.Thread(target=run_client,
+                                            args=(address, model_id, config['num_states'], authkey, seconds,
+                                                  latencies))
+                           for _ in range(n_clients)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                line = "{} clients: {:.0f} requests/s, latency p50 {:.2f} ms, p99 {:.2f} ms (max batch {}, " \
+                       "max wait {} ms)".format(n_clients, len(latencies) / seconds,
+                                                np.percentile(latencies, 50) * 1000, np.percentile(latencies, 99) * 1000,
+                                                config['server_max_batch'], config['server_max_wait_ms'])
+                print(line)
+                f.write(line + "\n")
+    finally:
+        server.send_signal(signal.SIGINT)  # the server prints its batching statistics
+        server.wait()
@@ -0,0 +1,24 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import sys
+
+from src.policy_server import PolicyServer
+from src.utils import import_test_configuration
+
+
+if __name__ == "__main__":
+    # python policy_server.py [address] serves the models of models_path_name, loaded on their first request
+    config = import_test_configuration(config_file='settings/testing_settings.ini')
+    address = sys.argv[1] if len(sys.argv) > 1 else config['server_address']
+    server = PolicyServer(address, config['num_states'], config['models_path_name'], config['server_max_batch'],
+                          config['server_max_wait_ms'] / 1000, config['model_cache_mb'] * 2**20,
+                          config['server_authkey'])
+    print("----- Serving at", address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        print("----- Requests served: {}, batches: {}".format(server.served, server.batches))
@@ -0,0 +1,33 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import json
+import os
+import sys
+
+from src.population import PopulationTrainer
+
+
+def run_interval(config_file, path, episodes, metrics_file, threads):
+    """
+    Trains a population member for 'episodes' more episodes within its thread budget and writes its metrics
+    """
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    from batch_trainer import train
+    stores = train(config_file, path, os.path.basename(os.path.normpath(path)),
+                   route_file=os.path.join(path, 'episode_routes.rou.xml'), episodes=episodes)
+
+    with open(metrics_file, 'w') as f:
+        json.dump({'reward': stores['reward'], 'delay': stores['delay']}, f, default=float)
+
+
+if __name__ == "__main__":
+    # python population.py settings/population_settings.ini - runs (or resumes) the population
+    # python population.py --interval <config> <member path> <episodes> <metrics file> <threads> - used by the trainer
+    if len(sys.argv) > 1 and sys.argv[1] == '--interval':
+        run_interval(sys.argv[2], sys.argv[3], int(sys.argv[4]), sys.argv[5], int(sys.argv[6]))
+    else:
+        PopulationTrainer(sys.argv[1] if len(sys.argv) > 1 else 'settings/population_settings.ini').run()
@@ -0,0 +1,45 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+
+from src.generator import TrafficGenerator
+from src.model import TestModel
+from src.observation import ObservationSpec
+from src.q_cache import QValueCache
+from src.testing_simulation import Simulation
+from src.utils import import_test_configuration, set_sumo, set_test_path
+
+
+if __name__ == "__main__":
+    # decisions of the tested model served from the q-value cache, at the traffic levels of the STL benchmark
+    config = import_test_configuration(config_file='settings/testing_settings.ini')
+    model_path, _ = set_test_path(config['models_path_name'], config['model_to_test'])
+    model = TestModel(input_dim=config['num_states'], model_path=model_path)
+    observation = ObservationSpec(config['net_file'], config['cell_edges'], config['channels'])
+    sumo_cmd = set_sumo(False, config['sumocfg_file_name'], config['max_steps'])
+    os.makedirs('benchmark', exist_ok=True)
+
+    with open(os.path.join('benchmark', 'q_cache.txt'), 'a') as f:
+        for n_cars in [1000, 2500, 3500]:
+            q_cache = QValueCache(config['q_cache_size'] or 4096, observation.is_binary)
+            simulation = Simulation(
+                model,
+                TrafficGenerator(config['max_steps'], n_cars),
+                sumo_cmd,
+                config['max_steps'],
+                config['green_duration'],
+                config['yellow_duration'],
+                config['num_states'],
+                config['num_actions'],
+                observation,
+                None,
+                config['native_stl'],
+                None,
+                0,
+                q_cache
+            )
+            simulation.run(config['episode_seed'])
+            line = "model {}, {} cars: {}".format(config['model_to_test'], n_cars, q_cache.stats())
+            print(line)
+            f.write(line + "\n")
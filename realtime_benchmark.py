@@ -0,0 +1,53 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+
+from src.generator import TrafficGenerator
+from src.model import TestModel
+from src.observation import ObservationSpec
+from src.realtime import RealTimeMonitor
+from src.testing_simulation import Simulation
+from src.utils import import_test_configuration, set_sumo, set_test_path
+
+
+if __name__ == "__main__":
+    # decision latencies of the tested model paced to the wall clock, at the traffic levels of the STL benchmark
+    config = import_test_configuration(config_file='settings/testing_settings.ini')
+    model_path, _ = set_test_path(config['models_path_name'], config['model_to_test'])
+    model = TestModel(input_dim=config['num_states'], model_path=model_path)
+    observation = ObservationSpec(config['net_file'], config['cell_edges'], config['channels'])
+    sumo_cmd = set_sumo(False, config['sumocfg_file_name'], config['max_steps'])
+    speed_up = max(config['speed_up'], 100)  # a 5400 s episode in under a minute, the deadline stays in wall time
+    os.makedirs('benchmark', exist_ok=True)
+
+    with open(os.path.join('benchmark', 'realtime.txt'), 'a') as f:
+        for n_cars in [1000, 2500, 3500]:
+            realtime = RealTimeMonitor(config['deadline_ms'], speed_up, config['fallback'])
+            simulation = Simulation(
+                model,
+                TrafficGenerator(config['max_steps'], n_cars),
+                sumo_cmd,
+                config['max_steps'],
+                config['green_duration'],
+                config['yellow_duration'],
+                config['num_states'],
+                config['num_actions'],
+                observation,
+                None,
+                config['native_stl'],
+                None,
+                0,
+                None,
+                False,
+                realtime
+            )
+            simulation.run(config['episode_seed'])
+            stats = realtime.stats()
+            line = ("model {}, {} cars, x{:g}: {} decisions, p50 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms, "
+                    "{} over the {:g} ms deadline, {} fallbacks, max lag {:.1f} ms").format(
+                config['model_to_test'], n_cars, speed_up, stats['decisions'], stats['p50_ms'], stats['p99_ms'],
+                stats['max_ms'], stats['misses'], stats['deadline_ms'], simulation.fallbacks, stats['max_lag_ms'])
+            print(line)
+            f.write(line + "\n")
+            realtime.export(os.path.join('benchmark', 'latency_{}.json'.format(n_cars)))
@@ -0,0 +1,97 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import timeit
+
+import numpy as np
+
+from src.memory import Memory
+from src.model import TrainModel
+from src.utils import import_train_configuration
+
+
+def fill_memory(memory, n_samples, num_states, num_actions, seed=0):
+    """
+    Fills the memory with random binary transitions shaped like the ones collected in the simulation
+    """
+    rng = np.random.RandomState(seed)
+    state = (rng.uniform(size=num_states) < 0.2).astype(float)
+    for _ in range(n_samples):
+        next_state = (rng.uniform(size=num_states) < 0.2).astype(float)
+        memory.add_sample((state, rng.randint(num_actions), -rng.uniform(0, 100), next_state))
+        state = next_state
+
+
+def legacy_replay(model, memory, gamma, num_states, num_actions):
+    """
+    One replay iteration as done before: two predict calls and one fit call per batch
+    """
+    batch = memory.get_samples(model.batch_size)
+    states = np.array([val[0] for val in batch])
+    next_states = np.array([val[3] for val in batch])
+    q_current = model.predict_batch(states)
+    q_future = model.predict_batch(next_states)
+    x = np.zeros((len(batch), num_states))
+    y = np.zeros((len(batch), num_actions))
+    for i, b in enumerate(batch):
+        current_q = q_current[i]
+        current_q[b[1]] = b[2] + gamma * np.amax(q_future[i])
+        x[i] = b[0]
+        y[i] = current_q
+    model.train_batch(x, y)
+
+
+def measure(config, iterations, chunk, jit_compile):
+    """
+    Returns replay iterations per second, chunk=0 stands for the legacy model.fit path
+    """
+    model = TrainModel(
+        config['num_layers'],
+        config['width_layers'],
+        config['batch_size'],
+        config['learning_rate'],
+        config['num_states'],
+        config['num_actions'],
+        config['optimizer'],
+        jit_compile
+    )
+    memory = Memory(config['memory_size_max'], config['memory_size_min'])
+    fill_memory(memory, config['memory_size_max'], config['num_states'], config['num_actions'])
+
+    def run():
+        if chunk == 0:
+            for _ in range(iterations):
+                legacy_replay(model, memory, config['gamma'], config['num_states'], config['num_actions'])
+        else:
+            done = 0
+            while done < iterations:
+                n_batches = min(chunk, iterations - done)
+                model.train_replay(*memory.get_batches(model.batch_size, n_batches), config['gamma'])
+                done += n_batches
+
+    run()  # warm-up: tracing, compilation, optimizer slots
+    start_time = timeit.default_timer()
+    run()
+    return iterations / (timeit.default_timer() - start_time)
+
+
+if __name__ == "__main__":
+    config = import_train_configuration(config_file='settings/training_settings.ini')
+    iterations = config['training_epochs']
+    print("batch_size: {}, width_layers: {}, num_layers: {}, iterations: {}".format(
+        config['batch_size'], config['width_layers'], config['num_layers'], iterations))
+
+    memory = Memory(config['memory_size_max'], config['memory_size_min'])
+    fill_memory(memory, config['memory_size_max'], config['num_states'], config['num_actions'])
+    unpacked_bytes = config['memory_size_max'] * 2 * config['num_states'] * np.dtype(float).itemsize
+    print("memory of {} samples: {:.1f} MB as float64 state pairs, {:.2f} MB packed ({:.0f}x smaller)".format(
+        config['memory_size_max'], unpacked_bytes / 2 ** 20, memory.nbytes / 2 ** 20, unpacked_bytes / memory.nbytes))
+
+    with open("benchmark/replay_speed.txt", 'a') as f:
+        for name, chunk, jit_compile in [("model.fit", 0, False),
+                                         ("compiled, chunk {}".format(config['replay_chunk']), config['replay_chunk'], False),
+                                         ("compiled + XLA, chunk {}".format(config['replay_chunk']), config['replay_chunk'], True)]:
+            speed = measure(config, iterations, chunk, jit_compile)
+            print("{}: {:.1f} replay iterations/s".format(name, speed))
+            f.write("{}, {}, {}, {}: {:.1f} it/s\n".format(
+                config['batch_size'], config['width_layers'], config['num_layers'], name, speed))
@@ -0,0 +1,159 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import csv
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import timeit
+from collections import defaultdict
+
+import numpy as np
+
+from src.generator import TrafficGenerator
+from src.scaling import TraciMeter
+from src.telemetry import DECISION, TelemetryLog, TelemetryReader
+from src.utils import import_test_configuration, set_sumo
+from src.visualization import Visualization
+
+RESULTS_FILE = os.path.join('benchmark', 'scaling.csv')
+COLUMNS = ['controller', 'n_cars', 'max_steps', 'wall_s', 'steps_per_s', 'traci_calls_per_step', 'sumo_share',
+           'python_s', 'decisions', 'latency_p50_ms', 'latency_p99_ms', 'latency_max_ms', 'python_peak_rss_mb',
+           'sumo_peak_rss_mb', 'total_delay']
+PLOTS = [('steps_per_s', 'simulation steps per second'), ('traci_calls_per_step', 'TraCI calls per step'),
+         ('sumo_share', 'share of the wall time in sumo and TraCI'), ('latency_p99_ms', 'p99 decision latency (ms)'),
+         ('python_peak_rss_mb', 'peak RSS of python (MB)'), ('sumo_peak_rss_mb', 'peak RSS of sumo (MB)')]
+
+
+def _simulation(controller, config, traffic_gen, sumo_cmd, max_steps, telemetry):
+    """
+    Returns the simulation of the STL benchmark or of the tested model
+    """
+    if controller == 'stl':  # phase by phase and polled, the load the agent puts on TraCI
+        from src.benchmark_stl import Simulation
+        return Simulation(traffic_gen, sumo_cmd, max_steps, config['green_duration'], config['yellow_duration'],
+                          config['num_states'], config['num_actions'], native_stl=False, Telemetry=telemetry)
+    from src.model import TestModel  # tensorflow is only needed by the dqn controller
+    from src.observation import ObservationSpec
+    from src.testing_simulation import Simulation
+    from src.utils import set_test_path
+    model_path, _ = set_test_path(config['models_path_name'], config['model_to_test'])
+    return Simulation(TestModel(input_dim=config['num_states'], model_path=model_path), traffic_gen, sumo_cmd,
+                      max_steps, config['green_duration'], config['yellow_duration'], config['num_states'],
+                      config['num_actions'], ObservationSpec(config['net_file'], config['cell_edges'],
+                                                             config['channels']),
+                      native_stl=False, Telemetry=telemetry)  # phase by phase as well
+
+
+def measure(controller, n_cars, max_steps, results):
+    """
+    Runs an episode of 'controller' in this process and puts its measures, or its error, into 'results',
+    a new process for every episode so that the peak memory is its own
+    """
+    try:
+        results.put(_measure(controller, n_cars, max_steps))
+    except (Exception, SystemExit) as error:  # a missing model or tensorflow fails only the dqn controller
+        results.put({'error': "{}: {}".format(type(error).__name__, error)})
+
+
+def _measure(controller, n_cars, max_steps):
+    config = import_test_configuration(config_file='settings/testing_settings.ini')
+    work_dir = tempfile.mkdtemp(prefix='scaling_')
+    route_file = os.path.join(work_dir, 'episode_routes.rou.xml')
+    sumo_cmd = set_sumo(False, config['sumocfg_file_name'], max_steps, route_file)
+    telemetry = TelemetryLog(os.path.join(work_dir, 'telemetry.bin'))
+    simulation = _simulation(controller, config, TrafficGenerator(max_steps, n_cars, route_file), sumo_cmd,
+                             max_steps, telemetry)
+
+    with TraciMeter() as meter:
+        start_time = timeit.default_timer()
+        simulation.run(config['episode_seed'])
+        wall = timeit.default_timer() - start_time
+    telemetry.close()
+
+    reader = TelemetryReader(telemetry.path)
+    latencies = []
+    records = reader.poll()
+    while len(records):  # only the decisions are kept, the log of a long episode holds a record per step
+        latencies.append(records['latency_ms'][records['kind'] == DECISION])
+        records = reader.poll()
+    latencies = np.concatenate(latencies) if latencies else np.zeros(0)
+    shutil.rmtree(work_dir)
+
+    return {'controller': controller, 'n_cars': n_cars, 'max_steps': max_steps, 'wall_s': wall,
+            'steps_per_s': max_steps / wall, 'traci_calls_per_step': meter.calls / max_steps,
+            'sumo_share': meter.seconds / wall, 'python_s': wall - meter.seconds, 'decisions': len(latencies),
+            'latency_p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+            'latency_p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else 0.0,
+            'latency_max_ms': float(latencies.max()) if len(latencies) else 0.0,
+            'python_peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10,
+            'sumo_peak_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 2**10,
+            'total_delay': float(simulation.cumulative_total_wait())}
+
+
+def read_results():
+    """
+    Returns the rows of the results file, the last measure of every controller and load
+    """
+    if not os.path.isfile(RESULTS_FILE):
+        return []
+    rows = {}
+    with open(RESULTS_FILE) as f:
+        for row in csv.DictReader(f):
+            rows[(row['controller'], int(row['n_cars']), int(row['max_steps']))] = row
+    return [rows[key] for key in sorted(rows)]
+
+
+def plot(rows):
+    """
+    Plots every measure against the number of cars, a line per controller and episode length
+    """
+    visualization = Visualization('benchmark', dpi=96)
+    for metric, ylabel in PLOTS:
+        series = defaultdict(lambda: ([], []))
+        for row in rows:
+            x, y = series["{} {} steps".format(row['controller'], row['max_steps'])]
+            x.append(int(row['n_cars']))
+            y.append(float(row[metric]))
+        visualization.plot_series(dict(series), 'scaling_' + metric, 'Cars generated', ylabel, log_x=True)
+
+
+def _argument(name, default):
+    return sys.argv[sys.argv.index(name) + 1] if name in sys.argv else default
+
+
+if __name__ == "__main__":
+    # python scaling_benchmark.py [--controllers stl,dqn] [--cars 1000,...] [--steps 5400,...] [--plot-only]
+    # appends a row per controller and load to benchmark/scaling.csv and plots the measures of the whole file
+    controllers = _argument('--controllers', 'stl,dqn').split(',')
+    cars = [int(n) for n in _argument('--cars', '1000,2500,5000,10000,20000').split(',')]
+    steps = [int(n) for n in _argument('--steps', '5400,21600,86400').split(',')]
+    os.makedirs('benchmark', exist_ok=True)
+
+    if '--plot-only' not in sys.argv:
+        for controller in controllers:
+            for max_steps in steps:
+                for n_cars in cars:
+                    results = multiprocessing.Queue()
+                    process = multiprocessing.Process(target=measure, args=(controller, n_cars, max_steps, results))
+                    process.start()
+                    row = results.get()
+                    process.join()
+                    if 'error' in row:
+                        print("{}, {} cars, {} steps failed: {}".format(controller, n_cars, max_steps, row['error']))
+                        continue
+                    print("{controller}, {n_cars} cars, {max_steps} steps: {steps_per_s:.0f} steps/s, "
+                          "{traci_calls_per_step:.1f} TraCI calls/step, {sumo_share:.0%} in sumo, "
+                          "decision p99 {latency_p99_ms:.2f} ms, peak RSS python {python_peak_rss_mb:.0f} MB "
+                          "sumo {sumo_peak_rss_mb:.0f} MB".format(**row))
+                    new_file = not os.path.isfile(RESULTS_FILE)
+                    with open(RESULTS_FILE, 'a', newline='') as f:
+                        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+                        if new_file:
+                            writer.writeheader()
+                        writer.writerow({key: round(value, 4) if isinstance(value, float) else value
+                                         for key, value in row.items()})
+    plot(read_results())
@@ -0,0 +1,125 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import timeit
+
+import numpy as np
+
+from src.generator import TrafficGenerator
+from src.observation import ObservationSpec
+from src.snapshot import SnapshotCache
+from src.testing_simulation import Simulation
+from src.utils import import_test_configuration, set_sumo
+
+
+class RotationModel:
+    """
+    Stands in for a trained model: the benchmark measures simulation time, not the quality of the decisions
+    """
+    def __init__(self):
+        self._action = 0
+
+    def predict_one(self, state):
+        self._action = (self._action + 1) % 4
+        return np.eye(5)[[self._action]]
+
+
+class LookaheadSimulation(Simulation):
+    """
+    Simulation choosing the first 'lookahead_decisions' actions after the warm-up by simulating
+    every action for two decisions ahead and keeping the one with the shortest queues
+    """
+    def __init__(self, *args, lookahead_decisions=20, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lookahead_decisions = lookahead_decisions
+        self._last_action = -1
+        self._branches = 0
+        self._branch_time = 0
+
+    def _warm_up(self, episode, sumo_cmd):
+        self._last_action = super()._warm_up(episode, sumo_cmd)
+        return self._last_action
+
+    def _choose_action(self, state, allow_stl):
+        if self._lookahead_decisions > 0:
+            start_time = timeit.default_timer()
+            queue_lengths = self.evaluate_candidates([[action, action] for action in range(4)], self._last_action)
+            self._branch_time += timeit.default_timer() - start_time
+            self._branches += 4
+            self._lookahead_decisions -= 1
+            action = int(np.argmin(queue_lengths))
+        else:
+            action = super()._choose_action(state, allow_stl=False)
+        self._last_action = action
+        return action
+
+    @property
+    def branch_time(self):
+        """
+        Average time of a lookahead branch, restoring the simulation included
+        """
+        return self._branch_time / max(self._branches, 1)
+
+
+if __name__ == "__main__":
+    # warm-up simulation skipped through the snapshot cache, per model evaluated, and cost of a lookahead branch
+    config = import_test_configuration(config_file='settings/testing_settings.ini')
+    sumo_cmd = set_sumo(False, config['sumocfg_file_name'], config['max_steps'])
+    observation = ObservationSpec(config['net_file'], config['cell_edges'], config['channels'])
+    traffic_gen = TrafficGenerator(config['max_steps'], config['n_cars_generated'])
+    warmup_steps = config['warmup_steps'] or 1800
+    n_models = 3
+    episode_count = 3
+    snapshot_path = os.path.join('benchmark', 'snapshots')
+    os.makedirs('benchmark', exist_ok=True)
+
+    with open(os.path.join('benchmark', 'snapshots.txt'), 'a') as f:
+        snapshots = SnapshotCache(snapshot_path, config['snapshot_disk_mb'] * 2**20,
+                                  config['snapshot_memory_mb'] * 2**20)
+        for n in range(n_models):
+            warmup_time = 0
+            for i in range(episode_count):
+                simulation = Simulation(
+                    RotationModel(),
+                    traffic_gen,
+                    sumo_cmd,
+                    config['max_steps'],
+                    config['green_duration'],
+                    config['yellow_duration'],
+                    config['num_states'],
+                    config['num_actions'],
+                    observation,
+                    None,
+                    config['native_stl'],
+                    snapshots,
+                    warmup_steps
+                )
+                simulation.run(config['episode_seed'] + i)
+                warmup_time += simulation.warmup_time
+            line = "model {}: warm-up of {} steps in {:.2f} s per episode, snapshots loaded: {}, simulated: {}".format(
+                n + 1, warmup_steps, warmup_time / episode_count, snapshots.hits, snapshots.misses)
+            print(line)
+            f.write(line + "\n")
+
+        simulation = LookaheadSimulation(
+            RotationModel(),
+            traffic_gen,
+            sumo_cmd,
+            config['max_steps'],
+            config['green_duration'],
+            config['yellow_duration'],
+            config['num_states'],
+            config['num_actions'],
+            observation,
+            None,
+            config['native_stl'],
+            snapshots,
+            warmup_steps
+        )
+        simulation.run(config['episode_seed'])
+        line = "lookahead: {:.3f} s per branch of 2 decisions ({} steps or more)".format(
+            simulation.branch_time, 2 * config['green_duration'])
+        print(line)
+        f.write(line + "\n")
+        snapshots.close()
@@ -0,0 +1,76 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import timeit
+
+import numpy as np
+
+from src.generator import TrafficGenerator
+from src.model import TestModel, sparse_forward
+from src.observation import ObservationSpec
+from src.testing_simulation import Simulation
+from src.utils import import_test_configuration, set_sumo, set_test_path
+
+
+class StateRecorder:
+    """
+    Model keeping the states it is asked to predict, the decisions are taken by the dense model
+    """
+    def __init__(self, model):
+        self._model = model
+        self.states = []
+
+    def predict_one(self, state):
+        self.states.append(np.array(state))
+        return self._model.predict_one(state)
+
+
+def per_state(predict, states):
+    """
+    Returns the predictions of every state and the median seconds of a prediction
+    """
+    predictions, times = [], []
+    for state in states:
+        start_time = timeit.default_timer()
+        predictions.append(predict(state))
+        times.append(timeit.default_timer() - start_time)
+    return np.concatenate(predictions), float(np.median(times))
+
+
+if __name__ == "__main__":
+    # the decisions of the tested model on the states of its own episodes, through keras and through the sparse path
+    config = import_test_configuration(config_file='settings/testing_settings.ini')
+    model_path, _ = set_test_path(config['models_path_name'], config['model_to_test'])
+    observation = ObservationSpec(config['net_file'], config['cell_edges'], config['channels'])
+    model = TestModel(input_dim=config['num_states'], model_path=model_path)
+    sparse = sparse_forward(model._model, observation.is_binary)
+    kernels = [np.asarray(weights, dtype=np.float32) for weights in model._model.get_weights()]
+
+    def dense_numpy(state):  # the same numpy forward pass with the whole state, to separate the sparse gain
+        x = np.asarray(state, dtype=np.float32)[None, :]
+        for kernel, bias in zip(kernels[0:-2:2], kernels[1:-2:2]):
+            x = np.maximum(x @ kernel + bias, 0)
+        return x @ kernels[-2] + kernels[-1]
+
+    sumo_cmd = set_sumo(False, config['sumocfg_file_name'], config['max_steps'])
+    os.makedirs('benchmark', exist_ok=True)
+
+    with open(os.path.join('benchmark', 'sparse_input.txt'), 'a') as f:
+        for n_cars in [1000, 2500, 3500, 5000]:
+            recorder = StateRecorder(model)
+            Simulation(recorder, TrafficGenerator(config['max_steps'], n_cars), sumo_cmd, config['max_steps'],
+                       config['green_duration'], config['yellow_duration'], config['num_states'],
+                       config['num_actions'], observation, None, config['native_stl']).run(config['episode_seed'])
+            states = recorder.states
+            keras_q, keras_time = per_state(model.predict_one, states)
+            dense_q, dense_time = per_state(dense_numpy, states)
+            sparse_q, sparse_time = per_state(sparse.predict_one, states)
+            line = ("model {}, {} cars: {} states, {:.1f} of {} inputs non-zero, per decision keras {:.0f} us, "
+                    "dense numpy {:.1f} us, sparse {:.1f} us, max |q sparse - q keras| {:.2e}, "
+                    "same action {:.1%}").format(
+                config['model_to_test'], n_cars, len(states), np.mean([np.count_nonzero(s) for s in states]),
+                config['num_states'], keras_time * 1e6, dense_time * 1e6, sparse_time * 1e6,
+                np.abs(sparse_q - keras_q).max(), np.mean(sparse_q.argmax(axis=1) == keras_q.argmax(axis=1)))
+            print(line)
+            f.write(line + "\n")
@@ -0,0 +1,110 @@
+import multiprocessing
+import os
+import time
+
+from src.detectors import DetectorMeter
+from src.generator import TrafficGenerator
+from src.memory import Memory
+from src.model import TrainModel
+from src.observation import ObservationSpec
+from src.shared_transport import TransitionRing, WeightsBroadcast
+from src.training_simulation import Simulation
+from src.utils import set_sumo
+
+
+def _model(config, observation):
+    return TrainModel(config['num_layers'], config['width_layers'], config['batch_size'], config['learning_rate'],
+                      config['num_states'], config['num_actions'], config['optimizer'], config['jit_compile'],
+                      config['sparse_input'], observation.is_binary)
+
+
+def _actor(config, path, actor_id, n_actors, ring_name, weights_name, shapes, episodes_done):
+    """
+    Runs the episodes actor_id, actor_id + n_actors, ... of the session, each with the weights last published
+    by the learner, and writes their transitions into the ring 'ring_name'
+    """
+    observation = ObservationSpec(config['net_file'], config['cell_edges'], config['channels'])
+    model = _model(config, observation)
+    ring = TransitionRing(config['num_states'], binary=observation.is_binary, name=ring_name)
+    weights = WeightsBroadcast(shapes, name=weights_name)
+    route_file = os.path.join(path, 'episode_routes_{}.rou.xml'.format(actor_id))
+    detectors = None
+    if config['detectors']:
+        detectors = DetectorMeter(observation.network, os.path.join(path, 'detectors_{}.add.xml'.format(actor_id)))
+    sumo_cmd = set_sumo(False, config['sumocfg_file_name'], config['max_steps'], route_file,
+                        detectors.path if detectors else None)
+
+    # the ring takes the place of the memory, the actor does not train
+    simulation = Simulation(model, ring, TrafficGenerator(config['max_steps'], config['n_cars_generated'], route_file),
+                            sumo_cmd, config['gamma'], config['max_steps'], config['green_duration'],
+                            config['yellow_duration'], config['num_states'], config['num_actions'], 0,
+                            config['is_greedy'], config['replay_chunk'], None, observation, detectors,
+                            config['native_stl'], stl_threshold=config['stl_threshold'])
+    for episode in range(actor_id, config['total_episodes'], n_actors):
+        latest = weights.read()
+        if latest is not None:
+            model.set_weights(latest)
+        print('\n----- Actor', actor_id, '- episode', episode + 1, 'of', config['total_episodes'],
+              '- weights version', weights.version)
+        simulation.run(episode, 1.0 - episode / config['total_episodes'])
+        with episodes_done.get_lock():
+            episodes_done.value += 1
+    ring.close()
+    weights.close()
+
+
+def train(config, path, n_actors):
+    """
+    Trains a model with 'n_actors' simulation processes feeding the learner of this process through shared memory,
+    returns it once the learner trained on every episode
+
+    The learner runs training_epochs replay iterations per finished episode, draining the rings between chunks,
+    and publishes the weights after each episode for the next episodes of the actors
+    """
+    observation = ObservationSpec(config['net_file'], config['cell_edges'], config['channels'])
+    model = _model(config, observation)
+    memory = Memory(config['memory_size_max'], config['memory_size_min'], observation.is_binary)
+    shapes = [layer.shape for layer in model.get_weights()]
+    weights = WeightsBroadcast(shapes)
+    weights.publish(model.get_weights())
+    rings = [TransitionRing(config['num_states'], binary=observation.is_binary) for _ in range(n_actors)]
+    context = multiprocessing.get_context('spawn')  # tensorflow is not fork-safe
+    episodes_done = context.Value('i', 0)
+    actors = [context.Process(target=_actor, args=(config, path, i, n_actors, rings[i].name, weights.name, shapes,
+                                                    episodes_done))
+              for i in range(n_actors)]
+    for actor in actors:
+        actor.start()
+
+    trained = 0  # episodes the learner has trained on
+    try:
+        while trained < config['total_episodes']:
+            finished = episodes_done.value  # before draining, so that the finished episodes are in the memory
+            received = sum(ring.drain_into(memory) for ring in rings)
+            if finished > trained:
+                epochs_done = 0
+                while epochs_done < config['training_epochs']:
+                    n_batches = min(config['replay_chunk'], config['training_epochs'] - epochs_done)
+                    batches = memory.get_batches(model.batch_size, n_batches)
+                    if batches is not None:  # if the memory is full enough
+                        model.train_replay(*batches, config['gamma'])
+                    epochs_done += n_batches
+                    for ring in rings:  # the actors are not blocked on a full ring while the learner trains
+                        ring.drain_into(memory)
+                weights.publish(model.get_weights())
+                trained += 1
+                print('----- Learner trained on', trained, 'episodes,', memory.total_added, 'samples received')
+            elif received == 0:
+                if not any(actor.is_alive() for actor in actors) and episodes_done.value == trained:
+                    raise RuntimeError("The actors exited after {} of {} episodes".format(
+                        trained, config['total_episodes']))
+                time.sleep(0.01)
+    finally:
+        for actor in actors:
+            if trained < config['total_episodes']:
+                actor.terminate()
+            actor.join()
+        for ring in rings:
+            ring.close()
+        weights.close()
+    return model
@@ -0,0 +1,156 @@
+import asyncio
+
+import traci.constants as tc
+
+from src import benchmark_stl, testing_simulation
+from src.async_traci import AsyncConnection
+from src.episode_pipeline import set_route_file
+from src.stl_program import INCOMING_EDGES
+
+
+class STLSimulation(benchmark_stl.Simulation):
+    """
+    STL simulation driven through a non-blocking TraCI connection, to run many of them in one event loop,
+    each with its own route file
+    """
+    def __init__(self, traffic_gen, sumo_cmd, max_steps, green_duration, yellow_duration, num_states, num_actions,
+                 route_file):
+        super().__init__(traffic_gen, sumo_cmd, max_steps, green_duration, yellow_duration, num_states, num_actions)
+        self._route_file = route_file
+
+    async def run_async(self, episode):
+        """
+        Runs a single episode of the simulation with STL, the steps of the blocking run without its waiting times
+        """
+        self._TrafficGen.generate_routefile(seed=episode, route_file=self._route_file)
+        connection = await AsyncConnection.start(set_route_file(self._sumo_cmd, self._route_file))
+        try:
+            for edge_id in INCOMING_EDGES:
+                connection.subscribe_edge(edge_id, [tc.LAST_STEP_VEHICLE_HALTING_NUMBER])
+
+            self._step = 0
+            old_action = -1
+            self._queue_length_episode = []
+            self._reward_episode = []
+            while self._step < self._max_steps:
+                action = self._choose_action(self._step, old_action)
+
+                if self._step != 0 and old_action != action:
+                    connection.set_phase("TL", min(old_action, 3) * 2 + 1)
+                    await self._simulate_async(connection, self._yellow_duration)
+
+                connection.set_phase("TL", action * 2)
+                await self._simulate_async(connection, self._green_duration)
+
+                old_action = action
+        finally:  # sumo is closed also when the episode fails
+            await connection.close()
+
+    async def _simulate_async(self, connection, steps_todo):
+        """
+        Simulates intersection for 'steps_todo' steps, one round trip each
+        """
+        if (self._step + steps_todo) >= self._max_steps:
+            steps_todo = self._max_steps - self._step
+
+        while steps_todo > 0:
+            await connection.step()
+            self._step += 1
+            steps_todo -= 1
+            self._queue_length_episode.append(
+                sum(result[tc.LAST_STEP_VEHICLE_HALTING_NUMBER] for result in connection.edge_results().values()))
+
+
+class Simulation(testing_simulation.Simulation):
+    """
+    Testing simulation driven through a non-blocking TraCI connection, to run many of them in one event loop,
+    each with its own route file
+    """
+    def __init__(self, Model, TrafficGen, sumo_cmd, max_steps, green_duration, yellow_duration, num_states,
+                 num_actions, Observation, route_file, QCache=None):
+        super().__init__(Model, TrafficGen, sumo_cmd, max_steps, green_duration, yellow_duration, num_states,
+                         num_actions, Observation, QCache=QCache)
+        self._route_file = route_file
+
+    async def run_async(self, episode):
+        """
+        Runs a single episode of simulation, the decisions of the blocking run phase by phase,
+        without detectors, warm-up or native STL cycles
+        """
+        self._TrafficGen.generate_routefile(seed=episode, route_file=self._route_file)
+        connection = await AsyncConnection.start(set_route_file(self._sumo_cmd, self._route_file))
+        try:
+            connection.subscribe_simulation([tc.VAR_DEPARTED_VEHICLES_IDS])
+            for edge_id in INCOMING_EDGES:
+                connection.subscribe_edge(edge_id, [tc.LAST_STEP_VEHICLE_HALTING_NUMBER])
+
+            self._step = 0
+            self._queue_length_episode = []
+            self._reward_episode = []
+            old_action = -1
+            threshold = 0.75  # threshold for initiating STL cycle
+            while self._step < self._max_steps:
+                await connection.flush()  # the vehicles that departed in the last step
+                current_state = self._Observation.encode(connection.vehicle_results())[0]
+
+                allow_stl = self._Observation.occupied_share(current_state) >= threshold
+                action = self._choose_action(current_state, allow_stl=allow_stl)
+                if action != 4:
+                    if self._step != 0 and old_action != action:
+                        connection.set_phase("TL", min(old_action, 3) * 2 + 1)
+                        await self._simulate_async(connection, self._yellow_duration)
+
+                    connection.set_phase("TL", action * 2)
+                    await self._simulate_async(connection, self._green_duration)
+                    old_action = action
+                else:
+                    initial_step = self._step
+                    while self._step < (initial_step + 126) and self._step < self._max_steps:
+                        action = self._choose_stl_action(self._step - initial_step, old_action)
+                        if self._step != 0 and old_action != action:
+                            connection.set_phase("TL", min(old_action, 3) * 2 + 1)
+                            await self._simulate_async(connection, self._yellow_duration)
+                        connection.set_phase("TL", action * 2)
+                        await self._simulate_async(connection, self._green_duration)
+                        old_action = action
+                    old_action = 4
+        finally:  # sumo is closed also when the episode fails
+            await connection.close()
+
+    async def _simulate_async(self, connection, steps_todo):
+        """
+        Simulates 'steps_todo' steps, one round trip each, the departed vehicles subscribed with the next one
+        """
+        if (self._step + steps_todo) >= self._max_steps:
+            steps_todo = self._max_steps - self._step
+
+        variables = self._Observation.variables
+        while steps_todo > 0:
+            await connection.step()
+            for car_id in connection.simulation_results().get(tc.VAR_DEPARTED_VEHICLES_IDS, ()):
+                connection.subscribe_vehicle(car_id, variables)
+            self._step += 1
+            steps_todo -= 1
+            self._queue_length_episode.append(
+                sum(result[tc.LAST_STEP_VEHICLE_HALTING_NUMBER] for result in connection.edge_results().values()))
+
+
+def run_episodes(simulations, episodes):
+    """
+    Runs 'episodes' on the concurrent 'simulations', each taking the next episode when it finishes one,
+    returns the queue length series of every episode
+    """
+    async def run():
+        pending = list(episodes)
+        queue_lengths = {}
+
+        async def worker(simulation):
+            while pending:
+                episode = pending.pop(0)
+                await simulation.run_async(episode)
+                queue_lengths[episode] = simulation.queue_length_episode
+
+        await asyncio.gather(*(worker(simulation) for simulation in simulations))
+        return queue_lengths
+
+    return asyncio.run(run())
@@ -0,0 +1,159 @@
+import asyncio
+import struct
+
+import traci.constants as tc
+from sumolib.miscutils import getFreeSocketPort
+from traci.exceptions import FatalTraCIError, TraCIException
+from traci.storage import Storage
+
+# readers of the typed values of the subscribed variables
+_VALUE_READERS = {
+    tc.TYPE_INTEGER: lambda result: result.read("!i")[0],
+    tc.TYPE_DOUBLE: lambda result: result.read("!d")[0],
+    tc.TYPE_STRING: lambda result: result.readString(),
+    tc.TYPE_STRINGLIST: lambda result: result.readStringList(),
+    tc.TYPE_UBYTE: lambda result: result.read("!B")[0],
+    tc.TYPE_BYTE: lambda result: result.read("!b")[0],
+}
+_SUBSCRIBE_COMMANDS = {tc.CMD_SUBSCRIBE_VEHICLE_VARIABLE, tc.CMD_SUBSCRIBE_EDGE_VARIABLE, tc.CMD_SUBSCRIBE_SIM_VARIABLE}
+
+
+class AsyncConnection:
+    """
+    Class of a TraCI connection on a non-blocking socket, so that one event loop drives many sumo instances
+
+    Commands that do not return a value are queued and sent with the next simulation step, in a single message,
+    and the variable subscriptions come back with the step: a step costs one round trip
+    """
+    def __init__(self, process, reader, writer):
+        self._process = process
+        self._reader = reader
+        self._writer = writer
+        self._commands = bytearray()
+        self._queue = []  # ids of the queued commands
+        self._results = {}  # subscription response -> {object id: {variable: value}}
+
+    @classmethod
+    async def start(cls, sumo_cmd, retries=60):
+        """
+        Starts sumo with 'sumo_cmd' and returns the connection to it
+        """
+        port = getFreeSocketPort()
+        process = await asyncio.create_subprocess_exec(*sumo_cmd, "--remote-port", str(port),
+                                                       stdout=asyncio.subprocess.DEVNULL)
+        for _ in range(retries):
+            try:
+                reader, writer = await asyncio.open_connection("localhost", port)
+                return cls(process, reader, writer)
+            except OSError:
+                if process.returncode is not None:
+                    raise FatalTraCIError("sumo exited with code {}".format(process.returncode))
+                await asyncio.sleep(0.05)
+        process.kill()
+        raise FatalTraCIError("Could not connect to sumo on port {}".format(port))
+
+    def _add_command(self, command_id, content):
+        length = len(content) + 2
+        if length <= 255:
+            self._commands += struct.pack("!BB", length, command_id)
+        else:
+            self._commands += struct.pack("!BiB", 0, length + 4, command_id)
+        self._commands += content
+        self._queue.append(command_id)
+
+    @staticmethod
+    def _pack_string(value):
+        value = value.encode("utf8")
+        return struct.pack("!i", len(value)) + value
+
+    def _subscribe(self, command_id, object_id, variables):
+        content = struct.pack("!dd", tc.INVALID_DOUBLE_VALUE, tc.INVALID_DOUBLE_VALUE) + self._pack_string(object_id)
+        content += struct.pack("!B%dB" % len(variables), len(variables), *variables)
+        self._add_command(command_id, content)
+
+    def subscribe_vehicle(self, vehicle_id, variables):
+        self._subscribe(tc.CMD_SUBSCRIBE_VEHICLE_VARIABLE, vehicle_id, variables)
+
+    def subscribe_edge(self, edge_id, variables):
+        self._subscribe(tc.CMD_SUBSCRIBE_EDGE_VARIABLE, edge_id, variables)
+
+    def subscribe_simulation(self, variables):
+        self._subscribe(tc.CMD_SUBSCRIBE_SIM_VARIABLE, "", variables)
+
+    def set_phase(self, tl_id, index):
+        content = struct.pack("!B", tc.TL_PHASE_INDEX) + self._pack_string(tl_id)
+        self._add_command(tc.CMD_SET_TL_VARIABLE, content + struct.pack("!Bi", tc.TYPE_INTEGER, index))
+
+    async def _send(self):
+        """
+        Sends the queued commands in one message, returns the response positioned after the last status
+        """
+        self._writer.write(struct.pack("!i", len(self._commands) + 4) + bytes(self._commands))
+        queue = self._queue
+        self._commands = bytearray()
+        self._queue = []
+        length = struct.unpack("!i", await self._reader.readexactly(4))[0]
+        result = Storage(await self._reader.readexactly(length - 4))
+        for command_id in queue:
+            _, answered, status = result.read("!BBB")
+            description = result.readString()
+            if status or description:
+                raise TraCIException(description, answered, status)
+            if answered != command_id:
+                raise FatalTraCIError("Received answer {} for command {}".format(answered, command_id))
+            if command_id in _SUBSCRIBE_COMMANDS:
+                self._read_subscription(result)
+        return result
+
+    def _read_subscription(self, result):
+        result.readLength()
+        response = result.read("!B")[0]
+        object_id = result.readString()
+        values = self._results.setdefault(response, {}).setdefault(object_id, {})
+        for _ in range(result.read("!B")[0]):
+            variable, status = result.read("!BB")
+            value_type = result.read("!B")[0]
+            value = _VALUE_READERS[value_type](result)
+            if status:
+                raise TraCIException(value, response)
+            values[variable] = value
+
+    async def flush(self):
+        """
+        Sends the queued commands without a simulation step, e.g. subscriptions before reading the results
+        """
+        if self._queue:
+            await self._send()
+
+    async def step(self, time=0.):
+        """
+        Sends the queued commands and simulates one step, or up to 'time', then reads the subscription results
+        """
+        self._add_command(tc.CMD_SIMSTEP, struct.pack("!d", time))
+        result = await self._send()
+        self._results = {}
+        for _ in range(result.readInt()):
+            self._read_subscription(result)
+
+    def vehicle_results(self):
+        return self._results.get(tc.RESPONSE_SUBSCRIBE_VEHICLE_VARIABLE, {})
+
+    def edge_results(self):
+        return self._results.get(tc.RESPONSE_SUBSCRIBE_EDGE_VARIABLE, {})
+
+    def simulation_results(self):
+        return self._results.get(tc.RESPONSE_SUBSCRIBE_SIM_VARIABLE, {}).get("", {})
+
+    async def close(self):
+        """
+        Closes sumo, killed if the connection fails on the way, e.g. after an error in the middle of a step
+        """
+        try:
+            self._add_command(tc.CMD_CLOSE, b"")
+            await self._send()
+        except Exception:  # a reply left unread or sumo gone
+            if self._process.returncode is None:
+                self._process.kill()
+        finally:
+            self._writer.close()
+            await self._process.wait()
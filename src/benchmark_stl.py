@@ -6,7 +6,11 @@ import os
 from shutil import copyfile
 
 from src import visualization
+from src.eval_cache import EvaluationCache
 from src.generator import TrafficGenerator
+from src.stl_program import INCOMING_EDGES, QueueLog, add_additional, install_program, queue_totals, stl_schedule
+from src.telemetry import NO_EDGE_QUEUES, PhaseTrace
+from src.trip_output import TripLog
 from src.visualization import Visualization
 from src.utils import import_test_configuration, set_sumo, set_test_path
 
@@ -22,7 +26,8 @@ PHASE_EWL_YELLOW = 7
 
 
 class Simulation:
-    def __init__(self, traffic_gen, sumo_cmd, max_steps, green_duration, yellow_duration, num_states, num_actions):
+    def __init__(self, traffic_gen, sumo_cmd, max_steps, green_duration, yellow_duration, num_states, num_actions,
+                 native_stl=False, trip_output=False, Telemetry=None):
         self._TrafficGen = traffic_gen
         self._step = 0
         self._sumo_cmd = sumo_cmd
@@ -35,13 +40,32 @@ class Simulation:
         self._queue_length_episode = []
         self._waiting_times = {}
         self._total_wait_time = 0
+        self._native_stl = native_stl
+        self._trip_output = trip_output  # delays and queues written by sumo instead of polled at every step
+        self._queue_log = None
+        self._trip_stats = {}
+        self._Telemetry = Telemetry  # None keeps no per-step log
+        self._phase = -1
+        self._edge_queues = NO_EDGE_QUEUES
+        self._phase_trace = None  # phases of the steps whose queues are read from sumo, for the telemetry
 
     def run(self, episode):
         """
         Runs a single episode of the simulation with STL
         """
+        if self._native_stl:
+            return self._run_native(episode)
+
         self._TrafficGen.generate_routefile(seed=episode)
-        traci.start(self._sumo_cmd)
+        sumo_cmd = self._sumo_cmd
+        trip_log = None
+        if self._trip_output:
+            self._queue_log = QueueLog(INCOMING_EDGES, self._max_steps)
+            trip_log = TripLog(self._max_steps)
+            sumo_cmd = trip_log.add_output(add_additional(sumo_cmd, self._queue_log.path))
+            if self._Telemetry is not None:
+                self._phase_trace = PhaseTrace()
+        traci.start(sumo_cmd)
 
         self._step = 0
         self._waiting_times = {}
@@ -50,10 +74,18 @@ class Simulation:
         self._reward_episode = []
         self._total_wait_time = 0
         current_total_wait = 0
+        if self._Telemetry is not None:
+            self._Telemetry.begin(episode)
         while self._step < self._max_steps:
-            current_total_wait = self._collect_waiting_times()
+            old_total_wait = current_total_wait
+            if not self._trip_output:
+                current_total_wait = self._collect_waiting_times()
 
+            decision_time = timeit.default_timer()
             action = self._choose_action(self._step, old_action)
+            if self._Telemetry is not None:
+                self._Telemetry.decision(self._step, self._phase, action, old_total_wait - current_total_wait,
+                                         (timeit.default_timer() - decision_time) * 1000)
 
             if self._step != 0 and old_action != action:
                 if old_action == 4:
@@ -69,9 +101,66 @@ class Simulation:
 
         self._total_wait_time = current_total_wait
         traci.close()
+        if self._Telemetry is not None:
+            self._Telemetry.flush()
+        if trip_log is not None:
+            edge_queues = self._queue_log.read_edges()
+            self._queue_length_episode = queue_totals(edge_queues)
+            self._queue_log.close()
+            self._queue_log = None
+            self._log_steps(edge_queues)
+            self._trip_stats = trip_log.read()
+            trip_log.close()
 
         return 0
 
+    def _run_native(self, episode):
+        """
+        Runs a single episode with the STL cycle installed as a sumo program, simulated in a single call
+        and with the queue lengths aggregated by sumo
+        """
+        self._TrafficGen.generate_routefile(seed=episode)
+        queue_log = QueueLog(INCOMING_EDGES, self._max_steps)
+        sumo_cmd = add_additional(self._sumo_cmd, queue_log.path)
+        trip_log = None
+        if self._trip_output:
+            trip_log = TripLog(self._max_steps)
+            sumo_cmd = trip_log.add_output(sumo_cmd)
+        traci.start(sumo_cmd)
+
+        schedule, _ = stl_schedule(self._choose_action, self._max_steps, self._green_duration, self._yellow_duration)
+        install_program("TL", schedule)
+        if self._Telemetry is not None:
+            self._Telemetry.begin(episode)
+            self._phase_trace = PhaseTrace()
+            self._phase_trace.schedule(0, schedule)
+        traci.simulationStep(float(self._max_steps))
+        self._step = self._max_steps
+        traci.close()
+
+        edge_queues = queue_log.read_edges()
+        self._queue_length_episode = queue_totals(edge_queues)
+        self._log_steps(edge_queues)
+        self._reward_episode = []
+        self._total_wait_time = 0
+        queue_log.close()
+        if trip_log is not None:
+            self._trip_stats = trip_log.read()
+            trip_log.close()
+
+        return 0
+
+    def _log_steps(self, edge_queues):
+        """
+        Logs the step records of the episode from the queues aggregated by sumo
+        """
+        if self._Telemetry is None:
+            return
+        steps = np.arange(1, self._max_steps + 1)
+        self._Telemetry.steps(steps, self._phase_trace.phases(steps), edge_queues)
+        self._Telemetry.flush()
+        self._phase_trace = None
+
     def _simulate(self, steps_todo):
         """
         Simulates intersection for 'steps_todo' steps
@@ -83,8 +172,11 @@ class Simulation:
             traci.simulationStep()  # simulate 1 step in sumo
             self._step += 1  # update the step counter
             steps_todo -= 1
-            queue_length = self._get_queue_length()
-            self._queue_length_episode.append(queue_length)
+            if self._queue_log is None:  # otherwise read from the queue log at the end of the episode
+                queue_length = self._get_queue_length()
+                self._queue_length_episode.append(queue_length)
+                if self._Telemetry is not None:
+                    self._Telemetry.step(self._step, self._phase, queue_length, self._edge_queues)
 
     def _collect_waiting_times(self):
         """
@@ -123,6 +215,9 @@ class Simulation:
         """
         yellow_phase_code = old_action * 2 + 1  # obtain the yellow phase code, based on the old action (ref on environment.net.xml)
         traci.trafficlight.setPhase("TL", yellow_phase_code)
+        self._phase = yellow_phase_code
+        if self._phase_trace is not None:
+            self._phase_trace.set(self._step, self._phase)
 
     def _set_green_phase(self, action_number):
         """
@@ -136,6 +231,9 @@ class Simulation:
             traci.trafficlight.setPhase("TL", PHASE_EW_GREEN)
         elif action_number == 3:
             traci.trafficlight.setPhase("TL", PHASE_EWL_GREEN)
+        self._phase = action_number * 2
+        if self._phase_trace is not None:
+            self._phase_trace.set(self._step, self._phase)
 
     def _get_queue_length(self):
         """
@@ -146,6 +244,7 @@ class Simulation:
         halt_E = traci.edge.getLastStepHaltingNumber("E2TL")
         halt_W = traci.edge.getLastStepHaltingNumber("W2TL")
         queue_length = halt_N + halt_S + halt_E + halt_W
+        self._edge_queues = (halt_N, halt_S, halt_E, halt_W)  # for the telemetry of the step
         return queue_length
 
     def cumulative_total_wait(self):
@@ -155,6 +254,10 @@ class Simulation:
         """
         return np.sum(self._queue_length_episode)
 
+    @property
+    def trip_stats(self):
+        return self._trip_stats
+
     @property
     def queue_length_episode(self):
         return self._queue_length_episode
@@ -184,6 +287,8 @@ def make_benchmark(n_cars, episode_count, seed_shift):
         config['yellow_duration'],
         config['num_states'],
         config['num_actions'],
+        config['native_stl'],
+        config['trip_output']
     )
     plot_path = "benchmark"
 
@@ -193,11 +298,27 @@ def make_benchmark(n_cars, episode_count, seed_shift):
     )
     raw_data = []
     avg_delay = 0
+    trip_stats = []
+    cache = EvaluationCache()  # seeds already simulated with STL are read back
     for i in range(episode_count):
-        simulation.run(config['episode_seed'] + i + seed_shift)
-        raw_data.append(simulation.queue_length_episode)
-        delay = simulation.cumulative_total_wait()
+        seed = config['episode_seed'] + i + seed_shift
+        episode_key = cache.scenario_key(seed=seed, n_cars=n_cars, max_steps=config['max_steps'],
+                                         green_duration=config['green_duration'],
+                                         yellow_duration=config['yellow_duration'], detectors=config['detectors'],
+                                         native_stl=config['native_stl'], trip_output=config['trip_output'])
+        cached = cache.get('stl', episode_key)
+        if cached is None:
+            simulation.run(seed)
+            queue_lengths = simulation.queue_length_episode
+            delay = simulation.cumulative_total_wait()
+            cache.put('stl', episode_key, queue_lengths, delay)
+            if simulation.trip_stats:
+                trip_stats.append(simulation.trip_stats)
+        else:
+            queue_lengths, delay = cached
+        raw_data.append(queue_lengths)
         avg_delay += delay / episode_count
+    cache.close()
 
     to_graph_raw = []
     for i in range(episode_count):
@@ -217,3 +338,6 @@ def make_benchmark(n_cars, episode_count, seed_shift):
     with open("benchmark/total_delay.txt", 'a') as f:
         f.write("{}, {}, {}, resulted: {}\n".format(n_cars, episode_count, seed_shift, avg_delay))
     print('Average delay:', avg_delay)
+    if trip_stats:
+        print('Trips of the simulated episodes, averaged:',
+              {key: round(sum(stats[key] for stats in trip_stats) / len(trip_stats), 2) for key in trip_stats[0]})
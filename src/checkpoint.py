@@ -0,0 +1,130 @@
+import os
+import pickle
+import random
+import re
+import shutil
+import timeit
+
+import numpy as np
+
+from src.experience import ExperienceStore, warm_start
+
+
+class Checkpointer:
+    """
+    Class of periodic training checkpoints: model weights, optimizer slots, replay memory, RNG state and episode
+
+    The replay memory is appended to a log of transitions, so each checkpoint only writes the samples added since
+    the previous one. Once the log holds twice the memory, a new log is written with the memory alone and replaces
+    it. state.pkl is replaced atomically after everything else is on disk and is the commit point
+    """
+    def __init__(self, path, Model, Memory, num_states, memory_size_max, binary=True, Experience=None):
+        self._path = os.path.join(path, 'checkpoint', '')
+        self._Model = Model
+        self._Memory = Memory
+        self._Experience = Experience  # the store the session records into, rolled back to the checkpoint
+        self._memory_size_max = memory_size_max
+        self._num_states = num_states
+        self._binary = binary
+        os.makedirs(self._path, exist_ok=True)
+        state = self._read_state()
+        self._generation = state.get('replay_generation', 0) if state else 0
+        for name in os.listdir(self._path):  # logs replaced, or written by a rotation that never committed
+            if re.fullmatch(r'replay(_\d+)?', name) and name != self._log_name(self._generation):
+                shutil.rmtree(os.path.join(self._path, name))
+        self._replay_log = self._open_log(self._generation)
+        self._saved_samples = 0  # samples of the memory already in the replay log
+
+    def save(self, episode, reward_store, cumulative_wait_store):
+        """
+        Writes a checkpoint taken after 'episode' episodes, returns the time it took
+        """
+        start_time = timeit.default_timer()
+
+        new_samples = self._Memory.total_added - self._saved_samples
+        replaced_log = None
+        if len(self._replay_log) + new_samples > 2 * self._memory_size_max:
+            replaced_log = self._replay_log
+            self._generation += 1
+            self._replay_log = self._open_log(self._generation)
+            new_samples = self._memory_size_max
+        self._append(self._Memory.get_latest(new_samples))
+        self._replay_log.flush()
+        self._saved_samples = self._Memory.total_added
+        if self._Experience is not None:
+            self._Experience.flush()
+
+        state = {
+            'episode': episode,
+            'model_checkpoint': self._Model.save_checkpoint(self._path),
+            'replay_generation': self._generation,
+            'replay_transitions': len(self._replay_log),
+            'experience_transitions': len(self._Experience) if self._Experience is not None else None,
+            'experience_writer': self._Experience.writer if self._Experience is not None else None,
+            'python_random': random.getstate(),
+            'numpy_random': np.random.get_state(),
+            'reward_store': list(reward_store),
+            'cumulative_wait_store': list(cumulative_wait_store),
+        }
+        tmp_path = os.path.join(self._path, 'state.pkl.tmp')
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(self._path, 'state.pkl'))
+        if replaced_log is not None:
+            replaced_log.close()
+            shutil.rmtree(os.path.join(self._path, self._log_name(self._generation - 1)))
+
+        return round(timeit.default_timer() - start_time, 2)
+
+    def restore(self, reward_store, cumulative_wait_store):
+        """
+        Restores the last committed checkpoint into the model, the memory and the given stores,
+        returns the number of episodes already done (0 if there is no checkpoint)
+        """
+        state = self._read_state()
+        if state is None:
+            return 0
+
+        # relative to this checkpoint, which may have been copied from another session
+        self._Model.restore_checkpoint(self._path, os.path.join(self._path,
+                                                                os.path.basename(state['model_checkpoint'])))
+        self._replay_log.rollback(state['replay_transitions'])  # drop samples of a checkpoint that never committed
+        warm_start(self._Memory, self._replay_log, self._memory_size_max)
+        if self._Experience is not None and state.get('experience_writer') is not None:
+            # what the session recorded after the checkpoint is recorded again by the resumed episodes
+            if not self._Experience.rollback(state['experience_transitions'], state['experience_writer']):
+                print("Experience store {} was written by another session since the checkpoint, "
+                      "the transitions recorded after it are kept".format(self._Experience.path))
+        self._saved_samples = self._Memory.total_added  # everything in the memory is already in the replay log
+        random.setstate(state['python_random'])
+        np.random.set_state(state['numpy_random'])
+        reward_store.extend(state['reward_store'])
+        cumulative_wait_store.extend(state['cumulative_wait_store'])
+        return state['episode']
+
+    def close(self):
+        self._replay_log.close()
+
+    def _append(self, latest):
+        if latest is not None:
+            states, actions, rewards, next_states = latest
+            for i in range(len(actions)):
+                self._replay_log.add_sample((states[i], actions[i], rewards[i], next_states[i]))
+
+    def _open_log(self, generation):
+        # a checkpoint is resumed by a single process, a stale lock can only come from a crashed run
+        return ExperienceStore(os.path.join(self._path, self._log_name(generation)), mode='a',
+                               num_states=self._num_states, steal_lock=True, binary=self._binary)
+
+    def _read_state(self):
+        state_path = os.path.join(self._path, 'state.pkl')
+        if not os.path.isfile(state_path):
+            return None
+        with open(state_path, 'rb') as f:
+            return pickle.load(f)
+
+    @staticmethod
+    def _log_name(generation):
+        return 'replay_{}'.format(generation) if generation else 'replay'
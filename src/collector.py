@@ -0,0 +1,78 @@
+import traci
+
+from src import benchmark_stl
+
+
+class Simulation(benchmark_stl.Simulation):
+    """
+    STL simulation that records (state, action, reward, next_state) transitions into an experience store
+    """
+    def __init__(self, ExperienceStore, Observation, traffic_gen, sumo_cmd, max_steps, green_duration, yellow_duration,
+                 num_states, num_actions):
+        super().__init__(traffic_gen, sumo_cmd, max_steps, green_duration, yellow_duration, num_states, num_actions)
+        self._ExperienceStore = ExperienceStore
+        self._Observation = Observation
+
+    def _simulate(self, steps_todo):
+        """
+        Simulates intersection for 'steps_todo' steps, keeping the vehicle subscriptions of the observation
+        """
+        if (self._step + steps_todo) >= self._max_steps:
+            steps_todo = self._max_steps - self._step
+
+        while steps_todo > 0:
+            traci.simulationStep()  # simulate 1 step in sumo
+            self._Observation.subscribe_departed()
+            self._step += 1  # update the step counter
+            steps_todo -= 1
+            queue_length = self._get_queue_length()
+            self._queue_length_episode.append(queue_length)
+
+    def _get_state(self):
+        """
+        Returns 1-d array-state of the intersection according to the observation spec
+        """
+        return self._Observation.observe()[0]
+
+    def run(self, episode):
+        """
+        Runs a single episode of the simulation with STL, storing a transition per decision
+        """
+        self._TrafficGen.generate_routefile(seed=episode)
+        traci.start(self._sumo_cmd)
+
+        self._step = 0
+        self._waiting_times = {}
+        old_action = -1
+        old_state = None
+        old_total_wait = 0
+        self._queue_length_episode = []
+        self._reward_episode = []
+        n_samples = 0
+        while self._step < self._max_steps:
+            current_state = self._get_state()
+            current_total_wait = self._collect_waiting_times()
+            reward = old_total_wait - current_total_wait
+
+            if self._step != 0:
+                self._ExperienceStore.add_sample((old_state, old_action, reward, current_state))
+                n_samples += 1
+
+            action = self._choose_action(self._step, old_action)
+
+            if self._step != 0 and old_action != action:
+                self._set_yellow_phase(old_action)
+                self._simulate(self._yellow_duration)
+
+            self._set_green_phase(action)
+            self._simulate(self._green_duration)
+
+            old_state = current_state
+            old_action = action
+            old_total_wait = current_total_wait
+
+        self._total_wait_time = old_total_wait
+        traci.close()
+        self._ExperienceStore.flush()
+
+        return n_samples
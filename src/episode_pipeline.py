@@ -0,0 +1,113 @@
+import os
+import threading
+import timeit
+
+import traci
+
+
+def set_route_file(sumo_cmd, route_file):
+    """
+    Returns 'sumo_cmd' loading the routes of 'route_file' instead of the ones it loads
+    """
+    sumo_cmd = list(sumo_cmd)
+    if "-r" in sumo_cmd:
+        sumo_cmd[sumo_cmd.index("-r") + 1] = route_file
+    else:
+        sumo_cmd += ["-r", route_file]
+    return sumo_cmd
+
+
+class EpisodePipeline:
+    """
+    Class preparing the next training episode in the background, its routes generated and its sumo booted,
+    while the current episode is simulated and trained
+
+    The two route files alternate between the episodes, since sumo reads its routes while it simulates
+    """
+    def __init__(self, total_episodes, route_file=os.path.join('tlcs', 'episode_routes.rou.xml')):
+        self._total_episodes = total_episodes
+        directory, name = os.path.split(route_file)
+        base, extension = name.split('.', 1)
+        self._route_files = [os.path.join(directory, "{}_{}.{}".format(base, slot, extension)) for slot in range(2)]
+        self._slot = 0
+        self._thread = None
+        self._episode = None
+        self._result = None
+        self._error = None
+        self._wait_time = 0
+
+    def _next_route_file(self):
+        route_file = self._route_files[self._slot]
+        self._slot = 1 - self._slot
+        return route_file
+
+    @staticmethod
+    def _label(episode):
+        return 'episode_{}'.format(episode)
+
+    def prefetch(self, episode, prepare):
+        """
+        Runs prepare(episode, label, route_file) in the background, which generates the routes of 'episode'
+        and starts its sumo under 'label' without switching to it
+        """
+        if episode >= self._total_episodes:
+            return
+        self.discard()
+        route_file = self._next_route_file()
+
+        def run():
+            try:
+                self._result = prepare(episode, self._label(episode), route_file)
+            except Exception as e:  # raised again by start
+                self._error = e
+
+        self._episode = episode
+        self._result = None
+        self._error = None
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def start(self, episode, prepare):
+        """
+        Switches traci to the sumo of 'episode', waiting for it if it is still booting and starting it now
+        if it was not prefetched, returns what prepare returned
+        """
+        if self._thread is not None and self._episode == episode:
+            start_time = timeit.default_timer()
+            self._thread.join()
+            self._wait_time += timeit.default_timer() - start_time
+            self._thread = None
+            if self._error is not None:
+                raise self._error
+            result = self._result
+        else:
+            self.discard()
+            result = prepare(episode, self._label(episode), self._next_route_file())
+        traci.switch(self._label(episode))
+        return result
+
+    def discard(self):
+        """
+        Closes the prefetched sumo that no episode started, and what prepare returned for it
+        """
+        if self._thread is None:
+            return
+        self._thread.join()
+        self._thread = None
+        if self._error is None:
+            traci.getConnection(self._label(self._episode)).close()
+            if self._result is not None:
+                self._result.close()
+
+    def close(self):
+        self.discard()
+        for route_file in self._route_files:
+            if os.path.exists(route_file):
+                os.remove(route_file)
+
+    @property
+    def wait_time(self):
+        """
+        Time the episodes waited for their prefetched sumo
+        """
+        return self._wait_time
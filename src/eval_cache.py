@@ -0,0 +1,95 @@
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+
+import numpy as np
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# besides every module of src/, the files whose content changes the result of an evaluation episode
+DATA_FILES = ['tlcs/environment.net.xml', 'tlcs/sumo_config.sumocfg']
+
+
+def file_hash(path):
+    """
+    Returns the sha1 of the content of the file at 'path'
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def code_files():
+    """
+    Returns the absolute paths of the simulation code and network, wherever the process is started from
+    """
+    return (sorted(glob.glob(os.path.join(ROOT_PATH, 'src', '*.py')))
+            + [os.path.join(ROOT_PATH, path) for path in DATA_FILES])
+
+
+def code_version(files=None):
+    """
+    Returns a hash of the simulation code and network, so that changing them invalidates the cached results
+    """
+    digest = hashlib.sha1()
+    for path in code_files() if files is None else files:
+        if not os.path.isfile(path):
+            raise FileNotFoundError("Missing file of the code version: " + path)
+        digest.update(os.path.relpath(path, ROOT_PATH).encode())
+        digest.update(file_hash(path).encode())
+    return digest.hexdigest()[:16]
+
+
+class EvaluationCache:
+    """
+    Class of the sqlite cache of evaluation episodes, keyed by the model and scenario hashes,
+    holding the queue length series and the total delay of every episode
+    """
+    def __init__(self, path=os.path.join('test_results', 'evaluation_cache.db')):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("""CREATE TABLE IF NOT EXISTS episodes (
+            model TEXT, scenario TEXT, params TEXT, delay NUMERIC, queue_lengths BLOB, PRIMARY KEY (model, scenario))""")
+        self._connection.commit()
+        self._code_version = code_version()
+        self._hits = 0
+        self._misses = 0
+
+    def scenario_key(self, **params):
+        """
+        Returns the key of an episode of the scenario 'params', e.g. n_cars, seed, max_steps and durations
+        """
+        params = dict(params, code=self._code_version)
+        return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:20], json.dumps(params)
+
+    def get(self, model, scenario):
+        """
+        Returns the (queue lengths, delay) of the episode, None if it is not cached
+        """
+        row = self._connection.execute("SELECT queue_lengths, delay FROM episodes WHERE model = ? AND scenario = ?",
+                                       (model, scenario[0])).fetchone()
+        if row is None:
+            self._misses += 1
+            return None
+        self._hits += 1
+        return np.frombuffer(row[0], dtype=np.int32).tolist(), row[1]
+
+    def put(self, model, scenario, queue_lengths, delay):
+        self._connection.execute("INSERT OR REPLACE INTO episodes VALUES (?, ?, ?, ?, ?)",
+                                 (model, scenario[0], scenario[1], np.asarray(delay).item(),
+                                  np.asarray(queue_lengths, dtype=np.int32).tobytes()))
+        self._connection.commit()
+
+    def close(self):
+        self._connection.close()
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
@@ -0,0 +1,312 @@
+import json
+import os
+import random
+import uuid
+
+import numpy as np
+
+from src.memory import frame_size, frame_dtype, pack_states, unpack_states
+
+
+class ExperienceStore:
+    """
+    Class of an on-disk, memory-mapped transition dataset shared between simulation and training runs
+
+    Observations are kept once (bit-packed if binary), transitions reference them by index.
+    Rows are written past the committed ones and files never shrink, the number of committed rows lives in
+    meta.json which is replaced atomically, so any number of processes may map the store while a single writer
+    appends to it
+    """
+    _COLUMNS = {
+        'state_idx': np.int64,
+        'next_state_idx': np.int64,
+        'actions': np.int8,
+        'rewards': np.float64,
+    }
+
+    def __init__(self, path, mode='r', num_states=None, steal_lock=False, binary=True):
+        self._path = path
+        self._mode = mode
+        self._lock_path = os.path.join(path, 'writer.lock')
+        self._pending_frames = []
+        self._pending = {name: [] for name in self._COLUMNS}
+        self._last_packed = None
+        self._last_frame = -1
+        self._writer = None
+
+        if mode == 'a':
+            os.makedirs(path, exist_ok=True)
+            if steal_lock and os.path.isfile(self._lock_path) and not self._lock_held():
+                os.remove(self._lock_path)  # left by a writer that crashed
+            self._acquire_lock()
+            self._writer = uuid.uuid4().hex  # stamped on every commit, see rollback()
+            if not os.path.isfile(self._meta_path()):
+                if num_states is None:
+                    raise ValueError("num_states is required to create a new experience store")
+                self._write_meta({'num_states': num_states, 'binary': binary, 'n_frames': 0, 'n_transitions': 0})
+            self._meta = self._read_meta()
+        elif mode == 'r':
+            if not os.path.isfile(self._meta_path()):
+                raise FileNotFoundError("No experience store found at " + path)
+            self._meta = self._read_meta()
+        else:
+            raise ValueError("Unknown experience store mode: " + str(mode))
+
+        self._num_states = self._meta['num_states']
+        self._binary = self._meta.get('binary', True)
+        self._frame_size = frame_size(self._num_states, self._binary)
+        self._frame_dtype = frame_dtype(self._binary)
+        self._frame_bytes = self._frame_size * np.dtype(self._frame_dtype).itemsize
+        self._map()
+
+    def add_sample(self, sample):
+        """
+        Buffers a single transition, it becomes visible to readers after flush()
+        """
+        if self._mode != 'a':
+            raise IOError("Experience store is opened read-only")
+        state, action, reward, next_state = sample
+
+        packed_state = pack_states(state, self._binary).tobytes()
+        if packed_state == self._last_packed:
+            state_frame = self._last_frame  # the state is the next state of the previous transition
+        else:
+            state_frame = self._add_frame(packed_state)
+        self._last_packed = pack_states(next_state, self._binary).tobytes()
+        self._last_frame = self._add_frame(self._last_packed)
+
+        self._pending['state_idx'].append(state_frame)
+        self._pending['next_state_idx'].append(self._last_frame)
+        self._pending['actions'].append(action)
+        self._pending['rewards'].append(reward)
+
+    def flush(self):
+        """
+        Appends buffered transitions to the files and commits them
+        """
+        if self._mode != 'a' or not self._pending['actions']:
+            return
+
+        # past the committed rows, over any left by a crashed writer or a rollback
+        self._write_rows('frames', self._meta['n_frames'] * self._frame_bytes, b''.join(self._pending_frames))
+        for name, dtype in self._COLUMNS.items():
+            self._write_rows(name, self._meta['n_transitions'] * np.dtype(dtype).itemsize,
+                             np.array(self._pending[name], dtype=dtype).tobytes())
+
+        self._meta['n_frames'] += len(self._pending_frames)
+        self._meta['n_transitions'] += len(self._pending['actions'])
+        self._meta['writer'] = self._writer
+        self._write_meta(self._meta)
+        self._pending_frames = []
+        self._pending = {name: [] for name in self._COLUMNS}
+        self._map()
+
+    def rollback(self, n_transitions, writer=None):
+        """
+        Forgets committed transitions past the first 'n_transitions', frames are kept and the files are not shrunk,
+        readers may still map them
+
+        With 'writer', the store is only rolled back if every transition past them was committed by that writer,
+        e.g. the crashed session this one resumes, whose commits this writer then continues. Returns False if
+        the store was left as it is
+        """
+        if self._mode != 'a':
+            raise IOError("Experience store is opened read-only")
+        if writer is not None:
+            if len(self) < n_transitions or (len(self) > n_transitions and self._meta.get('writer') != writer):
+                return False  # another writer committed since
+            self._writer = writer
+        if len(self) > n_transitions:
+            self._meta['n_transitions'] = n_transitions
+            self._meta['writer'] = self._writer
+            self._write_meta(self._meta)
+            self._last_packed = None
+            self._map()
+        return True
+
+    def refresh(self):
+        """
+        Picks up transitions committed by the writer since the store was opened
+        """
+        self._meta = self._read_meta()
+        self._map()
+
+    def close(self):
+        """
+        Flushes pending transitions and releases the writer lock
+        """
+        if self._mode == 'a':
+            self.flush()
+            os.remove(self._lock_path)
+            self._mode = 'r'
+
+    def get_batches(self, n, n_batches):
+        """
+        Returns n_batches independent batches of size n stacked into arrays
+        (states, actions, rewards, next_states), or None if the store is empty
+        """
+        if len(self) == 0:
+            return None
+
+        indices = np.array([random.sample(range(len(self)), min(n, len(self))) for _ in range(n_batches)])
+        try:
+            states, actions, rewards, next_states = self.get_range(indices)
+        except IndexError:  # rows rolled back and written again since the store was mapped
+            self.refresh()
+            return self.get_batches(n, n_batches)
+        return (states.astype(np.float32), actions.astype(np.int32), rewards.astype(np.float32),
+                next_states.astype(np.float32))
+
+    def get_range(self, indices):
+        """
+        Returns the unpacked (states, actions, rewards, next_states) of the transitions at the given indices
+        """
+        indices = np.asarray(indices)
+        states = unpack_states(self._frames[self._columns['state_idx'][indices]], self._num_states, self._binary)
+        next_states = unpack_states(self._frames[self._columns['next_state_idx'][indices]], self._num_states,
+                                    self._binary)
+        return (states, np.array(self._columns['actions'][indices]), np.array(self._columns['rewards'][indices]),
+                next_states)
+
+    def _add_frame(self, packed):
+        """
+        Buffers a packed observation and returns its global frame index
+        """
+        self._pending_frames.append(packed)
+        return self._meta['n_frames'] + len(self._pending_frames) - 1
+
+    def _map(self):
+        """
+        Memory-maps the committed part of every file
+        """
+        self._frames = self._memmap('frames', self._frame_dtype, (self._meta['n_frames'], self._frame_size))
+        self._columns = {name: self._memmap(name, dtype, (self._meta['n_transitions'],))
+                         for name, dtype in self._COLUMNS.items()}
+
+    def _memmap(self, name, dtype, shape):
+        if shape[0] == 0:
+            return np.zeros(shape, dtype=dtype)  # numpy cannot map an empty file
+        return np.memmap(self._file_path(name), dtype=dtype, mode='r', shape=shape)
+
+    def _write_rows(self, name, offset, data):
+        fd = os.open(self._file_path(name), os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            os.pwrite(fd, data, offset)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _lock_held(self):
+        """
+        Returns whether the process that wrote the writer lock is still running
+        """
+        try:
+            with open(self._lock_path, 'r') as f:
+                pid = int(f.read())
+        except (OSError, ValueError):
+            return False  # gone, or the writer crashed before writing its pid
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass  # alive, run by another user
+        return True
+
+    def _acquire_lock(self):
+        try:
+            fd = os.open(self._lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            raise IOError("Experience store {} already has a writer, remove {} if it crashed".format(
+                self._path, self._lock_path))
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+
+    def _meta_path(self):
+        return os.path.join(self._path, 'meta.json')
+
+    def _file_path(self, name):
+        return os.path.join(self._path, name + '.bin')
+
+    def _read_meta(self):
+        with open(self._meta_path(), 'r') as f:
+            return json.load(f)
+
+    def _write_meta(self, meta):
+        tmp_path = self._meta_path() + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._meta_path())
+
+    def __len__(self):
+        return self._meta['n_transitions']
+
+    @property
+    def num_states(self):
+        return self._num_states
+
+    @property
+    def binary(self):
+        return self._binary
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def writer(self):
+        return self._writer
+
+
+def warm_start(memory, store, n_samples):
+    """
+    Fills the replay memory with the newest 'n_samples' transitions of the store
+    """
+    n_samples = min(n_samples, len(store))
+    if n_samples == 0:
+        return 0
+
+    states, actions, rewards, next_states = store.get_range(np.arange(len(store) - n_samples, len(store)))
+    for i in range(n_samples):
+        memory.add_sample((states[i], int(actions[i]), float(rewards[i]), next_states[i]))
+    return n_samples
+
+
+def pretrain(model, store, epochs, chunk, gamma):
+    """
+    Trains the model offline on the store, 'epochs' replay iterations of model.batch_size samples
+    """
+    epochs_done = 0
+    while epochs_done < epochs:
+        n_batches = min(chunk, epochs - epochs_done)
+        batches = store.get_batches(model.batch_size, n_batches)
+        if batches is None:
+            return 0
+        model.train_replay(*batches, gamma)
+        epochs_done += n_batches
+    return epochs_done
+
+
+def open_for_training(config, model, memory, resume=False):
+    """
+    Opens the experience store of a training config, warm-starts the memory and pretrains the model from it
+    (unless a checkpoint is resumed), returns the store to record new transitions into or None
+
+    With 'resume', the writer lock left by the interrupted session is taken over if its process is gone
+    """
+    if not config['experience_path']:
+        return None
+
+    # a resumed session takes over the lock of the crashed one, its checkpoint rolls back what it recorded after it
+    store = ExperienceStore(config['experience_path'], mode='a' if config['record_experience'] else 'r',
+                            num_states=config['num_states'], steal_lock=resume,
+                            binary=config['channels'] == ['occupancy'])
+    if resume:
+        return store if config['record_experience'] else None
+    n_samples = warm_start(memory, store, config['warm_start_samples'])
+    n_epochs = pretrain(model, store, config['pretrain_epochs'], config['replay_chunk'], config['gamma'])
+    print("Experience store {}: {} transitions, warm start with {}, pretrained for {} replay iterations".format(
+        config['experience_path'], len(store), n_samples, n_epochs))
+    return store if config['record_experience'] else None
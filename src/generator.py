@@ -1,20 +1,22 @@
 import numpy as np
 import math
+import os
 
 class TrafficGenerator:
-    def __init__(self, max_steps, n_cars_generated):
+    def __init__(self, max_steps, n_cars_generated, route_file=os.path.join('tlcs', 'episode_routes.rou.xml')):
         self._n_cars_generated = n_cars_generated  # car count per episode
         self._max_steps = max_steps
+        self._route_file = route_file
 
-    def generate_routefile(self, seed):
+    def generate_routefile(self, seed, route_file=None):
         """
-        Generates routefile for SUMO to use
+        Generates routefile for SUMO to use, by default the route file of the generator
         """
 
-        np.random.seed(seed)  # make tests reproducible
+        rng = np.random.RandomState(seed)  # make tests reproducible, without touching the global generator of numpy
 
         # the generation of cars is distributed according to a weibull distribution
-        timings = np.random.weibull(2, self._n_cars_generated)
+        timings = rng.weibull(2, self._n_cars_generated)
         # timings = np.random.uniform(0, 1, self._n_cars_generated)
         timings = np.sort(timings)
         np.interp(timings, (timings.min(), timings.max()), (0, self._max_steps))  # scale to [0; max_step]
@@ -31,7 +33,7 @@ class TrafficGenerator:
         car_gen_steps = np.rint(car_gen_steps)  # round to int -> effective steps when a car will be generated
 
         # produce the file for cars generation, one car per line
-        with open("tlcs/episode_routes.rou.xml", "w") as routes:
+        with open(route_file or self._route_file, "w") as routes:
             print("""<routes>
             <vType accel="1.0" decel="4.5" id="standard_car" length="5.0" minGap="2.5" maxSpeed="25" sigma="0.5" />
 
@@ -50,9 +52,9 @@ class TrafficGenerator:
 
             p = 0.75 # chance of going straight
             for car_counter, step in enumerate(car_gen_steps):
-                straight_or_turn = np.random.uniform()
+                straight_or_turn = rng.uniform()
                 if straight_or_turn < p:  # choose direction: straight or turn - with probability p the car goes straight
-                    route_straight = np.random.randint(1, 5)  # choose a random source & destination
+                    route_straight = rng.randint(1, 5)  # choose a random source & destination
                     if route_straight == 1:
                         print('    <vehicle id="W_E_%i" type="standard_car" route="W_E" depart="%s" departLane="random" departSpeed="10" />' % (car_counter, step), file=routes)
                     elif route_straight == 2:
@@ -62,7 +64,7 @@ class TrafficGenerator:
                     else:
                         print('    <vehicle id="S_N_%i" type="standard_car" route="S_N" depart="%s" departLane="random" departSpeed="10" />' % (car_counter, step), file=routes)
                 else:  # the car turns
-                    route_turn = np.random.randint(1, 9)  # choose random source source & destination
+                    route_turn = rng.randint(1, 9)  # choose random source source & destination
                     if route_turn == 1:
                         print('    <vehicle id="W_N_%i" type="standard_car" route="W_N" depart="%s" departLane="random" departSpeed="10" />' % (car_counter, step), file=routes)
                     elif route_turn == 2:
@@ -83,3 +85,7 @@ class TrafficGenerator:
             print("</routes>", file=routes)
         return timings
 
+
+    @property
+    def n_cars_generated(self):
+        return self._n_cars_generated
@@ -0,0 +1,386 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+from multiprocessing.connection import Client, Listener
+
+from src.eval_cache import file_hash
+from src.policy_server import parse_address
+
+# every message is a json object sent with send_bytes, the files of a message follow it as raw frames in the order
+# of its 'files' list, so that neither side unpickles what the other one sends
+
+
+def _send(connection, message, files=()):
+    """
+    Sends 'message' followed by the content of the local 'files' listed in it
+    """
+    connection.send_bytes(json.dumps(message).encode())
+    for path in files:
+        with open(path, 'rb') as f:
+            connection.send_bytes(f.read())
+
+
+def _receive(connection):
+    message = json.loads(connection.recv_bytes().decode())
+    files = [connection.recv_bytes() for _ in message.get('files', [])]
+    return message, files
+
+
+def _safe_path(root, name):
+    """
+    Returns the path of the stored file 'name' under 'root', refusing names that leave it
+    """
+    path = os.path.normpath(os.path.join(root, name))
+    if os.path.isabs(name) or not path.startswith(os.path.normpath(root) + os.sep):
+        raise ValueError("invalid file name: " + name)
+    return path
+
+
+class JobStore:
+    """
+    Class of the central store of the coordinator: the jobs with their leases and results in sqlite,
+    and the files uploaded by the workers under 'path'/files
+    """
+    def __init__(self, path):
+        self._files_path = os.path.join(path, 'files')
+        os.makedirs(self._files_path, exist_ok=True)
+        self._connection = sqlite3.connect(os.path.join(path, 'jobs.db'), check_same_thread=False)
+        self._connection.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT, payload TEXT, status TEXT, worker TEXT,
+            lease_expires REAL, attempts INTEGER, submitted REAL, finished REAL, result TEXT, error TEXT)""")
+        self._connection.commit()
+        self._lock = threading.Lock()
+
+    def submit(self, kind, payload):
+        with self._lock:
+            cursor = self._connection.execute(
+                "INSERT INTO jobs (kind, payload, status, attempts, submitted) VALUES (?, ?, 'pending', 0, ?)",
+                (kind, json.dumps(payload), time.time()))
+            self._connection.commit()
+            return cursor.lastrowid
+
+    def lease(self, worker, lease_seconds):
+        """
+        Returns the oldest pending job (id, kind, payload) leased to 'worker', or None
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT id, kind, payload FROM jobs WHERE status = 'pending' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            self._connection.execute(
+                "UPDATE jobs SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 "
+                "WHERE id = ?", (worker, time.time() + lease_seconds, row[0]))
+            self._connection.commit()
+            return row[0], row[1], json.loads(row[2])
+
+    def renew(self, job_id, worker, lease_seconds):
+        """
+        Extends the lease of 'worker' on a job, returns False if it lost it
+        """
+        with self._lock:
+            cursor = self._connection.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                (time.time() + lease_seconds, job_id, worker))
+            self._connection.commit()
+            return cursor.rowcount == 1
+
+    def complete(self, job_id, result, files):
+        """
+        Stores the result and the files {name: content} of a job, returns False if it was already done,
+        e.g. by the worker it was given to after the lease of a slow one expired
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None or row[0] == 'done':
+                return False
+            for name, content in files.items():
+                path = _safe_path(self._files_path, name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path + '.tmp', 'wb') as f:
+                    f.write(content)
+                os.replace(path + '.tmp', path)
+            self._connection.execute(
+                "UPDATE jobs SET status = 'done', finished = ?, result = ?, lease_expires = NULL WHERE id = ?",
+                (time.time(), json.dumps(result), job_id))
+            self._connection.commit()
+            return True
+
+    def fail(self, job_id, worker, error, max_attempts):
+        """
+        Puts a job that failed back in the queue, or marks it failed after 'max_attempts'
+        """
+        with self._lock:
+            self._connection.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts < ? THEN 'pending' ELSE 'failed' END, error = ?, "
+                "lease_expires = NULL WHERE id = ? AND worker = ? AND status = 'leased'",
+                (max_attempts, error, job_id, worker))
+            self._connection.commit()
+
+    def requeue_expired(self, max_attempts):
+        """
+        Puts the jobs whose lease expired, e.g. because their worker died, back in the queue, returns their number
+        """
+        with self._lock:
+            cursor = self._connection.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts < ? THEN 'pending' ELSE 'failed' END, "
+                "error = 'lease expired on ' || worker, lease_expires = NULL "
+                "WHERE status = 'leased' AND lease_expires < ?", (max_attempts, time.time()))
+            self._connection.commit()
+            return cursor.rowcount
+
+    def files(self, directory):
+        """
+        Returns the stored files under 'directory' as {name: local path}
+        """
+        root = _safe_path(self._files_path, directory)
+        files = {}
+        for parent, _, names in os.walk(root):
+            for name in names:
+                if not name.endswith('.tmp'):
+                    path = os.path.join(parent, name)
+                    files[os.path.relpath(path, self._files_path)] = path
+        return files
+
+    def counts(self):
+        with self._lock:
+            return dict(self._connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def results(self, kind=None):
+        """
+        Returns (id, kind, payload, status, worker, attempts, result, error) of every job, or of every job of 'kind'
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT id, kind, payload, status, worker, attempts, result, error FROM jobs "
+                "WHERE ? IS NULL OR kind = ? ORDER BY id", (kind, kind)).fetchall()
+        return [(job_id, job_kind, json.loads(payload), status, worker, attempts,
+                 json.loads(result) if result else None, error)
+                for job_id, job_kind, payload, status, worker, attempts, result, error in rows]
+
+    def close(self):
+        self._connection.close()
+
+
+class Coordinator:
+    """
+    Class of the service handing out the jobs of the store to the workers over a unix socket or tcp,
+    with leases the workers renew while they run a job
+    """
+    def __init__(self, address, store_path='jobs', lease_seconds=60, max_attempts=3):
+        self._address = parse_address(address)
+        if isinstance(self._address, str) and os.path.exists(self._address):
+            os.remove(self._address)  # left over by a coordinator that did not close
+        self._listener = Listener(self._address)
+        self._store = JobStore(store_path)
+        self._lease_seconds = lease_seconds
+        self._max_attempts = max_attempts
+        self._closed = False
+
+    def serve_forever(self):
+        """
+        Accepts workers in the background and requeues the expired leases until close is called
+        """
+        threading.Thread(target=self._accept, daemon=True).start()
+        while not self._closed:
+            n = self._store.requeue_expired(self._max_attempts)
+            if n:
+                print("{} expired leases requeued".format(n))
+            time.sleep(min(1.0, self._lease_seconds / 4))
+
+    def _accept(self):
+        while not self._closed:
+            try:
+                connection = self._listener.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    def _serve(self, connection):
+        """
+        Answers the requests of a worker or of a submitting script until it disconnects
+        """
+        try:
+            while True:
+                message, files = _receive(connection)
+                try:
+                    reply, reply_files = self._handle(message, files)
+                except Exception as e:
+                    reply, reply_files = {'error': str(e)}, []
+                _send(connection, reply, reply_files)
+        except (EOFError, OSError, ValueError):
+            connection.close()
+
+    def _handle(self, message, files):
+        """
+        Returns the reply to a request and the local paths of the files that follow it
+        """
+        op = message['op']
+        if op == 'submit':
+            return {'ids': [self._store.submit(job['kind'], job['payload']) for job in message['jobs']]}, []
+        if op == 'lease':
+            job = self._store.lease(message['worker'], self._lease_seconds)
+            if job is None:  # the leased jobs come back if their worker dies
+                return {'job': None, 'leased': self._store.counts().get('leased', 0)}, []
+            return {'job': {'id': job[0], 'kind': job[1], 'payload': job[2]},
+                    'lease_seconds': self._lease_seconds}, []
+        if op == 'renew':
+            return {'ok': self._store.renew(message['job'], message['worker'], self._lease_seconds)}, []
+        if op == 'complete':
+            return {'ok': self._store.complete(message['job'], message['result'],
+                                               dict(zip(message['files'], files)))}, []
+        if op == 'fail':
+            self._store.fail(message['job'], message['worker'], message['error'], self._max_attempts)
+            return {'ok': True}, []
+        if op == 'fetch':  # only the files the worker does not have with the same hash
+            stored = self._store.files(message['directory'])
+            have = message.get('have', {})
+            names = sorted(name for name, path in stored.items() if have.get(name) != file_hash(path))
+            return {'files': names, 'stored': len(stored)}, [stored[name] for name in names]
+        if op == 'status':
+            return {'counts': self._store.counts()}, []
+        if op == 'results':
+            return {'jobs': self._store.results(message.get('kind'))}, []
+        raise ValueError("unknown operation: " + str(op))
+
+    def close(self):
+        self._closed = True
+        self._listener.close()
+        self._store.close()
+        if isinstance(self._address, str) and os.path.exists(self._address):
+            os.remove(self._address)
+
+    @property
+    def store(self):
+        return self._store
+
+
+class CoordinatorClient:
+    """
+    Class of a connection to the coordinator, used by the workers and to submit jobs
+    """
+    def __init__(self, address, retries=50):
+        for attempt in range(retries):
+            try:
+                self._connection = Client(parse_address(address))
+                break
+            except (ConnectionRefusedError, FileNotFoundError):
+                if attempt == retries - 1:
+                    raise
+                time.sleep(0.1)
+
+    def request(self, message, files=()):
+        """
+        Sends a request with the local 'files' listed in message['files'], returns the reply and its files
+        """
+        _send(self._connection, message, files)
+        reply, reply_files = _receive(self._connection)
+        if 'error' in reply:
+            raise RuntimeError(reply['error'])
+        return reply, reply_files
+
+    def submit(self, jobs):
+        """
+        Queues the jobs [(kind, payload)], returns their ids
+        """
+        return self.request({'op': 'submit', 'jobs': [{'kind': kind, 'payload': payload}
+                                                      for kind, payload in jobs]})[0]['ids']
+
+    def status(self):
+        return self.request({'op': 'status'})[0]['counts']
+
+    def results(self, kind=None):
+        """
+        Returns [id, kind, payload, status, worker, attempts, result, error] of the jobs, or of the jobs of 'kind'
+        """
+        return self.request({'op': 'results', 'kind': kind})[0]['jobs']
+
+    def close(self):
+        self._connection.close()
+
+
+class Worker:
+    """
+    Class of a worker node, running the jobs leased from the coordinator with the runner of their kind,
+    a runner(Worker, payload) returns the result of a job and the local files {stored name: path} to upload
+    """
+    def __init__(self, address, runners, name=None):
+        self._address = address
+        self._runners = runners
+        self._name = name or "{}-{}".format(socket.gethostname(), os.getpid())
+        self._client = CoordinatorClient(address)
+        self._jobs_done = 0
+
+    def run(self, exit_when_empty=False, poll_interval=1.0):
+        """
+        Runs jobs until no job is pending or leased if 'exit_when_empty', forever otherwise,
+        returns the number of jobs done
+        """
+        while True:
+            reply, _ = self._client.request({'op': 'lease', 'worker': self._name})
+            job = reply['job']
+            if job is None:
+                if exit_when_empty and reply['leased'] == 0:
+                    return self._jobs_done
+                time.sleep(poll_interval)
+                continue
+            self._run_job(job, reply['lease_seconds'])
+
+    def _run_job(self, job, lease_seconds):
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._renew, args=(job['id'], lease_seconds, stop), daemon=True)
+        heartbeat.start()
+        try:
+            result, files = self._runners[job['kind']](self, job['payload'])
+        except Exception:
+            stop.set()
+            self._client.request({'op': 'fail', 'job': job['id'], 'worker': self._name,
+                                  'error': traceback.format_exc()})
+            print("job {} failed".format(job['id']))
+            return
+        stop.set()
+        names = sorted(files)
+        reply, _ = self._client.request({'op': 'complete', 'job': job['id'], 'worker': self._name, 'result': result,
+                                         'files': names}, [files[name] for name in names])
+        self._jobs_done += reply['ok']
+        print("job {} {}".format(job['id'], "done" if reply['ok'] else "already done by another worker"))
+
+    def _renew(self, job_id, lease_seconds, stop):
+        """
+        Renews the lease of the running job on its own connection
+        """
+        client = CoordinatorClient(self._address)
+        while not stop.wait(lease_seconds / 3):
+            client.request({'op': 'renew', 'job': job_id, 'worker': self._name})
+        client.close()
+
+    def fetch(self, directory, local_root='.'):
+        """
+        Downloads the stored files under 'directory' into 'local_root', except the ones it already has,
+        returns the number of stored files
+        """
+        local_root = os.path.abspath(local_root)
+        have = {}
+        for parent, _, names in os.walk(_safe_path(local_root, directory)):
+            for name in names:
+                path = os.path.join(parent, name)
+                have[os.path.relpath(path, local_root)] = file_hash(path)
+        reply, contents = self._client.request({'op': 'fetch', 'directory': directory, 'have': have})
+        for name, content in zip(reply['files'], contents):
+            path = _safe_path(local_root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(content)
+            os.replace(path + '.tmp', path)
+        return reply['stored']
+
+    def close(self):
+        self._client.close()
+
+    @property
+    def name(self):
+        return self._name
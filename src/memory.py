@@ -1,22 +1,103 @@
 import random
 
+import numpy as np
+
 
 class Memory:
     """
     Class of memory for Reinforcement Learning scheme
+
+    Every observation is stored once in a ring of frames, bit-packed if the states are binary,
+    transitions only keep the indices of their state and next state frames
     """
-    def __init__(self, size_max, size_min):
-        self._samples = []
+    def __init__(self, size_max, size_min, binary=True):
         self._size_max = size_max
         self._size_min = size_min
+        self._binary = binary
+        self._num_states = None
+        self._frames = None  # packed observations, at most two new frames per transition
+        self._last_frame = -1  # frame slot of the most recent next state, shared with the following transition
+        self._frame_head = 0
+        self._state_idx = np.zeros(size_max, dtype=np.int32)
+        self._next_state_idx = np.zeros(size_max, dtype=np.int32)
+        self._actions = np.zeros(size_max, dtype=np.int8)
+        self._rewards = np.zeros(size_max, dtype=np.float64)
+        self._start = 0  # slot of the oldest transition
+        self._size = 0
+        self._total_added = 0
 
     def add_sample(self, sample):
         """
         Adds a single sample to the memory, deleting if necessary
         """
-        self._samples.append(sample)
-        if self._size_now() > self._size_max:
-            self._samples.pop(0)  # if the length is greater than the size of memory, remove the oldest element
+        state, action, reward, next_state = sample
+        if self._frames is None:
+            self._num_states = len(state)
+            self._frames = np.zeros((2 * self._size_max, frame_size(self._num_states, self._binary)),
+                                    dtype=frame_dtype(self._binary))
+
+        packed_state = pack_states(state, self._binary)
+        if self._last_frame >= 0 and np.array_equal(self._frames[self._last_frame], packed_state):
+            state_frame = self._last_frame  # the state is the next state of the previous transition
+        else:
+            state_frame = self._add_frame(packed_state)
+        self._last_frame = self._add_frame(pack_states(next_state, self._binary))
+
+        if self._size < self._size_max:
+            slot = (self._start + self._size) % self._size_max
+            self._size += 1
+        else:
+            slot = self._start  # if the memory is full, overwrite the oldest element
+            self._start = (self._start + 1) % self._size_max
+        self._state_idx[slot] = state_frame
+        self._next_state_idx[slot] = self._last_frame
+        self._actions[slot] = action
+        self._rewards[slot] = reward
+        self._total_added += 1
+
+    def add_packed(self, states, actions, rewards, next_states, num_states):
+        """
+        Adds a batch of transitions whose states are already packed frames, e.g. views of a shared memory ring,
+        exactly like add_sample would add them one by one
+        """
+        if self._frames is None:
+            self._num_states = num_states
+            self._frames = np.zeros((2 * self._size_max, frame_size(num_states, self._binary)),
+                                    dtype=frame_dtype(self._binary))
+        for start in range(0, len(actions), self._size_max):  # a chunk never overwrites its own transitions
+            stop = start + self._size_max
+            self._add_packed_chunk(states[start:stop], actions[start:stop], rewards[start:stop],
+                                   next_states[start:stop])
+
+    def _add_packed_chunk(self, states, actions, rewards, next_states):
+        n = len(actions)
+        n_frames = len(self._frames)
+        # a state shared with the next state of the previous transition gets no frame of its own
+        previous = np.empty_like(next_states)
+        previous[1:] = next_states[:-1]
+        if self._last_frame >= 0:
+            previous[0] = self._frames[self._last_frame]
+        shared = np.all(states == previous, axis=1)
+        if self._last_frame < 0:
+            shared[0] = False
+        counts = 2 - shared
+        first = self._frame_head + np.cumsum(counts) - counts  # frame of the state, or where it would be
+        state_frame = np.where(shared, first - 1, first) % n_frames
+        next_frame = (first + 1 - shared) % n_frames
+        self._frames[state_frame[~shared]] = states[~shared]
+        self._frames[next_frame] = next_states
+        self._frame_head = (self._frame_head + int(counts.sum())) % n_frames
+        self._last_frame = int(next_frame[-1])
+
+        slots = (self._start + self._size + np.arange(n)) % self._size_max
+        overflow = max(0, self._size + n - self._size_max)
+        self._size = min(self._size_max, self._size + n)
+        self._start = (self._start + overflow) % self._size_max
+        self._state_idx[slots] = state_frame
+        self._next_state_idx[slots] = next_frame
+        self._actions[slots] = actions
+        self._rewards[slots] = rewards
+        self._total_added += n
 
     def get_samples(self, n):
         """
@@ -25,10 +106,100 @@ class Memory:
         if self._size_now() < self._size_min:
             return []
 
-        if n > self._size_now():
-            return random.sample(self._samples, self._size_now())  # get all the samples
-        else:
-            return random.sample(self._samples, n)  # get "batch size" number of samples
+        indices = self._sample_indices(n)
+        states, actions, rewards, next_states = self._gather(indices)
+        return [(states[i], int(actions[i]), float(rewards[i]), next_states[i]) for i in range(len(indices))]
+
+    def get_batches(self, n, n_batches):
+        """
+        Returns n_batches independent batches of size n (or max_size) stacked into arrays
+        (states, actions, rewards, next_states), or None if the memory is not full enough
+        """
+        if self._size_now() < self._size_min:
+            return None
+
+        indices = np.array([self._sample_indices(n) for _ in range(n_batches)])
+        states, actions, rewards, next_states = self._gather(indices)
+        return (states.astype(np.float32), actions.astype(np.int32), rewards.astype(np.float32),
+                next_states.astype(np.float32))
+
+    def get_latest(self, n):
+        """
+        Returns the newest n samples, oldest first, as arrays (states, actions, rewards, next_states)
+        """
+        n = min(n, self._size_now())
+        if n == 0:
+            return None
+        return self._gather(np.arange(self._size_now() - n, self._size_now()))
+
+    def _sample_indices(self, n):
+        """
+        Returns n distinct ages of samples, drawn exactly like random.sample over a list of the samples
+        """
+        return random.sample(range(self._size_now()), min(n, self._size_now()))
+
+    def _gather(self, indices):
+        """
+        Unpacks the transitions at the given ages (0 is the oldest) in one vectorized pass
+        """
+        slots = (self._start + np.asarray(indices)) % self._size_max
+        states = unpack_states(self._frames[self._state_idx[slots]], self._num_states, self._binary)
+        next_states = unpack_states(self._frames[self._next_state_idx[slots]], self._num_states, self._binary)
+        return states, self._actions[slots], self._rewards[slots], next_states
+
+    def _add_frame(self, packed):
+        """
+        Stores a packed observation and returns its frame slot
+        """
+        slot = self._frame_head
+        self._frames[slot] = packed
+        self._frame_head = (self._frame_head + 1) % len(self._frames)
+        return slot
 
     def _size_now(self):
-        return len(self._samples)
+        return self._size
+
+    @property
+    def total_added(self):
+        return self._total_added
+
+    @property
+    def nbytes(self):
+        """
+        Bytes held by the memory arrays
+        """
+        frames_bytes = self._frames.nbytes if self._frames is not None else 0
+        return (frames_bytes + self._state_idx.nbytes + self._next_state_idx.nbytes + self._actions.nbytes
+                + self._rewards.nbytes)
+
+
+def frame_size(num_states, binary):
+    """
+    Returns the number of frame elements holding one state
+    """
+    return (num_states + 7) // 8 if binary else num_states
+
+
+def frame_dtype(binary):
+    return np.uint8 if binary else np.float32
+
+
+def pack_states(states, binary):
+    """
+    Packs states (along the last axis) into frames, bits for binary states, float32 otherwise
+    """
+    states = np.asarray(states)
+    if not binary:
+        return states.astype(np.float32)
+    if np.any((states != 0) & (states != 1)):
+        raise ValueError("Binary memory got a non-binary state, use binary=False for multi-channel observations")
+    return np.packbits(states.astype(np.uint8), axis=-1)
+
+
+def unpack_states(frames, num_states, binary):
+    """
+    Unpacks frames (along the last axis) into float states
+    """
+    if not binary:
+        return frames.astype(float)
+    return np.unpackbits(frames, axis=-1, count=num_states).astype(float)
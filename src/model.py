@@ -5,23 +5,49 @@ os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'  # kill warning about tensorflow
 import numpy as np
 import sys
 
+import tensorflow as tf
 from tensorflow import keras
 from tensorflow.keras import layers
 from tensorflow.keras import losses
 from tensorflow.keras.optimizers import Adam, Adadelta
 from tensorflow.keras.models import load_model
 
+from src.sparse_model import SparseForward
+
+FIT_BATCH_SIZE = 32  # the batch size of model.fit, gradient steps per replay batch as in train_batch
+
+
+def sparse_forward(model, binary):
+    """
+    Returns the numpy forward pass of 'model' with a sparse first layer, None unless it is a stack of dense layers,
+    relu then linear, as the ones built by TrainModel
+    """
+    dense = [layer for layer in model.layers if layer.weights]
+    if not dense or not all(isinstance(layer, layers.Dense) and layer.use_bias for layer in dense):
+        return None
+    if any(layer.activation.__name__ != 'relu' for layer in dense[:-1]) or dense[-1].activation.__name__ != 'linear':
+        return None
+    return SparseForward(model.get_weights(), binary)
+
 
 class TrainModel:
     """
     Class of models used in training simulations
     """
-    def __init__(self, num_layers, width, batch_size, learning_rate, input_dim, output_dim, optimizer_name):
+    def __init__(self, num_layers, width, batch_size, learning_rate, input_dim, output_dim, optimizer_name,
+                 jit_compile=False, sparse_input=False, binary=True):
         self._input_dim = input_dim
         self._output_dim = output_dim
         self._batch_size = batch_size
         self._learning_rate = learning_rate
         self._model = self._build_model(num_layers, width, optimizer_name)
+        self._replay_step = self._build_replay_step(jit_compile)
+        self._checkpoint_manager = None
+        self._weights_version = 0  # changes with every update of the weights, so caches of predictions are dropped
+        self._sparse_input = sparse_input  # single states predicted in numpy from their non-zero inputs
+        self._binary = binary
+        self._sparse = None
+        self._sparse_version = -1  # weights version of the numpy copy
 
     def _build_model(self, num_layers, width, optimizer_name):
         """
@@ -43,10 +69,52 @@ class TrainModel:
 
         return model
 
+    def _build_replay_step(self, jit_compile):
+        """
+        Builds a compiled function that runs a whole stack of replay batches in a single call
+        """
+        model = self._model
+        output_dim = self._output_dim
+        signature = [
+            tf.TensorSpec([None, None, self._input_dim], tf.float32),  # states
+            tf.TensorSpec([None, None], tf.int32),  # actions
+            tf.TensorSpec([None, None], tf.float32),  # rewards
+            tf.TensorSpec([None, None, self._input_dim], tf.float32),  # next states
+            tf.TensorSpec([], tf.float32),  # gamma
+        ]
+
+        def replay_step(states, actions, rewards, next_states, gamma):
+            loss = tf.constant(0.0)
+            batch_size = tf.shape(states)[1]
+            for i in tf.range(tf.shape(states)[0]):
+                # same Bellman targets as the python replay, computed once per batch, then fitted in minibatches
+                # like model.fit does, but the weights change between batches inside the graph
+                q_future = model(next_states[i], training=False)
+                target = rewards[i] + gamma * tf.reduce_max(q_future, axis=1)
+                mask = tf.one_hot(actions[i], output_dim)
+                q_sa = model(states[i], training=False) * (1 - mask) + mask * target[:, None]
+                for start in tf.range(0, batch_size, FIT_BATCH_SIZE):
+                    with tf.GradientTape() as tape:
+                        q_current = model(states[i][start:start + FIT_BATCH_SIZE], training=True)
+                        loss = tf.reduce_mean(losses.mean_squared_error(q_sa[start:start + FIT_BATCH_SIZE], q_current))
+                    grads = tape.gradient(loss, model.trainable_variables)
+                    model.optimizer.apply_gradients(zip(grads, model.trainable_variables))
+            return loss
+
+        try:
+            return tf.function(replay_step, input_signature=signature, jit_compile=jit_compile)
+        except TypeError:  # tensorflow < 2.5 names the flag differently
+            return tf.function(replay_step, input_signature=signature, experimental_compile=jit_compile)
+
     def predict_one(self, state):
         """
         Make a prediction from 1-d array state
         """
+        if self._sparse_input:
+            if self._sparse_version != self._weights_version:  # the weights are copied again once trained
+                self._sparse = sparse_forward(self._model, self._binary)
+                self._sparse_version = self._weights_version
+            return self._sparse.predict_one(state)
         state = np.reshape(state, [1, self._input_dim])
         return self._model.predict(state)
 
@@ -61,6 +129,22 @@ class TrainModel:
         Train neural network on a batch of states(inputs) and targets(q_sa)
         """
         self._model.fit(states, q_sa, epochs=1, verbose=0)
+        self._weights_version += 1
+
+    def train_replay(self, states, actions, rewards, next_states, gamma):
+        """
+        Train neural network on a stack of replay batches, each fitted in minibatches of FIT_BATCH_SIZE like
+        train_batch, states and next_states have shape (n_batches, batch_size, input_dim)
+        """
+        loss = self._replay_step(
+            tf.convert_to_tensor(states, dtype=tf.float32),
+            tf.convert_to_tensor(actions, dtype=tf.int32),
+            tf.convert_to_tensor(rewards, dtype=tf.float32),
+            tf.convert_to_tensor(next_states, dtype=tf.float32),
+            tf.constant(gamma, dtype=tf.float32)
+        )
+        self._weights_version += 1
+        return float(loss)
 
     def save_model(self, path):
         """
@@ -68,6 +152,46 @@ class TrainModel:
         """
         self._model.save(os.path.join(path, 'trained_model.h5'))
 
+    def save_checkpoint(self, path):
+        """
+        Save weights and optimizer slots to a tensorflow checkpoint in 'path', returns the checkpoint prefix
+        """
+        return self._get_checkpoint_manager(path).save()
+
+    def restore_checkpoint(self, path, prefix=None):
+        """
+        Restore weights and optimizer slots from the checkpoint 'prefix' (by default the latest one) in 'path'
+        """
+        manager = self._get_checkpoint_manager(path)
+        manager.checkpoint.restore(prefix or manager.latest_checkpoint).assert_existing_objects_matched()
+        self._weights_version += 1
+
+    def get_weights(self):
+        """
+        Returns the list of weight arrays of the neural network
+        """
+        return self._model.get_weights()
+
+    def set_weights(self, weights):
+        """
+        Replaces the weights of the neural network, e.g. with the ones a learner broadcast
+        """
+        self._model.set_weights(weights)
+        self._weights_version += 1
+
+    def set_learning_rate(self, learning_rate):
+        """
+        Changes the learning rate of the optimizer, which a restored checkpoint would otherwise bring back
+        """
+        keras.backend.set_value(self._model.optimizer.learning_rate, learning_rate)
+        self._learning_rate = learning_rate
+
+    def _get_checkpoint_manager(self, path):
+        if self._checkpoint_manager is None:
+            checkpoint = tf.train.Checkpoint(model=self._model, optimizer=self._model.optimizer)
+            self._checkpoint_manager = tf.train.CheckpointManager(checkpoint, path, max_to_keep=2)
+        return self._checkpoint_manager
+
     @property
     def input_dim(self):
         return self._input_dim
@@ -80,14 +204,23 @@ class TrainModel:
     def batch_size(self):
         return self._batch_size
 
+    @property
+    def weights_version(self):
+        return self._weights_version
+
 
 class TestModel:
     """
     Class of models for testing
     """
-    def __init__(self, input_dim, model_path):
+    def __init__(self, input_dim, model_path, sparse_input=False, binary=True):
         self._input_dim = input_dim
         self._model = self._load_my_model(model_path)
+        self._sparse = None  # single states predicted in numpy from their non-zero inputs
+        if sparse_input:
+            self._sparse = sparse_forward(self._model, binary)
+            if self._sparse is None:
+                print("sparse_input ignored, the model is not a stack of dense layers:", model_path)
 
     @staticmethod
     def _load_my_model(model_folder_path):
@@ -106,9 +239,26 @@ class TestModel:
         """
         Make a prediction from 1-d array state
         """
+        if self._sparse is not None:
+            return self._sparse.predict_one(state)
         state = np.reshape(state, [1, self._input_dim])
         return self._model.predict(state)
 
+    def predict_batch(self, states):
+        """
+        Make predictions from 2-d array of states
+        """
+        return self._model.predict(states)
+
     @property
     def input_dim(self):
         return self._input_dim
+
+    @property
+    def nbytes(self):
+        nbytes = sum(weights.nbytes for weights in self._model.get_weights())
+        return nbytes + (self._sparse.nbytes if self._sparse is not None else 0)
+
+    @property
+    def weights_version(self):
+        return 0  # the weights of a test model never change
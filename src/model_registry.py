@@ -0,0 +1,90 @@
+import os
+import sys
+import timeit
+from collections import OrderedDict
+
+from src.eval_cache import file_hash
+from src.model import TestModel
+
+
+class ModelRegistry:
+    """
+    Class of the test models loaded by the process, kept in memory within a byte budget, least recently used evicted,
+    and reloaded when their file changes
+    """
+    def __init__(self, max_bytes=1024 * 2**20, sparse_input=False, binary=True):
+        self._max_bytes = max_bytes
+        self._sparse_input = sparse_input  # single states predicted in numpy from their non-zero inputs
+        self._binary = binary
+        self._models = OrderedDict()  # (model file, input_dim) -> [model, file hash, bytes], least recently used first
+        self._hashes = {}  # model file -> (mtime, file hash)
+        self._loads = 0
+        self._hits = 0
+        self._evictions = 0
+        self._load_time = 0
+
+    @staticmethod
+    def _model_file(model_path):
+        model_file = os.path.join(model_path, 'trained_model.h5')
+        if not os.path.isfile(model_file):
+            sys.exit("Model number not found")
+        return model_file
+
+    def hash(self, model_path):
+        """
+        Returns the sha1 of the model file in 'model_path', computed again only if its mtime changed
+        """
+        model_file = self._model_file(model_path)
+        mtime = os.path.getmtime(model_file)
+        if model_file not in self._hashes or self._hashes[model_file][0] != mtime:
+            self._hashes[model_file] = (mtime, file_hash(model_file))
+        return self._hashes[model_file][1]
+
+    def get(self, model_path, input_dim):
+        """
+        Returns the model in 'model_path', loaded on the first call and again if the file changed since
+        """
+        key = (self._model_file(model_path), input_dim)
+        digest = self.hash(model_path)
+        entry = self._models.get(key)
+        if entry is not None and entry[1] == digest:
+            self._models.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+        self._models.pop(key, None)
+        start_time = timeit.default_timer()
+        model = TestModel(input_dim=input_dim, model_path=model_path, sparse_input=self._sparse_input,
+                          binary=self._binary)
+        load_time = timeit.default_timer() - start_time
+        self._load_time += load_time
+        self._loads += 1
+        print("loaded {} in {:.2f} s".format(key[0], load_time))
+
+        nbytes = model.nbytes
+        while self._models and sum(entry[2] for entry in self._models.values()) + nbytes > self._max_bytes:
+            self._models.popitem(last=False)
+            self._evictions += 1
+        self._models[key] = [model, digest, nbytes]
+        return model
+
+    def stats(self):
+        return "model registry: {} loads in {:.1f} s, {} served from memory, {} evicted, {:.1f} MB held".format(
+            self._loads, self._load_time, self._hits, self._evictions, self.nbytes / 2**20)
+
+    @property
+    def nbytes(self):
+        return sum(entry[2] for entry in self._models.values())
+
+
+_registries = {}
+
+
+def get_registry(max_bytes=1024 * 2**20, sparse_input=False, binary=True):
+    """
+    Returns the registry of the process for these settings, created on their first call
+    """
+    key = (max_bytes, sparse_input, binary)
+    if key not in _registries:
+        _registries[key] = ModelRegistry(max_bytes, sparse_input, binary)
+    return _registries[key]
@@ -0,0 +1,138 @@
+import traci
+import traci.constants as tc
+import numpy as np
+import timeit
+
+
+class Simulation:
+    """
+    Simulation controlling every signalized intersection of a network with one batched policy inference per decision
+    """
+    def __init__(self, Model, TrafficGen, sumo_cmd, Observation, max_steps, green_duration, yellow_duration):
+        self._Model = Model
+        self._TrafficGen = TrafficGen  # None if the routes of the network are generated beforehand
+        self._Observation = Observation
+        self._Network = Observation.network
+        self._step = 0
+        self._sumo_cmd = sumo_cmd
+        self._max_steps = max_steps
+        self._green_duration = green_duration
+        self._yellow_duration = yellow_duration
+        self._queue_length_episode = []
+        self._observation_time = 0
+        self._inference_time = 0
+        self._decisions = 0
+
+    def run(self, episode):
+        """
+        Runs a single episode of simulation
+        """
+        start_time = timeit.default_timer()
+
+        if self._TrafficGen is not None:
+            self._TrafficGen.generate_routefile(seed=episode)
+        traci.start(self._sumo_cmd)
+        for edge_id in self._Network.incoming_edges:
+            traci.edge.subscribe(edge_id, [tc.LAST_STEP_VEHICLE_HALTING_NUMBER])
+
+        self._step = 0
+        self._queue_length_episode = []
+        self._observation_time = 0
+        self._inference_time = 0
+        self._decisions = 0
+        old_actions = np.full(len(self._Network.intersections), -1)
+        while self._step < self._max_steps:
+            observation_start = timeit.default_timer()
+            current_states = self._get_states()
+            inference_start = timeit.default_timer()
+            actions = self._choose_actions(current_states)
+            self._observation_time += inference_start - observation_start
+            self._inference_time += timeit.default_timer() - inference_start
+            self._decisions += 1
+
+            # intersections whose phase changes go through yellow, the others keep their green meanwhile
+            changed = (old_actions != actions) & (old_actions >= 0)
+            if self._step != 0 and changed.any():
+                for n in np.flatnonzero(changed):
+                    self._set_yellow_phase(n, old_actions[n])
+                self._simulate(self._yellow_duration)
+
+            for n, action in enumerate(actions):
+                self._set_green_phase(n, action)
+            self._simulate(self._green_duration)
+
+            old_actions = actions
+
+        traci.close()
+        simulation_time = round(timeit.default_timer() - start_time, 1)
+
+        return simulation_time
+
+    def _simulate(self, steps_todo):
+        """
+        Simulates 'steps_todo' steps
+        """
+        if (self._step + steps_todo) >= self._max_steps:
+            steps_todo = self._max_steps - self._step
+
+        while steps_todo > 0:
+            traci.simulationStep()  # simulate 1 step in sumo
+            self._Observation.subscribe_departed()
+            self._step += 1  # update the step counter
+            steps_todo -= 1
+            self._queue_length_episode.append(self._get_queue_length())
+
+    def _get_states(self):
+        """
+        Returns the states of all intersections, shape (n_intersections, num_states), in one pass over the vehicles
+        """
+        return self._Observation.observe()
+
+    def _choose_actions(self, states):
+        """
+        Chooses the best q-value action of every intersection with a single forward pass
+        """
+        q_values = self._Model.predict_batch(states)[:, :self._Network.num_actions]
+        q_values = np.where(self._Network.valid_actions, q_values, -np.inf)  # no STL cycle or missing phases
+        return np.argmax(q_values, axis=1)
+
+    def _set_yellow_phase(self, n, old_action):
+        """
+        Sets the yellow phase following the green of 'old_action' at intersection 'n'
+        """
+        intersection = self._Network.intersections[n]
+        if intersection.yellow_phases[old_action] is not None:
+            traci.trafficlight.setPhase(intersection.tl_id, intersection.yellow_phases[old_action])
+
+    def _set_green_phase(self, n, action_number):
+        """
+        Sets the green phase of 'action_number' at intersection 'n'
+        """
+        intersection = self._Network.intersections[n]
+        traci.trafficlight.setPhase(intersection.tl_id, intersection.green_phases[action_number])
+
+    def _get_queue_length(self):
+        """
+        Returns the current total queue length on the incoming edges of all intersections
+        """
+        results = traci.edge.getAllSubscriptionResults()
+        return sum(result[tc.LAST_STEP_VEHICLE_HALTING_NUMBER] for result in results.values())
+
+    def cumulative_total_wait(self):
+        """
+        Returns the sum of all waiting times throughout the episode
+        car in a queue = car is waiting -> queue_length = increment in waiting time per timestep.
+        """
+        return np.sum(self._queue_length_episode)
+
+    @property
+    def queue_length_episode(self):
+        return self._queue_length_episode
+
+    @property
+    def decision_timings(self):
+        """
+        Average observation and inference time per decision tick, in seconds
+        """
+        decisions = max(self._decisions, 1)
+        return self._observation_time / decisions, self._inference_time / decisions
@@ -0,0 +1,127 @@
+import math
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+
+class Intersection:
+    """
+    Class of a signalized intersection read from the net-file
+    """
+    def __init__(self, tl_id, incoming_edges, lane_groups, green_phases, yellow_phases):
+        self.tl_id = tl_id
+        self.incoming_edges = incoming_edges  # ordered clockwise starting from the west
+        self.lane_groups = lane_groups  # lane id -> group index, 2 groups per incoming edge
+        self.green_phases = green_phases  # phase index of every action
+        self.yellow_phases = yellow_phases  # phase index of the yellow that follows every action, or None
+
+    @property
+    def num_actions(self):
+        return len(self.green_phases)
+
+
+class Network:
+    """
+    Class of the signalized part of a SUMO network, parsed once from the net-file
+
+    Incoming edges of every intersection are ordered clockwise from the west, each split into a group of its
+    through lanes and a group of its leftmost lane, which is the lane layout of 'TL' in environment.net.xml
+    """
+    def __init__(self, net_file):
+        root = ET.parse(net_file).getroot()
+        junctions = {j.get('id'): (float(j.get('x')), float(j.get('y'))) for j in root.iter('junction')}
+        edges = {}
+        lane_lengths = {}
+        lane_speeds = {}
+        for edge in root.iter('edge'):
+            if edge.get('function') == 'internal':
+                continue
+            edges[edge.get('id')] = edge.get('from')
+            for lane in edge.iter('lane'):
+                lane_lengths[lane.get('id')] = float(lane.get('length'))
+                lane_speeds[lane.get('id')] = float(lane.get('speed'))
+
+        controlled = {}  # tl id -> incoming edge -> set of lane indices
+        for connection in root.iter('connection'):
+            tl_id = connection.get('tl')
+            if tl_id is None or connection.get('from') not in edges:
+                continue
+            lanes = controlled.setdefault(tl_id, {}).setdefault(connection.get('from'), set())
+            lanes.add(int(connection.get('fromLane')))
+
+        programs = {tl.get('id'): [phase.get('state') for phase in tl.iter('phase')] for tl in root.iter('tlLogic')}
+
+        self._intersections = []
+        for tl_id in sorted(controlled):
+            x, y = junctions[tl_id]
+
+            def clockwise_from_west(edge_id):
+                from_x, from_y = junctions[edges[edge_id]]
+                return (180 - math.degrees(math.atan2(from_y - y, from_x - x))) % 360
+
+            incoming_edges = sorted(controlled[tl_id], key=clockwise_from_west)
+            lane_groups = {}
+            for i, edge_id in enumerate(incoming_edges):
+                lane_indices = sorted(controlled[tl_id][edge_id])
+                for lane_index in lane_indices:
+                    is_left = len(lane_indices) > 1 and lane_index == lane_indices[-1]
+                    lane_groups[edge_id + '_' + str(lane_index)] = 2 * i + is_left
+
+            green_phases, yellow_phases = self._read_program(programs.get(tl_id, []))
+            self._intersections.append(Intersection(tl_id, incoming_edges, lane_groups, green_phases, yellow_phases))
+
+        self._num_groups = max(2 * len(i.incoming_edges) for i in self._intersections)
+        self._num_actions = max(i.num_actions for i in self._intersections)
+        self._lane_lengths = {lane_id: lane_lengths[lane_id] for i in self._intersections for lane_id in i.lane_groups}
+        self._lane_speeds = {lane_id: lane_speeds[lane_id] for i in self._intersections for lane_id in i.lane_groups}
+
+        # actions beyond the phases of an intersection are never chosen for it
+        self._valid_actions = np.zeros((len(self._intersections), self._num_actions), dtype=bool)
+        for n, intersection in enumerate(self._intersections):
+            self._valid_actions[n, :intersection.num_actions] = True
+
+    @staticmethod
+    def _read_program(states):
+        """
+        Returns the green phases of a program and the yellow phase following each of them
+        """
+        green_phases = []
+        yellow_phases = []
+        for index, state in enumerate(states):
+            if 'y' not in state and ('G' in state or 'g' in state):
+                green_phases.append(index)
+                next_state = states[(index + 1) % len(states)]
+                yellow_phases.append((index + 1) % len(states) if 'y' in next_state else None)
+        return green_phases, yellow_phases
+
+    @property
+    def intersections(self):
+        return self._intersections
+
+    @property
+    def incoming_edges(self):
+        return [edge_id for intersection in self._intersections for edge_id in intersection.incoming_edges]
+
+    @property
+    def num_groups(self):
+        """
+        Number of lane groups of the largest intersection
+        """
+        return self._num_groups
+
+    @property
+    def lane_lengths(self):
+        return self._lane_lengths
+
+    @property
+    def lane_speeds(self):
+        return self._lane_speeds
+
+    @property
+    def num_actions(self):
+        return self._num_actions
+
+    @property
+    def valid_actions(self):
+        return self._valid_actions
+
@@ -0,0 +1,141 @@
+import numpy as np
+import traci
+import traci.constants as tc
+
+from src.network import Network
+
+# upper bounds of the cells along a lane, in meters from the stop line, the last cell ends at the lane length
+CELL_EDGES = [7, 14, 21, 28, 40, 60, 100, 160, 400]
+CHANNELS = ['occupancy', 'count', 'speed', 'wait']
+
+
+class ObservationSpec:
+    """
+    Class of the observation of every intersection of a network, compiled once from the net-file and the settings
+
+    A state holds one block of cells per channel:
+    occupancy - 1 if a vehicle is in the cell, count - number of vehicles in the cell,
+    speed - mean speed in the cell relative to the lane speed limit, wait - accumulated waiting time in the cell.
+    With the default cells and the occupancy channel alone this is the 80-cell state the models were trained on
+    """
+    def __init__(self, net_file, cell_edges=CELL_EDGES, channels=('occupancy',)):
+        unknown = [channel for channel in channels if channel not in CHANNELS]
+        if unknown:
+            raise ValueError("Unknown observation channels: " + ", ".join(unknown))
+        if 'occupancy' not in channels and 'count' not in channels:
+            raise ValueError("The observation needs an occupancy or a count channel")
+
+        self._network = Network(net_file)
+        self._channels = list(channels)
+        self._cell_edges = np.array(sorted(cell_edges), dtype=float)
+        self._num_cells = len(self._cell_edges) + 1
+        self._cells = self._network.num_groups * self._num_cells  # cells of one channel of one intersection
+        self._num_states = len(self._channels) * self._cells
+
+        # flat per-lane tables, so that all vehicles are encoded with array operations
+        self._lane_row = {}
+        rows = []
+        for n, intersection in enumerate(self._network.intersections):
+            for lane_id, group in intersection.lane_groups.items():
+                self._lane_row[lane_id] = len(rows)
+                rows.append((n * self._cells + group * self._num_cells, self._network.lane_lengths[lane_id],
+                             self._network.lane_speeds[lane_id]))
+        rows = np.array(rows, dtype=float).reshape(-1, 3)
+        self._row_offset = rows[:, 0].astype(int)
+        self._row_length = rows[:, 1]
+        self._row_speed = rows[:, 2]
+
+        self._variables = [tc.VAR_LANE_ID, tc.VAR_LANEPOSITION]
+        if 'speed' in self._channels:
+            self._variables.append(tc.VAR_SPEED)
+        if 'wait' in self._channels:
+            self._variables.append(tc.VAR_ACCUMULATED_WAITING_TIME)
+
+    def observe(self):
+        """
+        Returns the states of all intersections from the subscribed vehicle data, shape (n_intersections, num_states)
+        """
+        return self.encode(traci.vehicle.getAllSubscriptionResults())
+
+    def encode(self, results):
+        """
+        Returns the states of all intersections from a dict vehicle id -> {variable: value}, in one vectorized pass
+        """
+        results = list(results.values())
+        n_vehicles = len(results)
+        n_intersections = len(self._network.intersections)
+
+        rows = np.fromiter((self._lane_row.get(r[tc.VAR_LANE_ID], -1) for r in results), dtype=int, count=n_vehicles)
+        valid = rows >= 0  # vehicles crossing the intersection or driving away from it are not observed
+        rows = rows[valid]
+        positions = np.fromiter((r[tc.VAR_LANEPOSITION] for r in results), dtype=float, count=n_vehicles)[valid]
+        cells = np.searchsorted(self._cell_edges, self._row_length[rows] - positions, side='right')
+        flat = self._row_offset[rows] + cells
+        size = n_intersections * self._cells
+        counts = np.bincount(flat, minlength=size).astype(float)
+
+        blocks = []
+        for channel in self._channels:
+            if channel == 'occupancy':
+                block = (counts > 0).astype(float)
+            elif channel == 'count':
+                block = counts
+            elif channel == 'speed':
+                speeds = np.fromiter((r[tc.VAR_SPEED] for r in results), dtype=float, count=n_vehicles)[valid]
+                sums = np.bincount(flat, weights=speeds / self._row_speed[rows], minlength=size)
+                block = np.divide(sums, counts, out=np.zeros(size), where=counts > 0)
+            else:
+                waits = np.fromiter((r[tc.VAR_ACCUMULATED_WAITING_TIME] for r in results), dtype=float,
+                                    count=n_vehicles)[valid]
+                block = np.bincount(flat, weights=waits, minlength=size)
+            blocks.append(block.reshape(n_intersections, self._cells))
+        return np.concatenate(blocks, axis=1)
+
+    def subscribe_departed(self):
+        """
+        Subscribes the vehicles that entered the network in the last step to the variables of the channels
+        """
+        for car_id in traci.simulation.getDepartedIDList():
+            traci.vehicle.subscribe(car_id, self._variables)
+
+    def subscribe_missing(self):
+        """
+        Subscribes every vehicle in the network that is not subscribed yet, after sumo skipped several steps
+        """
+        subscribed = traci.vehicle.getAllSubscriptionResults()
+        for car_id in traci.vehicle.getIDList():
+            if car_id not in subscribed:
+                traci.vehicle.subscribe(car_id, self._variables)
+
+    def subscribe_all(self):
+        """
+        Subscribes every vehicle in the network, after a simulation state was loaded
+        """
+        for car_id in traci.vehicle.getIDList():
+            traci.vehicle.subscribe(car_id, self._variables)
+
+    def occupied_share(self, state):
+        """
+        Returns the share of occupied cells of one intersection state
+        """
+        channel = self._channels.index('occupancy' if 'occupancy' in self._channels else 'count')
+        return np.mean(state[channel * self._cells:(channel + 1) * self._cells] > 0)
+
+    @property
+    def network(self):
+        return self._network
+
+    @property
+    def num_states(self):
+        return self._num_states
+
+    @property
+    def variables(self):
+        """
+        Vehicle variables the observation subscribes to
+        """
+        return list(self._variables)
+
+    @property
+    def is_binary(self):
+        return self._channels == ['occupancy']
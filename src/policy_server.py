@@ -0,0 +1,192 @@
+import os
+import queue
+import re
+import threading
+import time
+from multiprocessing.connection import AuthenticationError, Client, Listener
+
+import numpy as np
+
+# a request is b"<model id>\0" followed by the state as float32, a reply a status byte followed by the q-values
+# as float32 or by an error message, raw bytes so that the server never unpickles what a client sends
+OK = b'\0'
+ERROR = b'\1'
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '::1')  # served over tcp without an authkey
+
+
+def parse_address(address):
+    """
+    Returns the multiprocessing address of 'address', a unix socket path or 'host:port'
+    """
+    if ':' in address and not address.startswith('/'):
+        host, port = address.rsplit(':', 1)
+        return host, int(port)
+    return address
+
+
+class PolicyServer:
+    """
+    Class of the process serving the q-values of the models in 'models_path' over a unix socket or tcp,
+    coalescing the concurrent requests into one forward pass per model
+
+    With 'authkey', clients are authenticated with it, and without one tcp is only served on localhost
+    """
+    def __init__(self, address, input_dim, models_path='models', max_batch=256, max_wait=0.002,
+                 max_model_bytes=1024 * 2**20, authkey=''):
+        self._address = parse_address(address)
+        if not authkey and isinstance(self._address, tuple) and self._address[0] not in LOCAL_HOSTS:
+            raise ValueError("Serving on {} needs an authkey".format(address))
+        if isinstance(self._address, str) and os.path.exists(self._address):
+            os.remove(self._address)  # left over by a server that did not close
+        self._listener = Listener(self._address, authkey=authkey.encode() if authkey else None)
+        self._input_dim = input_dim
+        self._models_path = models_path
+        self._max_batch = max_batch
+        self._max_wait = max_wait  # seconds the first request of a batch waits for others
+        self._max_model_bytes = max_model_bytes
+        self._requests = queue.Queue()
+        self._closed = False
+        self._batches = 0
+        self._served = 0
+
+    def serve_forever(self):
+        """
+        Accepts clients in the background and answers their requests in batches until close is called
+        """
+        threading.Thread(target=self._accept, daemon=True).start()
+        while not self._closed:
+            try:
+                batch = [self._requests.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self._max_wait
+            while len(batch) < self._max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._serve_batch(batch)
+
+    def _accept(self):
+        while not self._closed:
+            try:
+                connection = self._listener.accept()
+            except AuthenticationError:
+                continue  # refused, the listener keeps accepting
+            except OSError:
+                break
+            threading.Thread(target=self._read, args=(connection,), daemon=True).start()
+
+    def _read(self, connection):
+        """
+        Queues the requests of a client until it disconnects, a malformed one with the error it is answered with,
+        so that the other requests batched with it are served and the replies keep their order
+        """
+        try:
+            while True:
+                message = connection.recv_bytes()
+                model_id, state = message.split(b'\0', 1)
+                if len(state) != 4 * self._input_dim:
+                    state = "state of {} bytes instead of {} float32".format(len(state), self._input_dim)
+                else:
+                    state = np.frombuffer(state, dtype=np.float32)
+                self._requests.put((model_id.decode(errors='replace'), state, connection))
+        except (EOFError, OSError, ValueError):
+            connection.close()
+
+    def _serve_batch(self, batch):
+        by_model = {}
+        for model_id, state, connection in batch:
+            by_model.setdefault(model_id, []).append((state, connection))
+        for model_id, requests in by_model.items():
+            states = [state for state, _ in requests if not isinstance(state, str)]
+            try:
+                q_values = iter(self._get_model(model_id).predict_batch(np.stack(states)) if states else [])
+                replies = [ERROR + state.encode() if isinstance(state, str)
+                           else OK + np.asarray(next(q_values), dtype=np.float32).tobytes()
+                           for state, _ in requests]
+            except (Exception, SystemExit) as e:  # TestModel exits on a missing model
+                replies = [ERROR + "model {}: {}".format(model_id, e).encode()] * len(requests)
+            for (_, connection), reply in zip(requests, replies):
+                try:
+                    connection.send_bytes(reply)
+                except OSError:
+                    pass  # the client is gone, its reader closes the connection
+        self._batches += 1
+        self._served += len(batch)
+
+    def _get_model(self, model_id):
+        """
+        Returns the model 'model_id', loaded on its first request and kept in the model registry of the process
+        """
+        # the id comes from any client that reaches the socket, only the model directories may be loaded
+        if not re.fullmatch(r'\d+', model_id):
+            raise ValueError("invalid model id")
+        models_path = os.path.realpath(self._models_path)
+        model_path = os.path.realpath(os.path.join(models_path, 'model_' + model_id))
+        if os.path.commonpath([models_path, model_path]) != models_path:
+            raise ValueError("model outside of " + self._models_path)
+        from src.model_registry import get_registry  # tensorflow is only needed by the server
+        return get_registry(self._max_model_bytes).get(model_path, self._input_dim)
+
+    def close(self):
+        self._closed = True
+        self._listener.close()
+        if isinstance(self._address, str) and os.path.exists(self._address):
+            os.remove(self._address)
+
+    @property
+    def batches(self):
+        return self._batches
+
+    @property
+    def served(self):
+        return self._served
+
+
+class PolicyClient:
+    """
+    Class of a connection to a policy server, used in place of TestModel
+    """
+    def __init__(self, address, model_id, input_dim, authkey=''):
+        self._connection = Client(parse_address(address), authkey=authkey.encode() if authkey else None)
+        self._model_id = str(model_id).encode() + b'\0'
+        self._input_dim = input_dim
+
+    def predict_one(self, state):
+        """
+        Make a prediction from 1-d array state
+        """
+        self._send(state)
+        return self._receive()[np.newaxis]
+
+    def predict_batch(self, states):
+        """
+        Make predictions from 2-d array of states, sent all at once so that the server batches them
+        """
+        for state in states:
+            self._send(state)
+        return np.stack([self._receive() for _ in states])
+
+    def _send(self, state):
+        self._connection.send_bytes(self._model_id + np.asarray(state, dtype=np.float32).tobytes())
+
+    def _receive(self):
+        reply = self._connection.recv_bytes()
+        if reply[:1] != OK:
+            raise RuntimeError(reply[1:].decode())
+        return np.frombuffer(reply[1:], dtype=np.float32)
+
+    def close(self):
+        self._connection.close()
+
+    @property
+    def input_dim(self):
+        return self._input_dim
+
+    @property
+    def weights_version(self):
+        return 0  # the server serves fixed test models
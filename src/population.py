@@ -0,0 +1,234 @@
+import configparser
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import time
+
+from src.sweep import Catalog, pin_cores
+
+# bounds of the hyperparameters that are mutated, the others are only clipped at 0
+_BOUNDS = {'agent.gamma': (0.0, 0.99), 'agent.stl_threshold': (0.0, 1.0)}
+
+
+def read_population(config_file):
+    """
+    Reads a population config, returns the [population] settings, the training config without it and the choices
+    of every comma-separated value, from which the initial members draw their hyperparameters
+    """
+    content = configparser.ConfigParser()
+    content.read(config_file)
+    section = content['population']
+    settings = {'name': section.get('name', fallback=os.path.splitext(os.path.basename(config_file))[0]),
+                'size': section.getint('size', fallback=8),
+                'workers': section.getint('workers', fallback=max(1, (os.cpu_count() or 1) // 2)),
+                'threads_per_worker': section.getint('threads_per_worker', fallback=1),
+                'ready_episodes': section.getint('ready_episodes', fallback=2),
+                'exploit_fraction': section.getfloat('exploit_fraction', fallback=0.25),
+                'perturb': [float(factor) for factor in section.get('perturb', fallback='0.8, 1.25').split(',')],
+                'mutable': [key.strip() for key in section.get(
+                    'mutable', fallback='agent.gamma, model.learning_rate, agent.stl_threshold').split(',')],
+                'seed': section.getint('seed', fallback=0),
+                'catalog': section.get('catalog', fallback=os.path.join('sweeps', 'catalog.db'))}
+
+    training = configparser.ConfigParser()
+    training.read_dict({name: dict(content[name]) for name in content.sections() if name != 'population'})
+    choices = {}
+    for name in training.sections():
+        for key, value in training[name].items():
+            options = [option.strip() for option in value.split(',')]
+            if len(options) > 1:
+                choices[name + '.' + key] = options
+    return settings, training, choices
+
+
+def perturb(params, mutable, factors, rng):
+    """
+    Returns a copy of 'params' where every mutable hyperparameter is scaled by one of 'factors'
+    """
+    params = dict(params)
+    for key in mutable:
+        if key not in params:
+            continue
+        low, high = _BOUNDS.get(key, (0.0, float('inf')))
+        value = min(high, max(low, float(params[key]) * rng.choice(factors)))
+        params[key] = '{:.6g}'.format(value)
+    return params
+
+
+class PopulationTrainer:
+    """
+    Runs population-based training: the members train in intervals on a shared pool of worker processes,
+    and after every interval the worst ones continue from a copy of a leader with perturbed hyperparameters
+    """
+    def __init__(self, config_file):
+        self._settings, self._training, self._choices = read_population(config_file)
+        self._catalog = Catalog(self._settings['catalog'])
+        self._path = os.path.join(os.path.dirname(self._settings['catalog']) or '.', self._settings['name'])
+        self._state_path = os.path.join(self._path, 'population.json')
+        self._total_episodes = self._training.getint('simulation', 'total_episodes')
+        os.makedirs(self._path, exist_ok=True)
+        self._state = self._load_state()
+        for member in range(self._settings['size']):
+            self._write_config(member)
+
+    def _load_state(self):
+        """
+        Returns the state of the population saved by an interrupted run, or draws the initial members
+        """
+        if os.path.isfile(self._state_path):
+            with open(self._state_path, 'r') as f:
+                return json.load(f)
+        rng = random.Random(self._settings['seed'])
+        members = [{'params': {key: rng.choice(options) for key, options in sorted(self._choices.items())},
+                    'episodes': 0, 'score': None, 'parent': None} for _ in range(self._settings['size'])]
+        return {'round': 0, 'members': members, 'cpu_seconds': 0.0}
+
+    def _save_state(self):
+        tmp_path = self._state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._state, f, indent=1)
+        os.replace(tmp_path, self._state_path)
+
+    def _member_path(self, member):
+        return os.path.join(self._path, 'member_{}'.format(member), '')
+
+    def _write_config(self, member):
+        """
+        Writes the training config of a member with its current hyperparameters
+        """
+        content = configparser.ConfigParser()
+        content.read_dict({name: dict(self._training[name]) for name in self._training.sections()})
+        for key, value in self._state['members'][member]['params'].items():
+            section, option = key.split('.', 1)
+            content[section][option] = value
+        content['memory']['record_experience'] = 'False'  # an experience store has a single writer
+        os.makedirs(self._member_path(member), exist_ok=True)
+        with open(os.path.join(self._member_path(member), 'member.ini'), 'w') as f:
+            content.write(f)
+
+    def run(self):
+        """
+        Trains the population until every member did all its episodes, returns the index of the best member
+        """
+        print("Population {}: {} members, {} episodes in intervals of {}, {} workers x {} threads".format(
+            self._settings['name'], self._settings['size'], self._total_episodes, self._settings['ready_episodes'],
+            self._settings['workers'], self._settings['threads_per_worker']))
+        start_time = time.time()
+        while any(member['episodes'] < self._total_episodes for member in self._state['members']):
+            self._run_interval()
+            self._exploit()
+            self._state['round'] += 1
+            self._save_state()
+        return self.summary(time.time() - start_time)
+
+    def _run_interval(self):
+        """
+        Trains every member up to the end of the current interval, as many at once as there are workers
+        """
+        target = min(self._total_episodes, (self._state['round'] + 1) * self._settings['ready_episodes'])
+        pending = [member for member, state in enumerate(self._state['members']) if state['episodes'] < target]
+        running = {}  # slot -> (member, key, process, start time, log file)
+        while pending or running:
+            for slot in range(self._settings['workers']):
+                if slot not in running and pending:
+                    member = pending.pop(0)
+                    running[slot] = self._launch(slot, member, target - self._state['members'][member]['episodes'])
+
+            time.sleep(1)
+            for slot, (member, key, process, member_start, log) in list(running.items()):
+                if process.poll() is None:
+                    continue
+                log.close()
+                del running[slot]
+                duration = time.time() - member_start
+                self._state['cpu_seconds'] += duration * self._settings['threads_per_worker']
+                state = self._state['members'][member]
+                metrics = self._read_metrics(member)
+                if process.returncode == 0 and metrics is not None:
+                    interval = metrics['delay'][state['episodes']:]
+                    metrics['score'] = sum(interval) / len(interval) if interval else None
+                    state['episodes'] = len(metrics['delay'])
+                    state['score'] = metrics['score']
+                    status = 'done'
+                else:
+                    state['episodes'] = target  # the interval is not trained again, the member ranks last
+                    state['score'] = None
+                    status = 'failed'
+                self._catalog.finish(key, status, round(duration, 1), metrics)
+                self._save_state()
+                print("Member {} {} interval {} in {} s, delay {}".format(
+                    member, status, self._state['round'], round(duration, 1), state['score']))
+
+    def _launch(self, slot, member, episodes):
+        """
+        Starts the process training 'member' for 'episodes' more episodes
+        """
+        state = self._state['members'][member]
+        key = '{}-{}-{}'.format(self._settings['name'], self._state['round'], member)
+        params = dict(state['params'], member=member, round=self._state['round'], parent=state['parent'])
+        path = self._member_path(member)
+        self._catalog.start(key, self._settings['name'], params, path)
+        if os.path.isfile(self._metrics_path(member)):
+            os.remove(self._metrics_path(member))
+
+        threads = self._settings['threads_per_worker']
+        env = dict(os.environ, OMP_NUM_THREADS=str(threads), TF_NUM_INTRAOP_THREADS=str(threads),
+                   TF_NUM_INTEROP_THREADS='1')
+        log = open(os.path.join(path, 'train.log'), 'a')
+        process = subprocess.Popen(
+            [sys.executable, 'population.py', '--interval', os.path.join(path, 'member.ini'), path, str(episodes),
+             self._metrics_path(member), str(threads)],
+            stdout=log, stderr=subprocess.STDOUT, env=env, preexec_fn=pin_cores(slot, threads))
+        return member, key, process, time.time(), log
+
+    def _exploit(self):
+        """
+        Replaces the worst members by copies of random leaders, ranked by the cumulative delay of the interval,
+        with perturbed hyperparameters
+        """
+        members = self._state['members']
+        if all(member['episodes'] >= self._total_episodes for member in members):
+            return
+        ranked = sorted(range(len(members)), key=lambda m: (members[m]['score'] is None, members[m]['score']))
+        n = min(len(members) // 2, max(1, int(round(len(members) * self._settings['exploit_fraction']))))
+        rng = random.Random(self._settings['seed'] * 100003 + self._state['round'])
+        for follower in ranked[len(members) - n:]:
+            leader = rng.choice(ranked[:n])
+            checkpoint = os.path.join(self._member_path(leader), 'checkpoint')
+            if members[leader]['score'] is None or not os.path.isdir(checkpoint):
+                continue
+            shutil.rmtree(os.path.join(self._member_path(follower), 'checkpoint'), ignore_errors=True)
+            shutil.copytree(checkpoint, os.path.join(self._member_path(follower), 'checkpoint'))
+            members[follower] = {'params': perturb(members[leader]['params'], self._settings['mutable'],
+                                                   self._settings['perturb'], rng),
+                                 'episodes': members[leader]['episodes'], 'score': None, 'parent': leader}
+            self._write_config(follower)
+            print("Member {} continues from member {} with {}".format(follower, leader, members[follower]['params']))
+
+    def summary(self, elapsed):
+        """
+        Prints the members ranked by the delay of their last interval and the cost of the session,
+        returns the index of the best member
+        """
+        members = self._state['members']
+        ranked = sorted(range(len(members)), key=lambda m: (members[m]['score'] is None, members[m]['score']))
+        print("\n----- Population", self._settings['name'])
+        for member in ranked:
+            print("member {}: delay {} {} {}".format(member, members[member]['score'], members[member]['params'],
+                                                     self._member_path(member)))
+        print("Trained in {} s, {} cpu-hours, best delay {}".format(
+            round(elapsed, 1), round(self._state['cpu_seconds'] / 3600, 2), members[ranked[0]]['score']))
+        return ranked[0]
+
+    def _metrics_path(self, member):
+        return os.path.join(self._member_path(member), 'metrics.json')
+
+    def _read_metrics(self, member):
+        try:
+            with open(self._metrics_path(member), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
@@ -0,0 +1,81 @@
+import timeit
+from collections import OrderedDict
+
+import numpy as np
+
+
+class QValueCache:
+    """
+    Class of the bounded LRU cache of the q-values of the states a model has seen, in front of its inference,
+    emptied whenever the model or its weights change
+    """
+    def __init__(self, max_entries=4096, binary=True):
+        self._max_entries = max_entries
+        self._binary = binary  # binary states are keyed bit-packed, 80 cells in 10 bytes
+        self._entries = OrderedDict()  # key -> q-values, least recently used first
+        self._model = None
+        self._weights_version = None
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+        self._miss_time = 0
+        self._hit_time = 0
+
+    def _key(self, state):
+        state = np.asarray(state)
+        if self._binary:
+            return np.packbits(state.astype(bool)).tobytes()
+        return state.astype(np.float32).tobytes()
+
+    def predict_one(self, Model, state):
+        """
+        Returns Model.predict_one(state), read from the cache if the state was already seen by the same weights
+        """
+        start_time = timeit.default_timer()
+        weights_version = getattr(Model, 'weights_version', 0)
+        if Model is not self._model or weights_version != self._weights_version:
+            if self._entries:
+                self._invalidations += 1
+            self._entries.clear()
+            self._model = Model
+            self._weights_version = weights_version
+
+        key = self._key(state)
+        prediction = self._entries.get(key)
+        if prediction is not None:
+            self._entries.move_to_end(key)
+            self._hits += 1
+            self._hit_time += timeit.default_timer() - start_time
+            return prediction
+
+        prediction = Model.predict_one(state)
+        self._entries[key] = prediction
+        if len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+        self._misses += 1
+        self._miss_time += timeit.default_timer() - start_time
+        return prediction
+
+    def stats(self):
+        return "q-value cache: {} of {} decisions served from cache ({:.1%}), {:.2f} s of inference saved, " \
+               "{} invalidations".format(self._hits, self._hits + self._misses, self.hit_rate, self.latency_saved,
+                                         self._invalidations)
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    @property
+    def hit_rate(self):
+        return self._hits / max(self._hits + self._misses, 1)
+
+    @property
+    def latency_saved(self):
+        """
+        Inference time the hits would have cost at the average time of a miss, less the time of the lookups
+        """
+        return self._hits * self._miss_time / max(self._misses, 1) - self._hit_time
@@ -0,0 +1,114 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import numpy as np
+
+FALLBACKS = ('stl', 'hold')
+
+
+class RealTimeMonitor:
+    """
+    Class that paces a simulation to the wall clock and measures the latency of every decision against its deadline
+    """
+    def __init__(self, deadline_ms, speed_up=1.0, fallback='stl', resolution_ms=0.1, max_ms=None):
+        if fallback not in FALLBACKS:
+            raise ValueError("Unknown deadline fallback: " + str(fallback))
+        self._deadline = deadline_ms / 1000
+        self._speed_up = speed_up  # simulated seconds per wall-clock second
+        self._fallback = fallback
+        self._resolution = resolution_ms
+        max_ms = max_ms if max_ms is not None else 10 * deadline_ms  # slower decisions land in the last bin
+        self._histogram = np.zeros(int(np.ceil(max_ms / resolution_ms)) + 1, dtype=np.int64)
+        self._decisions = 0
+        self._misses = 0
+        self._total = 0.0
+        self._max = 0.0
+        self._max_lag = 0.0
+        self._origin = None
+        self._decision_start = None
+        self._executor = ThreadPoolExecutor(max_workers=1)  # the inference, waited on until the deadline
+
+    def start(self, step):
+        """
+        Maps simulation step 'step' to the current wall-clock time
+        """
+        self._origin = time.perf_counter() - step / self._speed_up
+
+    def wait(self, step):
+        """
+        Sleeps until the wall-clock time of simulation step 'step', returns how late the simulation already was
+        """
+        lag = time.perf_counter() - (self._origin + step / self._speed_up)
+        if lag < 0:
+            time.sleep(-lag)
+        return max(lag, 0.0)
+
+    def begin(self, step):
+        """
+        Waits for the time of the decision at 'step' and starts measuring its latency
+        """
+        self._max_lag = max(self._max_lag, self.wait(step))
+        self._decision_start = time.perf_counter()
+
+    def decide(self, choose, fallback):
+        """
+        Returns (choose(), False) if the inference returns before the deadline of the decision in progress,
+        and otherwise (fallback(), True) as soon as the deadline passes. An inference that finished late, but
+        before the fallback is returned, is kept and only counted as a miss by end()
+
+        A late inference still running delays the next one, which waits for the worker
+        """
+        future = self._executor.submit(choose)
+        try:
+            return future.result(timeout=max(self._deadline - (time.perf_counter() - self._decision_start), 0)), False
+        except TimeoutError:
+            if future.done():
+                return future.result(), False
+            return fallback(), True
+
+    def end(self):
+        """
+        Records the latency of the decision in progress once its phase is set, further calls are ignored
+        """
+        if self._decision_start is None:
+            return
+        latency = time.perf_counter() - self._decision_start
+        self._decision_start = None
+        self._decisions += 1
+        self._misses += latency > self._deadline
+        self._total += latency
+        self._max = max(self._max, latency)
+        self._histogram[min(int(latency * 1000 / self._resolution), len(self._histogram) - 1)] += 1
+
+    def percentile(self, q):
+        """
+        Returns the 'q' quantile of the latencies in ms, the upper edge of its histogram bin
+        """
+        if self._decisions == 0:
+            return 0.0
+        cumulative = np.cumsum(self._histogram)
+        return round((int(np.searchsorted(cumulative, q * cumulative[-1])) + 1) * self._resolution, 6)
+
+    def stats(self):
+        """
+        Returns the latency statistics of the decisions in ms and the deadline misses
+        """
+        return {'decisions': self._decisions, 'misses': self._misses,
+                'deadline_ms': self._deadline * 1000, 'speed_up': self._speed_up, 'fallback': self._fallback,
+                'mean_ms': self._total * 1000 / max(self._decisions, 1), 'p50_ms': self.percentile(0.5),
+                'p99_ms': self.percentile(0.99), 'max_ms': self._max * 1000, 'max_lag_ms': self._max_lag * 1000}
+
+    def export(self, path):
+        """
+        Writes the statistics and the non-empty bins of the latency histogram to the json file 'path'
+        """
+        bins = np.nonzero(self._histogram)[0]
+        with open(path, 'w') as f:
+            json.dump(dict(self.stats(), resolution_ms=self._resolution,
+                           histogram=[[round(float(b * self._resolution), 6), int(self._histogram[b])] for b in bins]),
+                      f, indent=1)
+
+    @property
+    def fallback(self):
+        return self._fallback
@@ -0,0 +1,41 @@
+import timeit
+
+import traci.connection
+
+
+class TraciMeter:
+    """
+    Class counting the TraCI round trips and the time they wait on sumo, patched into the connections while active
+    """
+    def __init__(self):
+        self._calls = 0
+        self._seconds = 0.0
+        self._send_exact = None
+
+    def __enter__(self):
+        send_exact = self._send_exact = traci.connection.Connection._sendExact
+
+        def metered(connection):
+            start_time = timeit.default_timer()
+            try:
+                return send_exact(connection)
+            finally:
+                self._seconds += timeit.default_timer() - start_time
+                self._calls += 1
+
+        traci.connection.Connection._sendExact = metered
+        return self
+
+    def __exit__(self, *exc_info):
+        traci.connection.Connection._sendExact = self._send_exact
+
+    @property
+    def calls(self):
+        return self._calls
+
+    @property
+    def seconds(self):
+        """
+        Seconds spent in TraCI round trips, the simulation in sumo and the socket communication
+        """
+        return self._seconds
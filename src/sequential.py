@@ -0,0 +1,82 @@
+import math
+from statistics import NormalDist
+
+import numpy as np
+
+
+def t_quantile(p, dof):
+    """
+    Returns the 'p' quantile of Student's t distribution with 'dof' degrees of freedom,
+    exact for 1 and 2 degrees of freedom, Cornish-Fisher expansion around the normal quantile otherwise
+    """
+    if dof == 1:
+        return math.tan(math.pi * (p - 0.5))
+    if dof == 2:
+        return (2 * p - 1) * math.sqrt(2 / (4 * p * (1 - p)))
+    z = NormalDist().inv_cdf(p)
+    g1 = (z ** 3 + z) / 4
+    g2 = (5 * z ** 5 + 16 * z ** 3 + 3 * z) / 96
+    g3 = (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / 384
+    g4 = (79 * z ** 9 + 776 * z ** 7 + 1482 * z ** 5 - 1920 * z ** 3 - 945 * z) / 92160
+    return z + g1 / dof + g2 / dof ** 2 + g3 / dof ** 3 + g4 / dof ** 4
+
+
+class SequentialComparison:
+    """
+    Class of the running statistics of the total delay of several models evaluated on the same seeds,
+    telling when the ranking or the precision of every mean is settled
+    """
+    def __init__(self, model_ids, confidence=0.95, precision=0.02, min_episodes=3):
+        self._model_ids = list(model_ids)
+        self._confidence = confidence
+        self._precision = precision  # half width of the confidence interval relative to the mean
+        self._min_episodes = max(min_episodes, 2)
+        self._delays = {model_id: [] for model_id in self._model_ids}
+
+    def add(self, model_id, delay):
+        self._delays[model_id].append(delay)
+
+    def _half_width(self, values):
+        n = len(values)
+        if n < 2:
+            return math.inf
+        return t_quantile(0.5 + self._confidence / 2, n - 1) * np.std(values, ddof=1) / math.sqrt(n)
+
+    def mean(self, model_id):
+        return float(np.mean(self._delays[model_id]))
+
+    def half_width(self, model_id):
+        return self._half_width(self._delays[model_id])
+
+    def ranking(self):
+        """
+        Returns the model ids from the lowest to the highest mean delay
+        """
+        return sorted(self._model_ids, key=self.mean)
+
+    def ranking_settled(self):
+        """
+        Returns True if every two neighbours of the ranking differ, by the confidence interval of their paired
+        differences, possible since all models run the same seeds. A single model has no ranking to settle
+        """
+        ranking = self.ranking()
+        if len(ranking) < 2:
+            return False
+        for better, worse in zip(ranking, ranking[1:]):
+            differences = np.array(self._delays[worse]) - np.array(self._delays[better])
+            if np.mean(differences) - self._half_width(differences) <= 0:
+                return False
+        return True
+
+    def precision_reached(self):
+        return all(self.half_width(model_id) <= self._precision * abs(self.mean(model_id))
+                   for model_id in self._model_ids)
+
+    def done(self):
+        if self.episodes < self._min_episodes:
+            return False
+        return self.ranking_settled() or self.precision_reached()
+
+    @property
+    def episodes(self):
+        return min(len(delays) for delays in self._delays.values())
@@ -0,0 +1,190 @@
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from src.memory import frame_dtype, frame_size, pack_states
+
+_LINE = 64  # the counters of the producer and of the consumer live in different cache lines
+
+
+def _attach(name, size):
+    """
+    Returns the shared memory segment 'name' if 'size' is None, a new one of 'size' bytes otherwise
+    """
+    if size is not None:
+        return shared_memory.SharedMemory(create=True, size=size)
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # python < 3.13, the worker processes share the resource tracker of the learner anyway
+        return shared_memory.SharedMemory(name=name)
+
+
+def _align(offset):
+    return (offset + 7) // 8 * 8
+
+
+class TransitionRing:
+    """
+    Class of a ring of transitions in shared memory, written by one simulation worker and read by the learner
+    without serialization, the states packed like in Memory
+
+    Lock-free with a single producer and a single consumer: each one only writes its own counter, and the producer
+    publishes a slot by moving its counter after writing it, which orders the writes on x86 (TSO)
+    """
+    def __init__(self, num_states, capacity=2**16, binary=True, name=None):
+        self._num_states = num_states
+        self._capacity = capacity
+        self._binary = binary
+        frames = frame_size(num_states, binary)
+        dtype = frame_dtype(binary)
+        layout = [('states', (capacity, frames), dtype), ('next_states', (capacity, frames), dtype),
+                  ('actions', (capacity,), np.int8), ('rewards', (capacity,), np.float64)]
+        offset = 2 * _LINE
+        offsets = []
+        for _, shape, column_dtype in layout:
+            offsets.append(offset)
+            offset = _align(offset + int(np.prod(shape)) * np.dtype(column_dtype).itemsize)
+        self._owner = name is None
+        self._segment = _attach(name, offset if self._owner else None)
+        buffer = self._segment.buf
+        self._head = np.ndarray((1,), dtype=np.int64, buffer=buffer, offset=0)  # transitions written
+        self._tail = np.ndarray((1,), dtype=np.int64, buffer=buffer, offset=_LINE)  # transitions read
+        if self._owner:
+            self._head[0] = 0
+            self._tail[0] = 0
+        self._columns = {column: np.ndarray(shape, dtype=column_dtype, buffer=buffer, offset=column_offset)
+                         for (column, shape, column_dtype), column_offset in zip(layout, offsets)}
+
+    def put(self, state, action, reward, next_state, block=True):
+        """
+        Writes a transition, waiting while the ring is full, returns False if it is full and 'block' is False
+        """
+        head = int(self._head[0])
+        while head - int(self._tail[0]) >= self._capacity:
+            if not block:
+                return False
+            time.sleep(0.0001)
+        slot = head % self._capacity
+        self._columns['states'][slot] = pack_states(state, self._binary)
+        self._columns['next_states'][slot] = pack_states(next_state, self._binary)
+        self._columns['actions'][slot] = action
+        self._columns['rewards'][slot] = reward
+        self._head[0] = head + 1
+        return True
+
+    def add_sample(self, sample):
+        """
+        Writes a (state, action, reward, next_state) transition, so that the ring takes the place of the memory
+        of a simulation run by a worker
+        """
+        self.put(*sample)
+
+    def read(self):
+        """
+        Returns views (states, actions, rewards, next states) of the packed transitions written and not read yet,
+        up to the end of the ring, to be passed to release once they are consumed
+        """
+        tail = int(self._tail[0])
+        start = tail % self._capacity
+        stop = start + min(int(self._head[0]) - tail, self._capacity - start)
+        return (self._columns['states'][start:stop], self._columns['actions'][start:stop],
+                self._columns['rewards'][start:stop], self._columns['next_states'][start:stop])
+
+    def release(self, n):
+        """
+        Gives the oldest 'n' transitions back to the producer
+        """
+        self._tail[0] = int(self._tail[0]) + n
+
+    def drain_into(self, Memory):
+        """
+        Adds every transition written so far to 'Memory', copying the packed frames once, returns their number
+        """
+        n_total = 0
+        while True:
+            states, actions, rewards, next_states = self.read()
+            if len(actions) == 0:
+                return n_total
+            Memory.add_packed(states, actions, rewards, next_states, self._num_states)
+            self.release(len(actions))
+            n_total += len(actions)
+
+    def close(self):
+        """
+        Detaches from the ring, and removes it if this process created it
+        """
+        self._columns = None
+        self._head = self._tail = None
+        self._segment.close()
+        if self._owner:
+            self._segment.unlink()
+
+    @property
+    def name(self):
+        return self._segment.name
+
+    @property
+    def pending(self):
+        return int(self._head[0]) - int(self._tail[0])
+
+
+class WeightsBroadcast:
+    """
+    Class of the shared memory region where the learner publishes the weights of the policy for every worker,
+    versioned like a seqlock: the version is odd while the weights are written
+    """
+    def __init__(self, shapes, name=None):
+        self._shapes = [tuple(shape) for shape in shapes]
+        self._sizes = [int(np.prod(shape)) for shape in self._shapes]
+        self._owner = name is None
+        self._segment = _attach(name, _LINE + 4 * sum(self._sizes) if self._owner else None)
+        self._version = np.ndarray((1,), dtype=np.int64, buffer=self._segment.buf, offset=0)
+        self._payload = np.ndarray((sum(self._sizes),), dtype=np.float32, buffer=self._segment.buf, offset=_LINE)
+        if self._owner:
+            self._version[0] = 0
+        self._read_version = 0
+
+    def publish(self, weights):
+        """
+        Writes the list of weight arrays, by the single learner
+        """
+        self._version[0] += 1
+        self._payload[:] = np.concatenate([np.ravel(w) for w in weights])
+        self._version[0] += 1
+
+    def read(self):
+        """
+        Returns the list of weight arrays if new ones were published since the last read, None otherwise
+        """
+        while True:
+            version = int(self._version[0])
+            if version == self._read_version or version == 0:
+                return None
+            if version % 2:
+                time.sleep(0.0001)
+                continue
+            payload = self._payload.copy()
+            if int(self._version[0]) == version:  # not overwritten while copied
+                break
+        self._read_version = version
+        weights = []
+        offset = 0
+        for shape, size in zip(self._shapes, self._sizes):
+            weights.append(payload[offset:offset + size].reshape(shape))
+            offset += size
+        return weights
+
+    def close(self):
+        self._version = self._payload = None
+        self._segment.close()
+        if self._owner:
+            self._segment.unlink()
+
+    @property
+    def name(self):
+        return self._segment.name
+
+    @property
+    def version(self):
+        return int(self._version[0]) // 2
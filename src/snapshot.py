@@ -0,0 +1,176 @@
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+from collections import OrderedDict
+
+import traci
+
+from src.eval_cache import code_version
+
+# memory tier of the snapshot cache, a tmpfs where there is one
+MEMORY_PATH = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+def remove_stale():
+    """
+    Removes the directories left in the memory tier by processes that are gone, e.g. after a crash
+    """
+    for name in os.listdir(MEMORY_PATH):
+        match = re.fullmatch(r'tlcs_(snapshots|fork)_(\d+)(_\w+)?', name)
+        if match is None or int(match.group(2)) == os.getpid():
+            continue
+        try:
+            os.kill(int(match.group(2)), 0)
+        except ProcessLookupError:
+            shutil.rmtree(os.path.join(MEMORY_PATH, name), ignore_errors=True)
+        except PermissionError:
+            pass  # alive, run by another user
+
+
+class _Tier:
+    """
+    Directory of snapshot files bounded in bytes, evicting the least recently used files
+    """
+    def __init__(self, path, max_bytes):
+        self._path = path
+        self._max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+        self._files = OrderedDict()  # name -> size, least recently used first
+        names = [name for name in os.listdir(path) if name.endswith('.xml')]
+        for name in sorted(names, key=lambda name: os.path.getmtime(os.path.join(path, name))):
+            self._files[name] = os.path.getsize(os.path.join(path, name))
+
+    def get(self, name):
+        if name not in self._files:
+            return None
+        self._files.move_to_end(name)
+        return os.path.join(self._path, name)
+
+    def put(self, name, source, move=False):
+        """
+        Adds the snapshot file 'source' as 'name', returns its path or None if it is larger than the tier
+        """
+        size = os.path.getsize(source)
+        if size > self._max_bytes:
+            return None
+        self._files.pop(name, None)
+        while self._files and sum(self._files.values()) + size > self._max_bytes:
+            evicted, _ = self._files.popitem(last=False)
+            os.remove(os.path.join(self._path, evicted))
+        path = os.path.join(self._path, name)
+        tmp_path = path + '.tmp'
+        if move:
+            shutil.move(source, tmp_path)
+        else:
+            shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, path)
+        self._files[name] = size
+        return path
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def nbytes(self):
+        return sum(self._files.values())
+
+
+class SnapshotCache:
+    """
+    Cache of sumo simulation states keyed by scenario, kept in a memory tier in front of a disk tier
+    """
+    def __init__(self, path='snapshots', max_disk_bytes=512 * 2**20, max_memory_bytes=64 * 2**20):
+        remove_stale()
+        self._disk = _Tier(path, max_disk_bytes)
+        self._memory = _Tier(os.path.join(MEMORY_PATH, 'tlcs_snapshots_{}'.format(os.getpid())), max_memory_bytes)
+        self._code_version = code_version()  # the disk tier outlives changes of the code
+        self._hits = 0
+        self._misses = 0
+
+    def key(self, *scenario):
+        """
+        Returns the file name of the snapshot of 'scenario', e.g. (route seed, n_cars, time, ...)
+        """
+        return hashlib.sha1(repr((self._code_version,) + scenario).encode()).hexdigest()[:20] + '.xml'
+
+    def load(self, key):
+        """
+        Loads the snapshot 'key' into the running simulation, returns False if it is not cached
+        """
+        path = self._memory.get(key)
+        if path is None:
+            path = self._disk.get(key)
+            if path is not None:
+                self._memory.put(key, path)  # promoted to the memory tier
+        if path is None:
+            self._misses += 1
+            return False
+        traci.simulation.loadState(path)
+        self._hits += 1
+        return True
+
+    def save(self, key):
+        """
+        Saves the state of the running simulation as snapshot 'key'
+        """
+        tmp_path = os.path.join(self._memory.path, 'saving.tmp')
+        traci.simulation.saveState(tmp_path)
+        self._disk.put(key, tmp_path)
+        if self._memory.put(key, tmp_path, move=True) is None:
+            os.remove(tmp_path)
+
+    def close(self):
+        """
+        Removes the memory tier, the disk tier persists across runs
+        """
+        shutil.rmtree(self._memory.path, ignore_errors=True)
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+
+class Fork:
+    """
+    Class evaluating branches from the state of the running simulation in a second sumo, started on the first
+    evaluation, so that the running simulation and its outputs are left as they are
+    """
+    def __init__(self, sumo_cmd):
+        remove_stale()
+        self._sumo_cmd = sumo_cmd
+        self._dir = tempfile.mkdtemp(prefix='tlcs_fork_{}_'.format(os.getpid()), dir=MEMORY_PATH)
+        self._path = os.path.join(self._dir, 'fork.xml')
+        self._label = os.path.basename(self._dir)
+        self._started = False
+
+    def evaluate(self, candidates, run_branch):
+        """
+        Returns run_branch(candidate) for every candidate, each simulated from the current state
+        """
+        traci.simulation.saveState(self._path)
+        label = traci.getLabel()
+        if not self._started:
+            traci.start(self._sumo_cmd, label=self._label)
+            self._started = True
+        traci.switch(self._label)
+        try:
+            results = []
+            for candidate in candidates:
+                traci.simulation.loadState(self._path)
+                results.append(run_branch(candidate))
+        finally:
+            traci.switch(label)
+        return results
+
+    def close(self):
+        if self._started:
+            traci.getConnection(self._label).close()
+            self._started = False
+        shutil.rmtree(self._dir, ignore_errors=True)
@@ -0,0 +1,37 @@
+import numpy as np
+
+
+class SparseForward:
+    """
+    Class running the q-network in numpy on single states, its first layer as a sum of the weight rows of the
+    non-zero inputs instead of a product with the whole, mostly empty, state
+    """
+    def __init__(self, weights, binary=True):
+        # keras order of the dense layers: kernel and bias of each, hidden layers relu, the last one linear
+        self._kernels = [np.ascontiguousarray(kernel, dtype=np.float32) for kernel in weights[0::2]]
+        self._biases = [np.asarray(bias, dtype=np.float32) for bias in weights[1::2]]
+        self._binary = binary  # every non-zero input is 1, so its weight row is added as it is
+
+    def predict_occupied(self, indices, values=None):
+        """
+        Returns the q-values, shape (1, output_dim), of the state given by the indices of its non-zero inputs,
+        and their values unless they are all 1
+        """
+        rows = self._kernels[0][indices]
+        x = rows.sum(axis=0) if values is None else np.asarray(values, dtype=np.float32) @ rows
+        x = np.maximum(x + self._biases[0], 0)
+        for kernel, bias in zip(self._kernels[1:-1], self._biases[1:-1]):
+            x = np.maximum(x @ kernel + bias, 0)
+        return (x @ self._kernels[-1] + self._biases[-1])[None, :]
+
+    def predict_one(self, state):
+        """
+        Returns the q-values, shape (1, output_dim), of a 1-d array state
+        """
+        state = np.asarray(state).ravel()
+        indices = np.flatnonzero(state)
+        return self.predict_occupied(indices, None if self._binary else state[indices])
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self._kernels + self._biases)
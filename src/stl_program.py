@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import traci
+
+STL_PROGRAM_ID = 'stl'
+INCOMING_EDGES = ["N2TL", "S2TL", "E2TL", "W2TL"]  # incoming edges of TL in environment.net.xml
+
+
+def stl_schedule(choose_action, steps, green_duration, yellow_duration, old_action=-1):
+    """
+    Returns the (phase, duration) sequence that the STL policy 'choose_action' runs for 'steps' steps
+    after 'old_action', with the yellow phases between different greens, and the number of steps it lasts
+    """
+    schedule = []
+    step = 0
+    while step < steps:
+        action = choose_action(step, old_action)
+        if old_action != -1 and old_action != action:
+            schedule.append((min(old_action, 3) * 2 + 1, yellow_duration))  # action 4, the STL cycle, ends in EWL
+            step += yellow_duration
+        schedule.append((action * 2, green_duration))
+        step += green_duration
+        old_action = action
+    return schedule, step
+
+
+def install_program(tl_id, schedule):
+    """
+    Installs 'schedule' as a static program of traffic light 'tl_id', starting from the current step
+    """
+    logic = [logic for logic in traci.trafficlight.getAllProgramLogics(tl_id) if logic.programID != STL_PROGRAM_ID][0]
+    states = [phase.state for phase in logic.phases]
+    phases = [traci.trafficlight.Phase(duration, states[phase]) for phase, duration in schedule]
+    last_phase = schedule[-1][0]
+    if last_phase % 2 == 0:  # close the cycle with a yellow, it is never reached within the schedule
+        phases.append(traci.trafficlight.Phase(schedule[-1][1], states[last_phase + 1]))
+    traci.trafficlight.setProgramLogic(tl_id, traci.trafficlight.Logic(STL_PROGRAM_ID, 0, 0, phases=phases))
+    # a program replaced while another one runs is not activated, and an active one keeps its phase
+    traci.trafficlight.setProgram(tl_id, STL_PROGRAM_ID)
+    traci.trafficlight.setPhase(tl_id, 0)
+
+
+def add_additional(sumo_cmd, additional_file):
+    """
+    Returns 'sumo_cmd' loading 'additional_file' as well, next to any additional file it already loads
+    """
+    sumo_cmd = list(sumo_cmd)
+    if "-a" in sumo_cmd:
+        i = sumo_cmd.index("-a") + 1
+        sumo_cmd[i] += "," + additional_file
+    else:
+        sumo_cmd += ["-a", additional_file]
+    return sumo_cmd
+
+
+def queue_totals(edge_queues):
+    """
+    Returns the queue length of every step, the sum of the queues of its edges
+    """
+    return [int(round(queue)) for queue in edge_queues.sum(axis=1)]
+
+
+class QueueLog:
+    """
+    Class aggregating the halting vehicles of the incoming edges per step in sumo itself, through edgeData,
+    so that the queue length does not need to be polled while sumo skips ahead
+    """
+    def __init__(self, edges, max_steps):
+        self._max_steps = max_steps
+        self._edges = {edge: i for i, edge in enumerate(edges)}
+        self._dir = tempfile.mkdtemp(prefix='queue_log_')
+        self._path = os.path.join(self._dir, 'queue.add.xml')
+        self._output = os.path.join(self._dir, 'queue.xml')
+        with open(self._path, 'w') as f:
+            f.write('<additional>\n    <edgeData id="queue" file="{}" period="1" edges="{}" excludeEmpty="false"/>\n'
+                    '</additional>\n'.format(self._output, " ".join(edges)))
+
+    def read_edges(self):
+        """
+        Returns the number of halting vehicles of every edge, in the order of 'edges', at every step of the last
+        episode as an array (max_steps, edges), to be called after traci.close
+        halting vehicles wait 1 second per step, so the waiting time of an interval of 1 step is the queue length
+        """
+        queues = np.zeros((self._max_steps, len(self._edges)))
+        for _, element in ET.iterparse(self._output):
+            if element.tag == 'interval':
+                step = int(float(element.get('begin')))
+                if step < self._max_steps:
+                    for edge in element:
+                        queues[step, self._edges[edge.get('id')]] = float(edge.get('waitingTime', 0))
+                element.clear()
+        return queues
+
+    def read(self):
+        """
+        Returns the number of halting vehicles of every step of the last episode, to be called after traci.close
+        """
+        return queue_totals(self.read_edges())
+
+    def close(self):
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    @property
+    def path(self):
+        return self._path
@@ -0,0 +1,194 @@
+import configparser
+import datetime
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+
+from src.utils import set_train_path
+
+
+def expand_grid(config_file):
+    """
+    Reads a sweep config and expands every comma-separated value outside of the [sweep] section into a grid,
+    returns the [sweep] settings and a list of trials (key, varied params, full config)
+    """
+    content = configparser.ConfigParser()
+    content.read(config_file)
+    settings = {'name': content['sweep'].get('name', fallback=os.path.splitext(os.path.basename(config_file))[0]),
+                'workers': content['sweep'].getint('workers', fallback=max(1, (os.cpu_count() or 1) // 2)),
+                'threads_per_trial': content['sweep'].getint('threads_per_trial', fallback=1),
+                'catalog': content['sweep'].get('catalog', fallback=os.path.join('sweeps', 'catalog.db'))}
+
+    axes = []
+    for section in content.sections():
+        if section == 'sweep':
+            continue
+        for key, value in content[section].items():
+            options = [option.strip() for option in value.split(',')]
+            if len(options) > 1:
+                axes.append(((section, key), options))
+
+    trials = []
+    for values in itertools.product(*[options for _, options in axes]):
+        trial_content = configparser.ConfigParser()
+        trial_content.read_dict({section: dict(content[section]) for section in content.sections()
+                                 if section != 'sweep'})
+        params = {}
+        for ((section, key), _), value in zip(axes, values):
+            trial_content[section][key] = value
+            params[section + '.' + key] = value
+        full = {section: dict(trial_content[section]) for section in trial_content.sections()}
+        key = hashlib.sha1(json.dumps(full, sort_keys=True).encode()).hexdigest()[:16]
+        trials.append((key, params, trial_content))
+    return settings, trials
+
+
+def pin_cores(slot, threads):
+    """
+    Returns a function pinning the process of a worker slot to its own cores, if the platform and core count allow it
+    """
+    if not hasattr(os, 'sched_setaffinity'):
+        return None
+    cpus = sorted(os.sched_getaffinity(0))
+    cores = cpus[slot * threads:(slot + 1) * threads]
+    if len(cores) < threads:
+        return None
+    return lambda: os.sched_setaffinity(0, cores)
+
+
+class Catalog:
+    """
+    Class of the sqlite catalog holding status and metrics of every sweep trial
+    """
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("""CREATE TABLE IF NOT EXISTS trials (
+            key TEXT PRIMARY KEY, sweep TEXT, params TEXT, status TEXT, model_path TEXT,
+            started TEXT, finished TEXT, duration REAL, metrics TEXT)""")
+        self._connection.commit()
+
+    def status(self, key):
+        row = self._connection.execute("SELECT status FROM trials WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def model_path(self, key):
+        row = self._connection.execute("SELECT model_path FROM trials WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def start(self, key, sweep, params, model_path):
+        self._connection.execute(
+            "INSERT OR REPLACE INTO trials VALUES (?, ?, ?, 'running', ?, ?, NULL, NULL, NULL)",
+            (key, sweep, json.dumps(params), model_path, datetime.datetime.now().isoformat()))
+        self._connection.commit()
+
+    def finish(self, key, status, duration, metrics):
+        self._connection.execute(
+            "UPDATE trials SET status = ?, finished = ?, duration = ?, metrics = ? WHERE key = ?",
+            (status, datetime.datetime.now().isoformat(), duration, json.dumps(metrics), key))
+        self._connection.commit()
+
+    def trials(self, sweep):
+        return self._connection.execute(
+            "SELECT key, params, status, model_path, duration, metrics FROM trials WHERE sweep = ? ORDER BY started",
+            (sweep,)).fetchall()
+
+
+class SweepScheduler:
+    """
+    Runs the trials of a sweep config concurrently, each in its own process with a fixed CPU and thread budget
+    """
+    def __init__(self, config_file):
+        self._settings, self._trials = expand_grid(config_file)
+        self._catalog = Catalog(self._settings['catalog'])
+        self._trials_path = os.path.join(os.path.dirname(self._settings['catalog']) or '.', self._settings['name'])
+        os.makedirs(self._trials_path, exist_ok=True)
+
+    def run(self):
+        """
+        Runs every trial that is not finished yet, returns the number of trials completed by this call
+        """
+        pending = [trial for trial in self._trials if self._catalog.status(trial[0]) != 'done']
+        print("Sweep {}: {} trials, {} already done, {} workers x {} threads".format(
+            self._settings['name'], len(self._trials), len(self._trials) - len(pending),
+            self._settings['workers'], self._settings['threads_per_trial']))
+
+        start_time = time.time()
+        running = {}  # slot -> (key, process, start time, log file)
+        completed = 0
+        while pending or running:
+            for slot in range(self._settings['workers']):
+                if slot not in running and pending:
+                    running[slot] = self._launch(slot, *pending.pop(0))
+
+            time.sleep(1)
+            for slot, (key, process, trial_start, log) in list(running.items()):
+                if process.poll() is None:
+                    continue
+                log.close()
+                del running[slot]
+                metrics = self._read_metrics(key)
+                status = 'done' if process.returncode == 0 and metrics is not None else 'failed'
+                self._catalog.finish(key, status, round(time.time() - trial_start, 1), metrics)
+                completed += status == 'done'
+                print("Trial {} {} in {} s".format(key, status, round(time.time() - trial_start, 1)))
+
+        self.summary(completed, time.time() - start_time)
+        return completed
+
+    def summary(self, completed, elapsed):
+        """
+        Prints the catalog entries of the sweep and the trial throughput of this session
+        """
+        print("\n----- Sweep", self._settings['name'])
+        for key, params, status, model_path, duration, metrics in self._catalog.trials(self._settings['name']):
+            metrics = json.loads(metrics) if metrics else {}
+            print("{} {:7} {} final delay: {} ({} s) {}".format(
+                key, status, params, metrics.get('final_delay'), duration, model_path))
+        hours = elapsed / 3600
+        print("Completed {} trials in {} s: {} trials per hour".format(
+            completed, round(elapsed, 1), round(completed / hours, 2) if hours > 0 else 0))
+
+    def _launch(self, slot, key, params, content):
+        """
+        Allocates a model directory and starts the training process of a trial, a trial interrupted by the end
+        of an earlier sweep starts over in the directory it had
+        """
+        config_file = os.path.join(self._trials_path, key + '.ini')
+        with open(config_file, 'w') as f:
+            content.write(f)
+        path = self._catalog.model_path(key)
+        if path and os.path.isdir(path):
+            shutil.rmtree(path)  # the partial results of the interrupted run
+            os.mkdir(path)
+        else:
+            path = set_train_path(content['dir']['models_path_name'])
+        self._catalog.start(key, self._settings['name'], params, path)
+        if os.path.isfile(self._metrics_path(key)):
+            os.remove(self._metrics_path(key))
+        print("Trial {} {} -> {}".format(key, params, path))
+
+        threads = self._settings['threads_per_trial']
+        env = dict(os.environ, OMP_NUM_THREADS=str(threads), TF_NUM_INTRAOP_THREADS=str(threads),
+                   TF_NUM_INTEROP_THREADS='1')
+        log = open(os.path.join(path, 'train.log'), 'w')
+        process = subprocess.Popen(
+            [sys.executable, 'sweep.py', '--trial', config_file, path, self._metrics_path(key), str(threads)],
+            stdout=log, stderr=subprocess.STDOUT, env=env, preexec_fn=pin_cores(slot, threads))
+        return key, process, time.time(), log
+
+    def _metrics_path(self, key):
+        return os.path.join(self._trials_path, key + '_metrics.json')
+
+    def _read_metrics(self, key):
+        try:
+            with open(self._metrics_path(key), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
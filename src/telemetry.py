@@ -0,0 +1,255 @@
+import os
+
+import numpy as np
+
+MAGIC = b'TLCSTEL1'
+HEADER_SIZE = 64
+# the count is the last field written for a record, a reader never sees a record before it is complete
+HEADER = np.dtype({'names': ['magic', 'record_size', 'capacity', 'count'],
+                   'formats': ['S8', '<u8', '<u8', '<u8'],
+                   'offsets': [0, 8, 16, 24], 'itemsize': HEADER_SIZE})
+RECORD = np.dtype([('episode', '<i4'), ('step', '<i4'), ('kind', 'u1'), ('phase', 'i1'), ('action', 'i1'),
+                   ('pad', 'u1'), ('queue', '<f4'), ('edge_queues', '<f4', (4,)), ('reward', '<f4'),
+                   ('latency_ms', '<f4')])
+STEP, DECISION = 0, 1
+NO_EDGE_QUEUES = (np.nan,) * 4  # the queue of each incoming edge is only known when polled, metered or read from sumo
+
+
+def _is_log(path):
+    """
+    Returns True if 'path' is a telemetry log with records of this version
+    """
+    if not os.path.isfile(path) or os.path.getsize(path) < HEADER_SIZE:
+        return False
+    header = np.fromfile(path, dtype=HEADER, count=1)
+    return header['magic'][0] == MAGIC and header['record_size'][0] == RECORD.itemsize
+
+
+class TelemetryLog:
+    """
+    Class appending per-step and per-decision records to a preallocated memory-mapped file, readable while written,
+    an existing log is continued
+    """
+    def __init__(self, path, capacity=2**16, batch=256):
+        self._path = path
+        self._episode = 0
+        # records are copied to the file in blocks, converting them one by one costs more than the run can spare
+        self._batch = batch
+        self._pending = []
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if _is_log(path):  # a resumed session appends to its log
+            self._header = np.memmap(path, dtype=HEADER, mode='r+', shape=(1,))
+            capacity = int(self._header['capacity'][0])
+            self._count = int(self._header['count'][0])
+        else:
+            with open(path, 'wb') as f:
+                f.truncate(HEADER_SIZE + capacity * RECORD.itemsize)
+            self._header = np.memmap(path, dtype=HEADER, mode='r+', shape=(1,))
+            self._header['magic'] = MAGIC
+            self._header['record_size'] = RECORD.itemsize
+            self._header['capacity'] = capacity
+            self._header['count'] = 0
+            self._count = 0
+        self._records = np.memmap(path, dtype=RECORD, mode='r+', offset=HEADER_SIZE, shape=(capacity,))
+
+    def begin(self, episode):
+        """
+        Sets the episode of the next records
+        """
+        self.flush()
+        self._episode = episode
+
+    def step(self, step, phase, queue, edge_queues=NO_EDGE_QUEUES):
+        """
+        Appends the state of the intersection after simulation step 'step'
+        """
+        self._append((self._episode, step, STEP, phase, -1, 0, queue, edge_queues, np.nan, np.nan))
+
+    def decision(self, step, phase, action, reward, latency_ms):
+        """
+        Appends the action chosen at 'step', its reward and the time the model took to choose it
+        """
+        self._append((self._episode, step, DECISION, phase, action, 0, np.nan, NO_EDGE_QUEUES, reward, latency_ms))
+
+    def steps(self, steps, phases, edge_queues):
+        """
+        Appends the records of many steps at once, e.g. from the queues sumo aggregated over an episode,
+        'edge_queues' of shape (steps, 4)
+        """
+        self.flush()
+        records = np.zeros(len(steps), dtype=RECORD)
+        records['episode'] = self._episode
+        records['step'] = steps
+        records['kind'] = STEP
+        records['phase'] = phases
+        records['action'] = -1
+        records['queue'] = np.sum(edge_queues, axis=1)
+        records['edge_queues'] = edge_queues
+        records['reward'] = np.nan
+        records['latency_ms'] = np.nan
+        self._write(records)
+
+    def _append(self, record):
+        self._pending.append(record)
+        if len(self._pending) >= self._batch:
+            self.flush()
+
+    def flush(self):
+        """
+        Copies the pending records to the file and makes them visible to the readers
+        """
+        if not self._pending:
+            return
+        self._write(self._pending)
+        self._pending = []
+
+    def _write(self, records):
+        count = self._count + len(records)
+        if count > len(self._records):
+            self._grow(count)
+        self._records[self._count:count] = records
+        self._count = count
+        self._header['count'] = count
+
+    def _grow(self, count):
+        """
+        Doubles the capacity of the file until it holds 'count' records, readers map the larger file once they see
+        a count beyond their mapping
+        """
+        capacity = len(self._records)
+        while capacity < count:
+            capacity *= 2
+        self._records.flush()
+        del self._records
+        with open(self._path, 'r+b') as f:
+            f.truncate(HEADER_SIZE + capacity * RECORD.itemsize)
+        self._records = np.memmap(self._path, dtype=RECORD, mode='r+', offset=HEADER_SIZE, shape=(capacity,))
+        self._header['capacity'] = capacity
+
+    def close(self):
+        self.flush()
+        self._records.flush()
+        self._header.flush()
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def count(self):
+        return self._count + len(self._pending)
+
+
+class PhaseTrace:
+    """
+    Class keeping the steps at which the phases were set, to give the phase of every step of an episode afterwards
+    """
+    def __init__(self):
+        self._steps = []
+        self._phases = []
+
+    def set(self, step, phase):
+        self._steps.append(step)
+        self._phases.append(phase)
+
+    def schedule(self, step, schedule):
+        """
+        Adds the (phase, duration) sequence of a program starting at 'step'
+        """
+        for phase, duration in schedule:
+            self.set(step, phase)
+            step += duration
+
+    def truncate(self, length):
+        del self._steps[length:]
+        del self._phases[length:]
+
+    def phases(self, steps):
+        """
+        Returns the phase of every record step, the one set last before it was simulated, -1 before the first
+        """
+        indices = np.searchsorted(self._steps, steps, side='left') - 1
+        return np.array(self._phases + [-1])[indices]  # index -1, before the first phase, is the -1 appended
+
+    def __len__(self):
+        return len(self._steps)
+
+
+class TelemetryReader:
+    """
+    Class reading the records of a telemetry log, also while it is written, mapping only the file not its contents
+    """
+    def __init__(self, path):
+        self._path = path
+        if not _is_log(path):
+            raise ValueError("Not a telemetry log of this version: " + path)
+        self._header = np.memmap(path, dtype=HEADER, mode='r', shape=(1,))
+        self._records = None
+        self._position = 0
+
+    @property
+    def count(self):
+        return int(self._header['count'][0])
+
+    def read(self, start, stop):
+        """
+        Returns a copy of the records from 'start' to 'stop'
+        """
+        stop = min(stop, self.count)
+        if self._records is None or stop > len(self._records):  # the writer has grown the file
+            self._records = np.memmap(self._path, dtype=RECORD, mode='r', offset=HEADER_SIZE,
+                                      shape=(int(self._header['capacity'][0]),))
+        return np.array(self._records[start:stop])
+
+    def poll(self, max_records=2**16):
+        """
+        Returns the records written since the last call, at most 'max_records'
+        """
+        records = self.read(self._position, self._position + max_records)
+        self._position += len(records)
+        return records
+
+
+class TelemetrySummary:
+    """
+    Class accumulating per-episode statistics from chunks of telemetry records
+    """
+    def __init__(self):
+        self._episodes = {}
+
+    def add(self, records):
+        for episode in np.unique(records['episode']):
+            episode_records = records[records['episode'] == episode]
+            steps = episode_records[episode_records['kind'] == STEP]
+            decisions = episode_records[episode_records['kind'] == DECISION]
+            stats = self._episodes.setdefault(int(episode), {'last_step': 0, 'steps': 0, 'queue_sum': 0.0,
+                                                             'queue_max': 0.0, 'decisions': 0, 'stl_cycles': 0,
+                                                             'reward': 0.0, 'latency_sum': 0.0, 'latency_max': 0.0})
+            stats['last_step'] = max(stats['last_step'], int(episode_records['step'].max()))
+            stats['steps'] += len(steps)
+            if len(steps):
+                stats['queue_sum'] += float(steps['queue'].sum())
+                stats['queue_max'] = max(stats['queue_max'], float(steps['queue'].max()))
+            stats['decisions'] += len(decisions)
+            if len(decisions):
+                stats['stl_cycles'] += int((decisions['action'] == 4).sum())
+                stats['reward'] += float(np.nansum(decisions['reward']))
+                stats['latency_sum'] += float(np.nansum(decisions['latency_ms']))
+                stats['latency_max'] = max(stats['latency_max'], float(np.nanmax(decisions['latency_ms'])))
+
+    def episode(self, episode):
+        """
+        Returns the summary of 'episode' so far
+        """
+        stats = self._episodes[episode]
+        return {'episode': episode, 'last_step': stats['last_step'], 'decisions': stats['decisions'],
+                'stl_cycles': stats['stl_cycles'], 'total_reward': stats['reward'],
+                'mean_queue': stats['queue_sum'] / stats['steps'] if stats['steps'] else None,
+                'max_queue': stats['queue_max'] if stats['steps'] else None,
+                'mean_latency_ms': stats['latency_sum'] / max(stats['decisions'], 1),
+                'max_latency_ms': stats['latency_max']}
+
+    @property
+    def episodes(self):
+        return sorted(self._episodes)
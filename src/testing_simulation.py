@@ -3,6 +3,13 @@ import numpy as np
 import random
 import timeit
 import os
+from functools import partial
+
+from src.observation import ObservationSpec
+from src.snapshot import Fork
+from src.stl_program import INCOMING_EDGES, QueueLog, add_additional, install_program, queue_totals, stl_schedule
+from src.telemetry import NO_EDGE_QUEUES, PhaseTrace
+from src.trip_output import TripLog
 
 # phase codes based on environment.net.xml
 PHASE_NS_GREEN = 0  # action 0 code 00
@@ -17,7 +24,9 @@ PHASE_EWL_YELLOW = 7
 
 class Simulation:
     def __init__(self, Model, TrafficGen, sumo_cmd, max_steps, green_duration, yellow_duration, num_states,
-                 num_actions):
+                 num_actions, Observation=None, Detectors=None, native_stl=False, Snapshots=None, warmup_steps=0,
+                 QCache=None, trip_output=False, RealTime=None,
+                 Telemetry=None):
         self._Model = Model
         self._TrafficGen = TrafficGen
         self._step = 0
@@ -31,6 +40,23 @@ class Simulation:
         self._queue_length_episode = []
         self._waiting_times = {}
         self._total_wait_time = 0
+        self._Observation = Observation or ObservationSpec(os.path.join('tlcs', 'environment.net.xml'))
+        self._Detectors = Detectors  # None to poll the vehicles and edges through TraCI
+        self._native_stl = native_stl  # STL cycles run as a sumo program instead of phase by phase
+        self._queue_log = None
+        self._Snapshots = Snapshots  # None simulates the warm-up of every episode
+        self._warmup_steps = warmup_steps  # steps run with STL before the model takes over, not measured
+        self._warmup_time = 0
+        self._Fork = None
+        self._QCache = QCache  # None runs the model on every decision
+        self._trip_output = trip_output  # delays and queues written by sumo instead of polled at every step
+        self._trip_stats = {}
+        self._RealTime = RealTime  # None runs as fast as possible, without decision deadlines
+        self._fallbacks = 0
+        self._Telemetry = Telemetry  # None keeps no per-step log
+        self._phase = -1  # the phase last set by the agent
+        self._edge_queues = NO_EDGE_QUEUES
+        self._phase_trace = None  # phases of the steps whose queues are read from sumo, for the telemetry
 
     def run(self, episode):
         """
@@ -40,7 +66,21 @@ class Simulation:
 
         # generate the routefile for the simulation and set up sumo
         car_timings = self._TrafficGen.generate_routefile(seed=episode)
-        traci.start(self._sumo_cmd)
+        sumo_cmd = self._sumo_cmd
+        if self._native_stl or self._trip_output:  # sumo aggregates the queue lengths, also over skipped STL cycles
+            self._queue_log = QueueLog(INCOMING_EDGES, self._max_steps)
+            sumo_cmd = add_additional(sumo_cmd, self._queue_log.path)
+            if self._Telemetry is not None:
+                self._phase_trace = PhaseTrace()
+        trip_log = None
+        if self._trip_output:
+            trip_log = TripLog(self._max_steps)
+            sumo_cmd = trip_log.add_output(sumo_cmd)
+        if self._Snapshots is not None:  # the random generators continue from the snapshot as well
+            sumo_cmd = sumo_cmd + ["--save-state.rng", "true"]
+        traci.start(sumo_cmd)
+        if self._Detectors is not None:
+            self._Detectors.start()
         # print("Simulating...")
 
         self._step = 0
@@ -50,14 +90,34 @@ class Simulation:
         current_total_wait = 0
         old_action = -1  # dummy inits
         self._reward_episode = []
+        if self._warmup_steps > 0:
+            old_action = self._warm_up(episode, sumo_cmd)
         threshold = 0.75  # threshold for initiating STL cycle
         counter = 0
+        self._fallbacks = 0
+        if self._Telemetry is not None:
+            self._Telemetry.begin(episode)
+        if self._RealTime is not None:
+            self._RealTime.start(self._step)
         while self._step < self._max_steps:
+            if self._RealTime is not None:
+                self._RealTime.begin(self._step)
             current_state = self._get_state()
-            current_total_wait = self._collect_waiting_times()
+            if not self._trip_output:  # the waiting times are read from the trips at the end of the episode
+                current_total_wait = self._collect_waiting_times()
 
-            allow_stl = sum(current_state) / len(current_state) >= threshold  # decide if to allow an STL cycle
-            action = self._choose_action(current_state, allow_stl=allow_stl)
+            allow_stl = self._Observation.occupied_share(current_state) >= threshold  # decide if to allow an STL cycle
+            decision_time = timeit.default_timer()
+            if self._RealTime is not None:  # the fallback phase is set as soon as the deadline passes
+                action, fallback = self._RealTime.decide(partial(self._choose_action, current_state, allow_stl),
+                                                         partial(self._fallback_action, old_action))
+                self._fallbacks += fallback
+            else:
+                action = self._choose_action(current_state, allow_stl=allow_stl)
+            latency = timeit.default_timer() - decision_time
+            if self._Telemetry is not None:
+                self._Telemetry.decision(self._step, self._phase, action, old_total_wait - current_total_wait,
+                                         latency * 1000)
             if action != 4:  # if not STL cycle
                 # if the chosen phase is different from the last phase, activate the yellow phase
                 if self._step != 0 and old_action != action:
@@ -65,10 +125,12 @@ class Simulation:
                         self._set_yellow_phase(3)
                     else:
                         self._set_yellow_phase(old_action)
+                    self._decided()
                     self._simulate(self._yellow_duration)
 
                 # execute the phase selected before
                 self._set_green_phase(action)
+                self._decided()
                 self._simulate(self._green_duration)
 
                 # saving variables for later & accumulate reward
@@ -76,31 +138,52 @@ class Simulation:
                 old_action = action
                 old_total_wait = current_total_wait
             else:
+                self._decided()  # the STL cycle takes over from here
                 counter += 1
                 initial_step = self._step
                 old_total_wait = current_total_wait
 
-                while self._step < (initial_step + 126) and self._step < self._max_steps:
-                    # choose the light phase to activate, based on the current state of the intersection
-                    action = self._choose_stl_action(self._step - initial_step, old_action)
-                    if self._step != 0 and old_action != action:
-                        if old_action == 4:
-                            self._set_yellow_phase(3)
-                        else:
-                            self._set_yellow_phase(old_action)
-                        self._simulate(self._yellow_duration)
-                    # execute the phase selected before
-                    self._set_green_phase(action)
-                    self._simulate(self._green_duration)
-
-                    # saving variables for later & accumulate reward
-                    old_state = current_state
-                    old_action = action
+                if self._native_stl:
+                    self._run_stl_cycle(old_action)
+                else:
+                    while self._step < (initial_step + 126) and self._step < self._max_steps:
+                        # choose the light phase to activate, based on the current state of the intersection
+                        action = self._choose_stl_action(self._step - initial_step, old_action)
+                        if self._step != 0 and old_action != action:
+                            if old_action == 4:
+                                self._set_yellow_phase(3)
+                            else:
+                                self._set_yellow_phase(old_action)
+                            self._simulate(self._yellow_duration)
+                        # execute the phase selected before
+                        self._set_green_phase(action)
+                        self._simulate(self._green_duration)
+
+                        # saving variables for later & accumulate reward
+                        old_state = current_state
+                        old_action = action
                 old_action = 4
 
         total_reward = np.sum(self._reward_episode)
         self._total_wait_time = current_total_wait
         traci.close()
+        if self._Telemetry is not None:
+            self._Telemetry.flush()
+        if self._native_stl or self._trip_output:
+            edge_queues = self._queue_log.read_edges()[self._warmup_steps:]
+            self._queue_length_episode = queue_totals(edge_queues)
+            self._queue_log.close()
+            if self._Telemetry is not None:  # the step records of the episode, after its decisions
+                steps = np.arange(self._warmup_steps + 1, self._max_steps + 1)
+                self._Telemetry.steps(steps, self._phase_trace.phases(steps), edge_queues)
+                self._Telemetry.flush()
+                self._phase_trace = None
+        if trip_log is not None:
+            self._trip_stats = trip_log.read()
+            trip_log.close()
+        if self._Fork is not None:
+            self._Fork.close()
+            self._Fork = None
         simulation_time = round(timeit.default_timer() - start_time, 1)
         # print("Made {} stl cycles".format(counter))
 
@@ -114,16 +197,138 @@ class Simulation:
             steps_todo = self._max_steps - self._step
 
         while steps_todo > 0:
+            if self._RealTime is not None:
+                self._RealTime.wait(self._step)
             traci.simulationStep()  # simulate 1 step in sumo
+            self._Observation.subscribe_departed()
+            if self._Detectors is not None:
+                self._Detectors.step()
             self._step += 1  # update the step counter
             steps_todo -= 1
-            queue_length = self._get_queue_length()
-            self._queue_length_episode.append(queue_length)
+            if not (self._native_stl or self._trip_output):  # otherwise read from the queue log at the end
+                queue_length = self._get_queue_length()
+                self._queue_length_episode.append(queue_length)
+                if self._Telemetry is not None:
+                    self._Telemetry.step(self._step, self._phase, queue_length, self._edge_queues)
+
+    def _run_stl_cycle(self, old_action):
+        """
+        Runs the STL cycle as a sumo program, skipping to its end in a single simulation call
+        """
+        schedule, steps = stl_schedule(self._choose_stl_action, 126, self._green_duration, self._yellow_duration,
+                                       old_action)
+        install_program("TL", schedule)
+        if self._phase_trace is not None:
+            self._phase_trace.schedule(self._step, schedule)
+        target_step = min(self._step + steps, self._max_steps)
+        traci.simulationStep(float(target_step))
+        skipped_steps = target_step - self._step
+        self._step = target_step
+        traci.trafficlight.setProgram("TL", "0")  # back to the phases set by the agent
+        self._Observation.subscribe_missing()
+        if self._Detectors is not None:
+            self._Detectors.step(skipped_steps)
+
+    def _warm_up(self, episode, sumo_cmd):
+        """
+        Brings the simulation to the end of the warm-up under STL, loading it from the snapshot cache if possible,
+        returns the action of the last green phase
+        """
+        start_time = timeit.default_timer()
+        schedule, _ = stl_schedule(self._choose_stl_action, self._warmup_steps, self._green_duration,
+                                   self._yellow_duration)
+        key = None
+        if self._Snapshots is not None:
+            key = self._Snapshots.key(episode, self._TrafficGen.n_cars_generated, self._warmup_steps,
+                                      self._max_steps, self._green_duration, self._yellow_duration)
+        if key is None or not self._Snapshots.load(key):
+            # phase by phase, a program installed through traci would be saved and could not be loaded by sumo
+            step = 0
+            for phase, duration in schedule:
+                if step >= self._warmup_steps:
+                    break
+                traci.trafficlight.setPhase("TL", phase)
+                step = min(step + duration, self._warmup_steps)
+                traci.simulationStep(float(step))
+            if self._Snapshots is not None:
+                # a loaded state does not continue bit-exactly, so this episode continues from it in a new sumo
+                # like the later ones
+                self._Snapshots.save(key)
+                traci.close()
+                traci.start(sumo_cmd)
+                self._Snapshots.load(key)
+        self._step = self._warmup_steps
+        self._Observation.subscribe_all()
+        if self._Detectors is not None:
+            self._Detectors.subscribe()
+        self._warmup_time = timeit.default_timer() - start_time
+
+        step = 0
+        for phase, duration in schedule:
+            if step >= self._warmup_steps:
+                break
+            if phase % 2 == 0:
+                old_action = phase // 2
+            step += duration
+        return old_action
+
+    def evaluate_candidates(self, candidates, old_action):
+        """
+        Simulates every candidate sequence of actions from the current state, following 'old_action',
+        and returns the queue length summed over each of them. The branches run in a second sumo, the episode
+        continues unchanged
+        """
+        if self._Fork is None:
+            self._Fork = Fork(self._sumo_cmd)
+
+        def advance(steps):
+            queue_length = 0
+            for _ in range(steps):
+                traci.simulationStep()
+                queue_length += sum(traci.edge.getLastStepHaltingNumber(edge_id) for edge_id in INCOMING_EDGES)
+            return queue_length
+
+        def run_branch(actions):
+            queue_length = 0
+            last_action = old_action
+            for action in actions:
+                if last_action != -1 and last_action != action:
+                    self._set_yellow_phase(min(last_action, 3))
+                    queue_length += advance(self._yellow_duration)
+                self._set_green_phase(action)
+                queue_length += advance(self._green_duration)
+                last_action = action
+            return queue_length
+
+        phase = self._phase
+        traced = len(self._phase_trace) if self._phase_trace is not None else 0
+        queue_lengths = self._Fork.evaluate(candidates, run_branch)
+        self._phase = phase
+        if self._phase_trace is not None:
+            self._phase_trace.truncate(traced)
+        return queue_lengths
+
+    def _decided(self):
+        """
+        Records the latency of the decision in progress, from its observation to the phase it set
+        """
+        if self._RealTime is not None:
+            self._RealTime.end()
+
+    def _fallback_action(self, old_action):
+        """
+        Returns the action taken instead of a decision that missed its deadline
+        """
+        if self._RealTime.fallback == 'hold' and 0 <= old_action <= 3:
+            return old_action
+        return self._choose_stl_action(self._step, old_action)  # the phase of the STL cycle at this step
 
     def _collect_waiting_times(self):
         """
         Return current total waiting time of all incoming cars
         """
+        if self._Detectors is not None:
+            return self._Detectors.total_wait()
         incoming_roads = ["E2TL", "N2TL", "W2TL", "S2TL"]
         car_list = traci.vehicle.getIDList()
         for car_id in car_list:
@@ -141,7 +346,10 @@ class Simulation:
         """
         Chooses best q-value action
         """
-        prediction = self._Model.predict_one(state)
+        if self._QCache is not None:
+            prediction = self._QCache.predict_one(self._Model, state)
+        else:
+            prediction = self._Model.predict_one(state)
         if not allow_stl and np.argmax(prediction) == 4:
             try:
                 np.argsort(prediction[0])[::-1][1]
@@ -170,6 +378,9 @@ class Simulation:
         """
         yellow_phase_code = old_action * 2 + 1  # obtain the yellow phase code, based on the old action (ref on environment.net.xml)
         traci.trafficlight.setPhase("TL", yellow_phase_code)
+        self._phase = yellow_phase_code
+        if self._phase_trace is not None:
+            self._phase_trace.set(self._step, self._phase)
 
     def _set_green_phase(self, action_number):
         """
@@ -183,84 +394,30 @@ class Simulation:
             traci.trafficlight.setPhase("TL", PHASE_EW_GREEN)
         elif action_number == 3:
             traci.trafficlight.setPhase("TL", PHASE_EWL_GREEN)
+        self._phase = action_number * 2
+        if self._phase_trace is not None:
+            self._phase_trace.set(self._step, self._phase)
 
     def _get_queue_length(self):
         """
         Returns the current total queue length in the simulation
         """
+        if self._Detectors is not None:
+            self._edge_queues = self._Detectors.edge_queues(INCOMING_EDGES)
+            return self._Detectors.queue_length()
         halt_N = traci.edge.getLastStepHaltingNumber("N2TL")
         halt_S = traci.edge.getLastStepHaltingNumber("S2TL")
         halt_E = traci.edge.getLastStepHaltingNumber("E2TL")
         halt_W = traci.edge.getLastStepHaltingNumber("W2TL")
         queue_length = halt_N + halt_S + halt_E + halt_W
+        self._edge_queues = (halt_N, halt_S, halt_E, halt_W)  # for the telemetry of the step
         return queue_length
 
     def _get_state(self):
         """
-        Returns 1-d array-state according to uneven discretisation policy
+        Returns 1-d array-state of the intersection according to the observation spec
         """
-        state = np.zeros(self._num_states)
-        car_list = traci.vehicle.getIDList()
-
-        for car_id in car_list:
-            lane_pos = traci.vehicle.getLanePosition(car_id)
-            lane_id = traci.vehicle.getLaneID(car_id)
-            lane_pos = 750 - lane_pos
-            if lane_pos < 7:
-                lane_cell = 0
-            elif lane_pos < 14:
-                lane_cell = 1
-            elif lane_pos < 21:
-                lane_cell = 2
-            elif lane_pos < 28:
-                lane_cell = 3
-            elif lane_pos < 40:
-                lane_cell = 4
-            elif lane_pos < 60:
-                lane_cell = 5
-            elif lane_pos < 100:
-                lane_cell = 6
-            elif lane_pos < 160:
-                lane_cell = 7
-            elif lane_pos < 400:
-                lane_cell = 8
-            elif lane_pos <= 750:
-                lane_cell = 9
-
-            # finding the lane where the car is located 
-            # x2TL_3 are the "turn left only" lanes
-            if lane_id == "W2TL_0" or lane_id == "W2TL_1" or lane_id == "W2TL_2":
-                lane_group = 0
-            elif lane_id == "W2TL_3":
-                lane_group = 1
-            elif lane_id == "N2TL_0" or lane_id == "N2TL_1" or lane_id == "N2TL_2":
-                lane_group = 2
-            elif lane_id == "N2TL_3":
-                lane_group = 3
-            elif lane_id == "E2TL_0" or lane_id == "E2TL_1" or lane_id == "E2TL_2":
-                lane_group = 4
-            elif lane_id == "E2TL_3":
-                lane_group = 5
-            elif lane_id == "S2TL_0" or lane_id == "S2TL_1" or lane_id == "S2TL_2":
-                lane_group = 6
-            elif lane_id == "S2TL_3":
-                lane_group = 7
-            else:
-                lane_group = -1
-
-            if 1 <= lane_group <= 7:
-                car_position = int(str(lane_group) + str(lane_cell))  # composition a number in interval 0-79
-                valid_car = True
-            elif lane_group == 0:
-                car_position = lane_cell
-                valid_car = True
-            else:
-                valid_car = False  # flag for not detecting cars crossing the intersection or driving away from it
-
-            if valid_car:
-                state[car_position] = 1
-
-        return state
+        return self._Observation.observe()[0]
 
     def cumulative_total_wait(self):
         """
@@ -269,6 +426,18 @@ class Simulation:
         """
         return np.sum(self._queue_length_episode)
 
+    @property
+    def fallbacks(self):
+        return self._fallbacks
+
+    @property
+    def trip_stats(self):
+        return self._trip_stats
+
+    @property
+    def warmup_time(self):
+        return self._warmup_time
+
     @property
     def queue_length_episode(self):
         return self._queue_length_episode
@@ -3,6 +3,11 @@ import numpy as np
 import random
 import timeit
 import os
+
+from src.episode_pipeline import set_route_file
+from src.observation import ObservationSpec
+from src.telemetry import NO_EDGE_QUEUES, PhaseTrace
+from src.stl_program import INCOMING_EDGES, QueueLog, add_additional, install_program, queue_totals, stl_schedule
 from collections import defaultdict
 
 # phase codes based on environment.net.xml
@@ -18,7 +23,9 @@ PHASE_EWL_YELLOW = 7
 
 class Simulation:
     def __init__(self, Model, Memory, TrafficGen, sumo_cmd, gamma, max_steps, green_duration, yellow_duration,
-                 num_states, num_actions, training_epochs, is_greedy):
+                 num_states, num_actions, training_epochs, is_greedy, replay_chunk=100, ExperienceStore=None,
+                 Observation=None, Detectors=None, native_stl=False, QCache=None,
+                 Pipeline=None, stl_threshold=0.5, Telemetry=None):
         self._Model = Model
         self._Memory = Memory
         self._TrafficGen = TrafficGen
@@ -34,6 +41,20 @@ class Simulation:
         self._cumulative_wait_store = []
         self._training_epochs = training_epochs
         self._is_greedy = is_greedy
+        self._replay_chunk = replay_chunk
+        self._ExperienceStore = ExperienceStore
+        self._Observation = Observation or ObservationSpec(os.path.join('tlcs', 'environment.net.xml'))
+        self._Detectors = Detectors  # None to poll the vehicles and edges through TraCI
+        self._native_stl = native_stl  # STL cycles run as a sumo program instead of phase by phase
+        self._queue_log = None
+        self._QCache = QCache  # None runs the model on every greedy decision
+        self._Pipeline = Pipeline  # None generates the routes and starts sumo at the beginning of every episode
+        self._startup_time = 0
+        self._stl_threshold = stl_threshold  # occupied share of the cells from which an STL cycle is allowed
+        self._Telemetry = Telemetry  # None keeps no per-step log
+        self._phase = -1  # the phase last set by the agent
+        self._edge_queues = NO_EDGE_QUEUES
+        self._phase_trace = None  # phases of the steps whose queues are read from sumo, for the telemetry
 
     def run(self, episode, epsilon):
         """
@@ -42,8 +63,16 @@ class Simulation:
         start_time = timeit.default_timer()
 
         # first, generate the route file for this simulation and set up sumo
-        self._TrafficGen.generate_routefile(seed=episode)
-        traci.start(self._sumo_cmd)
+        if self._Pipeline is not None:  # prepared in the background during the last episode
+            self._queue_log = self._Pipeline.start(episode, self._prepare_episode)
+            self._Pipeline.prefetch(episode + 1, self._prepare_episode)
+        else:
+            self._queue_log = self._prepare_episode(episode)
+        if self._Detectors is not None:
+            self._Detectors.start()
+        if self._queue_log is not None and self._Telemetry is not None:
+            self._phase_trace = PhaseTrace()
+        self._startup_time = timeit.default_timer() - start_time
 
         # inits
         self._step = 0
@@ -56,9 +85,10 @@ class Simulation:
         old_total_wait = 0
         old_state = -1
         old_action = -1
-        threshold = 0.5
         counter = 0
         action_frequency = defaultdict(lambda: 0)
+        if self._Telemetry is not None:
+            self._Telemetry.begin(episode)
         while self._step < self._max_steps:
             current_state = self._get_state()
 
@@ -70,11 +100,17 @@ class Simulation:
 
             if self._step != 0:
                 self._Memory.add_sample((old_state, old_action, reward, current_state))
+                if self._ExperienceStore is not None:
+                    self._ExperienceStore.add_sample((old_state, old_action, reward, current_state))
 
 
-            allow_stl = sum(current_state) / len(current_state) >= threshold
+            allow_stl = self._Observation.occupied_share(current_state) >= self._stl_threshold
             # choose the light phase to activate, based on the current state of the intersection
+            decision_time = timeit.default_timer()
             action = self._choose_action(current_state, epsilon, allow_stl=allow_stl)
+            if self._Telemetry is not None:
+                self._Telemetry.decision(self._step, self._phase, action, reward,
+                                         (timeit.default_timer() - decision_time) * 1000)
             action_frequency[action] += 1
 
             # add exploration reward if not epsilon_greedy
@@ -104,40 +140,73 @@ class Simulation:
                 initial_step = self._step
                 old_total_wait = current_total_wait
 
-                while self._step < (initial_step + 126) and self._step < self._max_steps:
-                    # choose the light phase to activate, based on the current state of the intersection
-                    action = self._choose_stl_action(self._step - initial_step, old_action)
-                    if self._step != 0 and old_action != action:
-                        if old_action == 4:
-                            self._set_yellow_phase(3)
-                        else:
-                            try:
-                                self._set_yellow_phase(old_action)
-                            except:
-                                print(action, old_action)
-                        self._simulate(self._yellow_duration)
-                    # execute the phase selected before
-                    self._set_green_phase(action)
-                    self._simulate(self._green_duration)
-
-                    # saving variables for later & accumulate reward
-                    old_state = current_state
-                    old_action = action
+                if self._native_stl:
+                    self._run_stl_cycle(old_action)
+                else:
+                    while self._step < (initial_step + 126) and self._step < self._max_steps:
+                        # choose the light phase to activate, based on the current state of the intersection
+                        action = self._choose_stl_action(self._step - initial_step, old_action)
+                        if self._step != 0 and old_action != action:
+                            if old_action == 4:
+                                self._set_yellow_phase(3)
+                            else:
+                                try:
+                                    self._set_yellow_phase(old_action)
+                                except:
+                                    print(action, old_action)
+                            self._simulate(self._yellow_duration)
+                        # execute the phase selected before
+                        self._set_green_phase(action)
+                        self._simulate(self._green_duration)
+
+                        # saving variables for later & accumulate reward
+                        old_state = current_state
+                        old_action = action
                 old_action = 4
 
+        traci.close()
+        if self._native_stl:
+            edge_queues = self._queue_log.read_edges()
+            self._sum_queue_length = self._sum_waiting_time = sum(queue_totals(edge_queues))
+            self._queue_log.close()
+            if self._Telemetry is not None:  # the step records of the episode, after its decisions
+                steps = np.arange(1, self._max_steps + 1)
+                self._Telemetry.steps(steps, self._phase_trace.phases(steps), edge_queues)
+                self._phase_trace = None
+        if self._Telemetry is not None:  # the records of the episode are visible while the model trains
+            self._Telemetry.flush()
         self._save_episode_stats()
         print("Total reward:", self._sum_reward, "- Epsilon:", round(epsilon, 2))
-        traci.close()
+        if self._ExperienceStore is not None:
+            self._ExperienceStore.flush()
         simulation_time = round(timeit.default_timer() - start_time, 1)
         print("Made {} stl cycles".format(counter))
         print("Training...")
         start_time = timeit.default_timer()
-        for _ in range(self._training_epochs):
-            self._replay()
+        epochs_done = 0
+        while epochs_done < self._training_epochs:
+            n_batches = min(self._replay_chunk, self._training_epochs - epochs_done)
+            self._replay(n_batches)
+            epochs_done += n_batches
         training_time = round(timeit.default_timer() - start_time, 1)
 
         return simulation_time, training_time
 
+    def _prepare_episode(self, episode, label='default', route_file=None):
+        """
+        Generates the routes of 'episode' and starts its sumo under 'label', returns the queue log of the episode
+        """
+        self._TrafficGen.generate_routefile(seed=episode, route_file=route_file)
+        sumo_cmd = self._sumo_cmd
+        if route_file is not None:
+            sumo_cmd = set_route_file(sumo_cmd, route_file)
+        queue_log = None
+        if self._native_stl:  # sumo aggregates the queue lengths, also while it skips the STL cycles
+            queue_log = QueueLog(INCOMING_EDGES, self._max_steps)
+            sumo_cmd = add_additional(sumo_cmd, queue_log.path)
+        traci.start(sumo_cmd, label=label, doSwitch=label == 'default')
+        return queue_log
+
     def _simulate(self, steps_todo):
         """
         Simulates 'steps_todo' steps
@@ -147,17 +216,43 @@ class Simulation:
 
         while steps_todo > 0:
             traci.simulationStep()
+            self._Observation.subscribe_departed()
+            if self._Detectors is not None:
+                self._Detectors.step()
             self._step += 1
             steps_todo -= 1
-            queue_length = self._get_queue_length()
-            self._sum_queue_length += queue_length
-            self._sum_waiting_time += queue_length
-            # 1 step while waiting in queue means 1 second waited, for each car, therefore queue_length == waited_seconds
+            if not self._native_stl:  # otherwise read from the queue log at the end of the episode
+                queue_length = self._get_queue_length()
+                if self._Telemetry is not None:
+                    self._Telemetry.step(self._step, self._phase, queue_length, self._edge_queues)
+                self._sum_queue_length += queue_length
+                self._sum_waiting_time += queue_length
+                # 1 step while waiting in queue means 1 second waited, for each car, therefore queue_length == waited_seconds
+
+    def _run_stl_cycle(self, old_action):
+        """
+        Runs the STL cycle as a sumo program, skipping to its end in a single simulation call
+        """
+        schedule, steps = stl_schedule(self._choose_stl_action, 126, self._green_duration, self._yellow_duration,
+                                       old_action)
+        install_program("TL", schedule)
+        if self._phase_trace is not None:
+            self._phase_trace.schedule(self._step, schedule)
+        target_step = min(self._step + steps, self._max_steps)
+        traci.simulationStep(float(target_step))
+        skipped_steps = target_step - self._step
+        self._step = target_step
+        traci.trafficlight.setProgram("TL", "0")  # back to the phases set by the agent
+        self._Observation.subscribe_missing()
+        if self._Detectors is not None:
+            self._Detectors.step(skipped_steps)
 
     def _collect_waiting_times(self):
         """
         Return current total waiting time of all incoming cars
         """
+        if self._Detectors is not None:
+            return self._Detectors.total_wait()
         incoming_roads = ["E2TL", "N2TL", "W2TL", "S2TL"]
         car_list = traci.vehicle.getIDList()
         for car_id in car_list:
@@ -179,7 +274,10 @@ class Simulation:
         if random.random() < epsilon and self._is_greedy:
             return random.randint(0, self._num_actions - 1)  # random action
         else:
-            prediction = self._Model.predict_one(state)
+            if self._QCache is not None:
+                prediction = self._QCache.predict_one(self._Model, state)
+            else:
+                prediction = self._Model.predict_one(state)
             if not allow_stl and np.argmax(prediction) == 4:
                 try:
                     np.argsort(prediction[0])[::-1][1]
@@ -208,6 +306,9 @@ class Simulation:
         """
         yellow_phase_code = old_action * 2 + 1  # obtain the yellow phase code, based on the old action (ref on environment.net.xml)
         traci.trafficlight.setPhase("TL", yellow_phase_code)
+        self._phase = yellow_phase_code
+        if self._phase_trace is not None:
+            self._phase_trace.set(self._step, self._phase)
 
     def _set_green_phase(self, action_number):
         """
@@ -223,112 +324,41 @@ class Simulation:
             traci.trafficlight.setPhase("TL", PHASE_EWL_GREEN)
         elif action_number == 4:
             print("Unexpected behaviour, ignoring...")
+            return
+        self._phase = action_number * 2
+        if self._phase_trace is not None:
+            self._phase_trace.set(self._step, self._phase)
 
     def _get_queue_length(self):
         """
         Returns the current total queue length in the simulation
         """
+        if self._Detectors is not None:
+            self._edge_queues = self._Detectors.edge_queues(INCOMING_EDGES)
+            return self._Detectors.queue_length()
         halt_N = traci.edge.getLastStepHaltingNumber("N2TL")
         halt_S = traci.edge.getLastStepHaltingNumber("S2TL")
         halt_E = traci.edge.getLastStepHaltingNumber("E2TL")
         halt_W = traci.edge.getLastStepHaltingNumber("W2TL")
         queue_length = halt_N + halt_S + halt_E + halt_W
+        self._edge_queues = (halt_N, halt_S, halt_E, halt_W)  # for the telemetry of the step
         return queue_length
 
     def _get_state(self):
         """
-        Returns 1-d array-state according to uneven discretisation policy
+        Returns 1-d array-state of the intersection according to the observation spec
         """
-        state = np.zeros(self._num_states)
-        car_list = traci.vehicle.getIDList()
+        return self._Observation.observe()[0]
 
-        for car_id in car_list:
-            lane_pos = traci.vehicle.getLanePosition(car_id)
-            lane_id = traci.vehicle.getLaneID(car_id)
-            lane_pos = 750 - lane_pos
-            if lane_pos < 7:
-                lane_cell = 0
-            elif lane_pos < 14:
-                lane_cell = 1
-            elif lane_pos < 21:
-                lane_cell = 2
-            elif lane_pos < 28:
-                lane_cell = 3
-            elif lane_pos < 40:
-                lane_cell = 4
-            elif lane_pos < 60:
-                lane_cell = 5
-            elif lane_pos < 100:
-                lane_cell = 6
-            elif lane_pos < 160:
-                lane_cell = 7
-            elif lane_pos < 400:
-                lane_cell = 8
-            elif lane_pos <= 750:
-                lane_cell = 9
-
-            # finding the lane where the car is located 
-            # x2TL_3 are the "turn left only" lanes
-            if lane_id == "W2TL_0" or lane_id == "W2TL_1" or lane_id == "W2TL_2":
-                lane_group = 0
-            elif lane_id == "W2TL_3":
-                lane_group = 1
-            elif lane_id == "N2TL_0" or lane_id == "N2TL_1" or lane_id == "N2TL_2":
-                lane_group = 2
-            elif lane_id == "N2TL_3":
-                lane_group = 3
-            elif lane_id == "E2TL_0" or lane_id == "E2TL_1" or lane_id == "E2TL_2":
-                lane_group = 4
-            elif lane_id == "E2TL_3":
-                lane_group = 5
-            elif lane_id == "S2TL_0" or lane_id == "S2TL_1" or lane_id == "S2TL_2":
-                lane_group = 6
-            elif lane_id == "S2TL_3":
-                lane_group = 7
-            else:
-                lane_group = -1
-
-            if 1 <= lane_group <= 7:
-                car_position = int(str(lane_group) + str(lane_cell))  # composition a number in interval 0-79
-                valid_car = True
-            elif lane_group == 0:
-                car_position = lane_cell
-                valid_car = True
-            else:
-                valid_car = False  # flag for not detecting cars crossing the intersection or driving away from it
-
-            if valid_car:
-                state[car_position] = 1
-
-        return state
-
-    def _replay(self):
+    def _replay(self, n_batches):
         """
-        Initiates learning from memorised samples, i.e. replay
+        Initiates learning from memorised samples, i.e. replay, running 'n_batches' updates in one model call
         """
-        batch = self._Memory.get_samples(self._Model.batch_size)
-
-        if len(batch) > 0:  # if the memory is full enough
-            states = np.array([val[0] for val in batch])  # extract states from the batch
-            next_states = np.array([val[3] for val in batch])  # extract next states from the batch
-
-            # prediction
-            q_current = self._Model.predict_batch(states)  # predict Q(state), for every sample
-            q_future = self._Model.predict_batch(next_states)  # predict Q(next_state), for every sample
+        batches = self._Memory.get_batches(self._Model.batch_size, n_batches)
 
-            # setup training arrays
-            x = np.zeros((len(batch), self._num_states))
-            y = np.zeros((len(batch), self._num_actions))
-
-            for i, b in enumerate(batch):
-                state, action, reward, _ = b[0], b[1], b[2], b[3]  # extract data from one sample
-                current_q = q_current[i]  # get the Q(state) predicted before
-                current_q[action] = reward + self._gamma * np.amax(
-                    q_future[i])  # update Q(state, action) according to Bellman
-                x[i] = state
-                y[i] = current_q  # Q(state) that includes the updated action value
-
-            self._Model.train_batch(x, y)  # train the NN
+        if batches is not None:  # if the memory is full enough
+            states, actions, rewards, next_states = batches
+            self._Model.train_replay(states, actions, rewards, next_states, self._gamma)  # train the NN
 
     def _save_episode_stats(self):
         """
@@ -338,6 +368,13 @@ class Simulation:
         self._cumulative_wait_store.append(
             self._sum_waiting_time)  # total number of seconds waited by cars in this episode
 
+    @property
+    def startup_time(self):
+        """
+        Time from the call of run to the first step of the last episode
+        """
+        return self._startup_time
+
     @property
     def reward_store(self):
         return self._reward_store
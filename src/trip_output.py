@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+# tripinfo attributes of the per-vehicle statistics
+TRIP_METRICS = {'time_loss': 'timeLoss', 'waiting_time': 'waitingTime'}
+
+
+class TripLog:
+    """
+    Class of the tripinfo output of an episode, written by sumo for every vehicle as it arrives, and read back
+    incrementally into fixed-size histograms, so that memory does not grow with the number of vehicles
+    """
+    def __init__(self, max_steps, resolution=0.1):
+        self._dir = tempfile.mkdtemp(prefix='trip_log_')
+        self._output = os.path.join(self._dir, 'tripinfo.xml')
+        self._resolution = resolution  # seconds per histogram bin, the precision of the percentiles
+        self._bins = int(np.ceil(max_steps / resolution)) + 1
+
+    def add_output(self, sumo_cmd):
+        """
+        Returns 'sumo_cmd' writing the trips, also of the vehicles still running when the episode ends
+        """
+        return list(sumo_cmd) + ["--tripinfo-output", self._output, "--tripinfo-output.write-unfinished", "true"]
+
+    def read(self):
+        """
+        Returns the number of vehicles and the mean, 95th percentile and maximum of their time loss and waiting time,
+        to be called after traci.close
+        """
+        histograms = {metric: np.zeros(self._bins, dtype=np.int64) for metric in TRIP_METRICS}
+        sums = dict.fromkeys(TRIP_METRICS, 0.0)
+        maxima = dict.fromkeys(TRIP_METRICS, 0.0)
+        vehicles = 0
+        root = None
+        for event, element in ET.iterparse(self._output, events=('start', 'end')):
+            if root is None:
+                root = element
+            if event != 'end' or element.tag != 'tripinfo':
+                continue
+            for metric, attribute in TRIP_METRICS.items():
+                value = float(element.get(attribute, 0))
+                sums[metric] += value
+                maxima[metric] = max(maxima[metric], value)
+                histograms[metric][min(int(value / self._resolution), self._bins - 1)] += 1
+            vehicles += 1
+            root.clear()  # drops the trips read so far, with their emission or device children
+
+        stats = {'vehicles': vehicles}
+        for metric in TRIP_METRICS:
+            stats[metric + '_mean'] = sums[metric] / vehicles if vehicles else 0.0
+            stats[metric + '_p95'] = self._percentile(histograms[metric], 0.95) if vehicles else 0.0
+            stats[metric + '_max'] = maxima[metric]
+        return stats
+
+    def _percentile(self, histogram, q):
+        """
+        Returns the upper edge of the bin holding the 'q' quantile
+        """
+        cumulative = np.cumsum(histogram)
+        return (int(np.searchsorted(cumulative, q * cumulative[-1])) + 1) * self._resolution
+
+    @property
+    def path(self):
+        return self._output
+
+    def close(self):
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+
+def interval_means(queue_lengths, interval):
+    """
+    Returns the queue length averaged over consecutive intervals of 'interval' steps
+    """
+    queue_lengths = np.asarray(queue_lengths, dtype=float)
+    n_intervals = int(np.ceil(len(queue_lengths) / interval))
+    return [float(queue_lengths[i * interval:(i + 1) * interval].mean()) for i in range(n_intervals)]
@@ -1,8 +1,12 @@
 import configparser
+import xml.etree.ElementTree as ET
 from sumolib import checkBinary
 import os
+import re
 import sys
 
+from src.observation import ObservationSpec, CELL_EDGES
+
 
 def import_train_configuration(config_file):
     """
@@ -17,17 +21,32 @@ def import_train_configuration(config_file):
               'green_duration': content['simulation'].getint('green_duration'),
               'yellow_duration': content['simulation'].getint('yellow_duration'),
               'is_greedy': content['simulation'].getboolean('is_greedy'),
+              'checkpoint_interval': content['simulation'].getint('checkpoint_interval', fallback=1),
+              'detectors': content['simulation'].getboolean('detectors', fallback=False),
+              'native_stl': content['simulation'].getboolean('native_stl', fallback=False),
+              'prefetch': content['simulation'].getboolean('prefetch', fallback=False),
+              'actors': content['simulation'].getint('actors', fallback=2),
+              'telemetry_path': content['simulation'].get('telemetry_path', fallback=''),
               'num_layers': content['model'].getint('num_layers'),
               'width_layers': content['model'].getint('width_layers'),
               'batch_size': content['model'].getint('batch_size'),
               'learning_rate': content['model'].getfloat('learning_rate'),
               'training_epochs': content['model'].getint('training_epochs'), 'optimizer': content['model']['optimizer'],
+              'replay_chunk': content['model'].getint('replay_chunk', fallback=100),
+              'jit_compile': content['model'].getboolean('jit_compile', fallback=False),
               'memory_size_min': content['memory'].getint('memory_size_min'),
               'memory_size_max': content['memory'].getint('memory_size_max'),
-              'num_states': content['agent'].getint('num_states'),
+              'experience_path': content['memory'].get('experience_path', fallback=''),
+              'record_experience': content['memory'].getboolean('record_experience', fallback=False),
+              'warm_start_samples': content['memory'].getint('warm_start_samples', fallback=0),
+              'pretrain_epochs': content['memory'].getint('pretrain_epochs', fallback=0),
               'num_actions': content['agent'].getint('num_actions'), 'gamma': content['agent'].getfloat('gamma'),
+              'q_cache_size': content['agent'].getint('q_cache_size', fallback=0),
+              'stl_threshold': content['agent'].getfloat('stl_threshold', fallback=0.5),
+              'sparse_input': content['agent'].getboolean('sparse_input', fallback=False),
               'models_path_name': content['dir']['models_path_name'],
               'sumocfg_file_name': content['dir']['sumocfg_file_name']}
+    config.update(import_observation_configuration(content, config['sumocfg_file_name']))
     return config
 
 
@@ -44,15 +63,57 @@ def import_test_configuration(config_file):
     config['episode_seed'] = content['simulation'].getint('episode_seed')
     config['green_duration'] = content['simulation'].getint('green_duration')
     config['yellow_duration'] = content['simulation'].getint('yellow_duration')
-    config['num_states'] = content['agent'].getint('num_states')
+    config['detectors'] = content['simulation'].getboolean('detectors', fallback=False)
+    config['native_stl'] = content['simulation'].getboolean('native_stl', fallback=False)
+    config['warmup_steps'] = content['simulation'].getint('warmup_steps', fallback=0)
+    config['trip_output'] = content['simulation'].getboolean('trip_output', fallback=False)
+    config['queue_interval'] = content['simulation'].getint('queue_interval', fallback=300)
+    config['telemetry_path'] = content['simulation'].get('telemetry_path', fallback='')
+    config['snapshot_path'] = content.get('snapshot', 'snapshot_path', fallback='snapshots')
+    config['snapshot_disk_mb'] = content.getint('snapshot', 'snapshot_disk_mb', fallback=512)
+    config['snapshot_memory_mb'] = content.getint('snapshot', 'snapshot_memory_mb', fallback=64)
+    config['confidence'] = content.getfloat('evaluation', 'confidence', fallback=0.95)
+    config['precision'] = content.getfloat('evaluation', 'precision', fallback=0.02)
+    config['min_episodes'] = content.getint('evaluation', 'min_episodes', fallback=3)
+    config['model_cache_mb'] = content.getint('evaluation', 'model_cache_mb', fallback=1024)
+    config['use_server'] = content.getboolean('server', 'use_server', fallback=False)
+    config['server_address'] = content.get('server', 'address', fallback='/tmp/tlcs_policy.sock')
+    config['server_max_batch'] = content.getint('server', 'max_batch', fallback=256)
+    config['server_max_wait_ms'] = content.getfloat('server', 'max_wait_ms', fallback=2)
+    config['server_authkey'] = content.get('server', 'authkey', fallback='')
+    config['realtime'] = content.getboolean('realtime', 'realtime', fallback=False)
+    config['speed_up'] = content.getfloat('realtime', 'speed_up', fallback=1.0)
+    config['deadline_ms'] = content.getfloat('realtime', 'deadline_ms', fallback=100)
+    config['fallback'] = content.get('realtime', 'fallback', fallback='stl')
+    config['jobs_address'] = content.get('jobs', 'address', fallback='localhost:6010')
+    config['jobs_store_path'] = content.get('jobs', 'store_path', fallback='jobs')
+    config['lease_seconds'] = content.getfloat('jobs', 'lease_seconds', fallback=60)
+    config['max_attempts'] = content.getint('jobs', 'max_attempts', fallback=3)
     config['num_actions'] = content['agent'].getint('num_actions')
+    config['q_cache_size'] = content['agent'].getint('q_cache_size', fallback=0)
+    config['sparse_input'] = content['agent'].getboolean('sparse_input', fallback=False)
     config['sumocfg_file_name'] = content['dir']['sumocfg_file_name']
     config['models_path_name'] = content['dir']['models_path_name']
     config['model_to_test'] = content['dir'].getint('model_to_test') 
+    config.update(import_observation_configuration(content, config['sumocfg_file_name']))
     return config
 
 
-def set_sumo(gui, sumocfg_file_name, max_steps):
+def import_observation_configuration(content, sumocfg_file_name):
+    """
+    Read the observation settings of the [agent] section, num_states is derived from them and the net-file
+    """
+    sumocfg = ET.parse(os.path.join('tlcs', sumocfg_file_name)).getroot()
+    net_file = os.path.join('tlcs', sumocfg.find('input/net-file').get('value'))
+    cell_edges = content['agent'].get('cell_edges', fallback='')
+    cell_edges = [float(edge) for edge in cell_edges.split()] if cell_edges.strip() else CELL_EDGES
+    channels = content['agent'].get('channels', fallback='occupancy').split()
+    config = {'net_file': net_file, 'cell_edges': cell_edges, 'channels': channels,
+              'num_states': ObservationSpec(net_file, cell_edges, channels).num_states}
+    return config
+
+
+def set_sumo(gui, sumocfg_file_name, max_steps, route_file=None, additional_file=None):
     """
     Configure various parameters of SUMO
     """
@@ -71,27 +132,33 @@ def set_sumo(gui, sumocfg_file_name, max_steps):
  
     # setting the cmd command to run sumo at simulation time
     sumo_cmd = [sumoBinary, "-c", os.path.join('tlcs', sumocfg_file_name), "--no-step-log", "true", "--waiting-time-memory", str(max_steps)]
+    if route_file is not None:  # concurrent runs each need their own route file
+        sumo_cmd += ["-r", route_file]
+    if additional_file is not None:
+        sumo_cmd += ["-a", additional_file]
 
     return sumo_cmd
 
 
 def set_train_path(models_path_name):
     """
-    Create a new model path with an incremental integer, also considering previously created model paths
+    Create a new model path with an incremental integer, also considering previously created model paths,
+    safe to call from concurrently running trainers
     """
     models_path = os.path.join(os.getcwd(), models_path_name, '')
     os.makedirs(os.path.dirname(models_path), exist_ok=True)
 
-    dir_content = os.listdir(models_path)
-    if dir_content:
-        previous_versions = [int(name.split("_")[1]) for name in dir_content]
-        new_version = str(max(previous_versions) + 1)
-    else:
-        new_version = '1'
+    while True:
+        previous_versions = [int(name.split("_")[1]) for name in os.listdir(models_path)
+                             if re.fullmatch(r'model_\d+', name)]
+        new_version = str(max(previous_versions) + 1) if previous_versions else '1'
 
-    data_path = os.path.join(models_path, 'model_'+new_version, '')
-    os.makedirs(os.path.dirname(data_path), exist_ok=True)
-    return data_path 
+        data_path = os.path.join(models_path, 'model_'+new_version, '')
+        try:
+            os.mkdir(os.path.dirname(data_path))  # fails if another trainer took this number meanwhile
+            return data_path
+        except FileExistsError:
+            continue
 
 
 def set_test_path(models_path_name, model_n):
@@ -76,6 +76,23 @@ class Visualization:
         fig.savefig(os.path.join(self._path, 'plot_' + filename + '.png'), dpi=self._dpi)
         plt.close("all")
 
+    def plot_series(self, series, filename, xlabel, ylabel, log_x=False):
+        """
+        Plots one line per label of 'series', a dict of label -> (x values, y values)
+        """
+        plt.rcParams.update({'font.size': 24})  # set bigger font size
+        for label, (x, y) in series.items():
+            plt.plot(x, y, marker='o', label=label)
+        if log_x:
+            plt.xscale('log')
+        plt.legend()
+        plt.ylabel(ylabel)
+        plt.xlabel(xlabel)
+        fig = plt.gcf()
+        fig.set_size_inches(20, 11.25)
+        fig.savefig(os.path.join(self._path, 'plot_' + filename + '.png'), dpi=self._dpi)
+        plt.close("all")
+
     def plot_timings(self, timings):
         count, bins, ignored = plt.hist(timings, bins=50)
         plt.savefig(os.path.join(self._path, 'plot_timings.png'), dpi=self._dpi)
@@ -0,0 +1,37 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import json
+import os
+import sys
+
+from src.sweep import SweepScheduler
+
+
+def run_trial(config_file, path, metrics_file, threads):
+    """
+    Trains a single sweep trial within its thread budget and writes its metrics
+    """
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    from batch_trainer import train
+    stores = train(config_file, path, os.path.basename(os.path.normpath(path)),
+                   route_file=os.path.join(path, 'episode_routes.rou.xml'))
+
+    metrics = {'final_reward': stores['reward'][-1] if stores['reward'] else None,
+               'final_delay': stores['delay'][-1] if stores['delay'] else None,
+               'best_delay': min(stores['delay']) if stores['delay'] else None,
+               'delay': stores['delay']}
+    with open(metrics_file, 'w') as f:
+        json.dump(metrics, f, default=float)
+
+
+if __name__ == "__main__":
+    # python sweep.py settings/sweep_settings.ini - runs (or resumes) the sweep
+    # python sweep.py --trial <config> <model path> <metrics file> <threads> - used by the scheduler
+    if len(sys.argv) > 1 and sys.argv[1] == '--trial':
+        run_trial(sys.argv[2], sys.argv[3], sys.argv[4], int(sys.argv[5]))
+    else:
+        SweepScheduler(sys.argv[1] if len(sys.argv) > 1 else 'settings/sweep_settings.ini').run()
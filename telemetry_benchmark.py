@@ -0,0 +1,83 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import tempfile
+import timeit
+
+import numpy as np
+
+from src.benchmark_stl import Simulation
+from src.generator import TrafficGenerator
+from src.telemetry import RECORD, TelemetryLog, TelemetryReader, TelemetrySummary
+from src.utils import import_test_configuration, set_sumo
+
+
+def write_cost(n_records=100000):
+    """
+    Returns the seconds to append a record to a telemetry log
+    """
+    path = os.path.join(tempfile.mkdtemp(prefix='telemetry_'), 'telemetry.bin')
+    telemetry = TelemetryLog(path)
+    edge_queues = (3, 0, 5, 1)
+    start_time = timeit.default_timer()
+    for step in range(n_records):
+        telemetry.step(step, 2, 9, edge_queues)
+    elapsed = timeit.default_timer() - start_time
+    telemetry.close()
+    os.remove(path)
+    return elapsed / n_records
+
+
+def episode_time(config, sumo_cmd, n_cars, native_stl, telemetry):
+    simulation = Simulation(TrafficGenerator(config['max_steps'], n_cars), sumo_cmd, config['max_steps'],
+                            config['green_duration'], config['yellow_duration'], config['num_states'],
+                            config['num_actions'], native_stl, False, telemetry)
+    start_time = timeit.default_timer()
+    simulation.run(config['episode_seed'])
+    return timeit.default_timer() - start_time
+
+
+if __name__ == "__main__":
+    # the STL episode polled step by step, and run natively with the steps logged from the queues of sumo,
+    # with and without the telemetry log, and the time to summarize the log
+    config = import_test_configuration(config_file='settings/testing_settings.ini')
+    sumo_cmd = set_sumo(False, config['sumocfg_file_name'], config['max_steps'])
+    os.makedirs('benchmark', exist_ok=True)
+    repeats = 15  # the overhead is a few percent at most, within the noise of a single pair of episodes
+    record_time = write_cost()
+
+    with open(os.path.join('benchmark', 'telemetry.txt'), 'a') as f:
+        for native_stl, n_cars in [(False, 1000), (False, 2500), (False, 3500), (True, 2500)]:
+            path = os.path.join(tempfile.mkdtemp(prefix='telemetry_'), 'telemetry.bin')
+            telemetry = TelemetryLog(path)
+            without, logged = [], []
+            for i in range(repeats):  # interleaved, so that both see the same load of the machine
+                if i % 2:
+                    logged.append(episode_time(config, sumo_cmd, n_cars, native_stl, telemetry))
+                without.append(episode_time(config, sumo_cmd, n_cars, native_stl, None))
+                if not i % 2:
+                    logged.append(episode_time(config, sumo_cmd, n_cars, native_stl, telemetry))
+            telemetry.close()
+
+            start_time = timeit.default_timer()
+            reader = TelemetryReader(path)
+            summary = TelemetrySummary()
+            records = reader.poll()
+            while len(records):
+                summary.add(records)
+                records = reader.poll()
+            read_time = timeit.default_timer() - start_time
+            os.remove(path)
+
+            records_per_episode = reader.count / repeats
+            overhead = 100 * (np.array(logged) / np.array(without) - 1)  # of the pairs of consecutive episodes
+            line = ("{}{} cars, {} pairs: episode median {:.2f} s without telemetry, {:.2f} s with, overhead median "
+                    "{:+.1f}% (quartiles {:+.1f}% {:+.1f}%), {:.0f} records of {} bytes written in {:.1f} ms "
+                    "({:.2f}% of the episode), {} records summarized in {:.1f} ms").format(
+                'native STL, ' if native_stl else '', n_cars, repeats, np.median(without), np.median(logged), np.median(overhead),
+                np.percentile(overhead, 25), np.percentile(overhead, 75), records_per_episode, RECORD.itemsize,
+                records_per_episode * record_time * 1000, 100 * records_per_episode * record_time / np.median(without),
+                reader.count, read_time * 1000)
+            print(line)
+            f.write(line + "\n")
@@ -0,0 +1,41 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import sys
+import time
+
+from src.telemetry import TelemetryReader, TelemetrySummary
+
+
+def print_episode(summary, episode):
+    stats = summary.episode(episode)
+    queue = "queue mean {:.2f} max {:.0f}".format(stats['mean_queue'], stats['max_queue']) \
+        if stats['mean_queue'] is not None else "queue not logged"
+    print("episode {episode}, step {last_step}: {decisions} decisions, {stl_cycles} stl cycles, "
+          "total reward {total_reward:.1f}, {queue}, latency mean {mean_latency_ms:.2f} ms "
+          "max {max_latency_ms:.2f} ms".format(queue=queue, **stats), flush=True)
+
+
+if __name__ == "__main__":
+    # python telemetry_tail.py <telemetry log> - summarizes every episode of the log
+    # python telemetry_tail.py <telemetry log> --follow - summarizes the running episode every second, until stopped
+    reader = TelemetryReader(sys.argv[1])
+    summary = TelemetrySummary()
+    if '--follow' in sys.argv:
+        try:
+            while True:
+                records = reader.poll()
+                if len(records):
+                    summary.add(records)
+                    print_episode(summary, int(records['episode'][-1]))
+                else:
+                    time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+    else:
+        records = reader.poll()
+        while len(records):  # in chunks, the log is never loaded whole
+            summary.add(records)
+            records = reader.poll()
+        for episode in summary.episodes:
+            print_episode(summary, episode)
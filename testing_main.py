@@ -7,19 +7,34 @@ from shutil import copyfile
 from src.testing_simulation import Simulation
 from src.generator import TrafficGenerator
 from src.model import TestModel
+from src.observation import ObservationSpec
+from src.detectors import DetectorMeter
+from src.snapshot import SnapshotCache
+from src.q_cache import QValueCache
+from src.policy_server import PolicyClient
+from src.trip_output import interval_means
+from src.realtime import RealTimeMonitor
+from src.telemetry import TelemetryLog
 from src.visualization import Visualization
 from src.utils import import_test_configuration, set_sumo, set_test_path
 
 
 if __name__ == "__main__":
     config = import_test_configuration(config_file='settings/testing_settings.ini')
-    sumo_cmd = set_sumo(config['gui'], config['sumocfg_file_name'], config['max_steps'])
     model_path, plot_path = set_test_path(config['models_path_name'], config['model_to_test'])
 
-    Model = TestModel(
-        input_dim=config['num_states'],
-        model_path=model_path
-    )
+    observation = ObservationSpec(config['net_file'], config['cell_edges'], config['channels'])
+
+    if config['use_server']:  # the model is served by policy_server.py
+        Model = PolicyClient(config['server_address'], config['model_to_test'], config['num_states'],
+                             config['server_authkey'])
+    else:
+        Model = TestModel(
+            input_dim=config['num_states'],
+            model_path=model_path,
+            sparse_input=config['sparse_input'],
+            binary=observation.is_binary
+        )
 
     TrafficGen = TrafficGenerator(
         config['max_steps'], 
@@ -31,6 +46,25 @@ if __name__ == "__main__":
         dpi=96
     )
         
+    detectors = DetectorMeter(observation.network) if config['detectors'] else None
+    sumo_cmd = set_sumo(config['gui'], config['sumocfg_file_name'], config['max_steps'],
+                        additional_file=detectors.path if detectors else None)
+    snapshots = None
+    if config['warmup_steps'] > 0:
+        snapshots = SnapshotCache(config['snapshot_path'], config['snapshot_disk_mb'] * 2**20,
+                                  config['snapshot_memory_mb'] * 2**20)
+    q_cache = None
+    if config['q_cache_size'] > 0:
+        q_cache = QValueCache(config['q_cache_size'], observation.is_binary)
+
+    realtime = None
+    if config['realtime']:  # paced to the wall clock, every decision measured against its deadline
+        realtime = RealTimeMonitor(config['deadline_ms'], config['speed_up'], config['fallback'])
+
+    telemetry = None
+    if config['telemetry_path']:  # per-step log of the test, see telemetry_tail.py
+        telemetry = TelemetryLog(os.path.join(plot_path, config['telemetry_path']))
+
     Simulation = Simulation(
         Model,
         TrafficGen,
@@ -40,13 +74,38 @@ if __name__ == "__main__":
         config['yellow_duration'],
         config['num_states'],
         config['num_actions'],
+        observation,
+        detectors,
+        config['native_stl'],
+        snapshots,
+        config['warmup_steps'],
+        q_cache,
+        config['trip_output'],
+        realtime,
+        telemetry
     )
 
     print('\n----- Test episode')
     total_reward, simulation_time, car_timings = Simulation.run(config['episode_seed'])  # run the simulation
     print('Simulation time:', simulation_time, 's')
+    if snapshots is not None:
+        print('Warm-up time:', round(Simulation.warmup_time, 2), 's')
+        snapshots.close()
 
     print('Total_delay:', Simulation.cumulative_total_wait())
+    if config['trip_output']:
+        print('Trips:', Simulation.trip_stats)
+        print('Average queue length every {} steps:'.format(config['queue_interval']),
+              [round(q, 2) for q in interval_means(Simulation.queue_length_episode, config['queue_interval'])])
+    if q_cache is not None:
+        print(q_cache.stats())
+    if realtime is not None:
+        print('Decision latency:', realtime.stats())
+        print('Fallback decisions:', Simulation.fallbacks)
+        realtime.export(os.path.join(plot_path, 'latency.json'))
+
+    if telemetry is not None:
+        telemetry.close()
 
     print("----- Testing info saved at:", plot_path)
 
@@ -2,21 +2,37 @@ from __future__ import absolute_import
 from __future__ import print_function
 
 import os
+import sys
 import datetime
 from shutil import copyfile
 
 from src.training_simulation import Simulation
 from src.generator import TrafficGenerator
 from src.memory import Memory
+from src.experience import open_for_training
+from src.checkpoint import Checkpointer
+from src.detectors import DetectorMeter
+from src.episode_pipeline import EpisodePipeline
 from src.model import TrainModel
+from src.q_cache import QValueCache
+from src.telemetry import TelemetryLog
+from src.observation import ObservationSpec
 from src.visualization import Visualization
 from src.utils import import_train_configuration, set_sumo, set_train_path
 
 if __name__ == "__main__":
+    # python training_main.py --resume models/model_N continues an interrupted session from its last checkpoint
+    resume = len(sys.argv) > 2 and sys.argv[1] == '--resume'
+    if resume:
+        path = os.path.join(sys.argv[2], '')
+    else:
+        config = import_train_configuration(config_file='settings/training_settings.ini')
+        path = set_train_path(config['models_path_name'])
+        copyfile(src='settings/training_settings.ini', dst=os.path.join(path, 'training_settings.ini'))
+
+    config = import_train_configuration(config_file=os.path.join(path, 'training_settings.ini'))
 
-    config = import_train_configuration(config_file='settings/training_settings.ini')
-    sumo_cmd = set_sumo(config['gui'], config['sumocfg_file_name'], config['max_steps'])
-    path = set_train_path(config['models_path_name'])
+    observation = ObservationSpec(config['net_file'], config['cell_edges'], config['channels'])
 
     Model = TrainModel(
         config['num_layers'],
@@ -25,14 +41,24 @@ if __name__ == "__main__":
         config['learning_rate'],
         config['num_states'],
         config['num_actions'],
-        config['optimizer']
+        config['optimizer'],
+        config['jit_compile'],
+        config['sparse_input'],
+        observation.is_binary
     )
 
+    detectors = DetectorMeter(observation.network) if config['detectors'] else None
+    sumo_cmd = set_sumo(config['gui'], config['sumocfg_file_name'], config['max_steps'],
+                        additional_file=detectors.path if detectors else None)
+
     Memory = Memory(
         config['memory_size_max'],
-        config['memory_size_min']
+        config['memory_size_min'],
+        observation.is_binary
     )
 
+    experience = open_for_training(config, Model, Memory, resume)
+
     TrafficGen = TrafficGenerator(
         config['max_steps'],
         config['n_cars_generated']
@@ -43,7 +69,31 @@ if __name__ == "__main__":
         dpi=96
     )
 
+    q_cache = None
+    if config['q_cache_size'] > 0:  # the q-values of states seen since the last update of the weights
+        q_cache = QValueCache(config['q_cache_size'], observation.is_binary)
+
+    telemetry = None
+    if config['telemetry_path']:  # per-step log of the session, see telemetry_tail.py
+        telemetry = TelemetryLog(os.path.join(path, config['telemetry_path']))
+
+    pipeline = None
+    if config['prefetch']:  # the next episode is generated and its sumo started while the current one runs
+        pipeline = EpisodePipeline(config['total_episodes'])
+    startup_time = 0
+
     episode = 0
+    reward_store = []
+    cumulative_wait_store = []
+    checkpointer = None
+    if config['checkpoint_interval'] > 0:
+        checkpointer = Checkpointer(path, Model, Memory, config['num_states'], config['memory_size_max'],
+                                    observation.is_binary, experience)
+        if resume:
+            start_time = datetime.datetime.now()
+            episode = checkpointer.restore(reward_store, cumulative_wait_store)
+            print("----- Resumed after episode", episode, "in",
+                  round((datetime.datetime.now() - start_time).total_seconds(), 1), "s")
     timestamp_start = datetime.datetime.now()
 
     if config['is_greedy']:
@@ -60,15 +110,31 @@ if __name__ == "__main__":
                 config['num_states'],
                 config['num_actions'],
                 config['training_epochs'],
-                config['is_greedy']
+                config['is_greedy'],
+                config['replay_chunk'],
+                experience,
+                observation,
+                detectors,
+                config['native_stl'],
+                q_cache,
+                pipeline,
+                config['stl_threshold'],
+                telemetry
             )
             print('\n----- Episode', str(episode + 1), 'of', str(config['total_episodes']))
             epsilon = 1.0 - (episode / config[
                 'total_episodes'])  # set the epsilon for this episode according to epsilon-greedy policy
             simulation_time, training_time = simulation.run(episode, epsilon)  # run the simulation
             print('Simulation time:', simulation_time, 's - Training time:', training_time, 's - Total:',
-                  round(simulation_time + training_time, 1), 's')
+                  round(simulation_time + training_time, 1), 's - Startup time:', round(simulation.startup_time, 2), 's')
+            startup_time += simulation.startup_time
+            if q_cache is not None:
+                print(q_cache.stats())
             episode += 1
+            reward_store += simulation.reward_store
+            cumulative_wait_store += simulation.cumulative_wait_store
+            if checkpointer is not None and episode % config['checkpoint_interval'] == 0:
+                print('Checkpoint time:', checkpointer.save(episode, reward_store, cumulative_wait_store), 's')
     else:
         while episode < config['total_episodes']:
             print('\n----- Episode', str(episode + 1), 'of', str(config['total_episodes']))
@@ -77,13 +143,21 @@ if __name__ == "__main__":
                   round(simulation_time + training_time, 1), 's')
             episode += 1
 
+    if pipeline is not None:
+        pipeline.close()
+    if config['is_greedy']:
+        print("\n----- Average startup time of an episode:", round(startup_time / max(config['total_episodes'], 1), 3), "s")
     print("\n----- Start time:", timestamp_start)
     print("----- End time:", datetime.datetime.now())
     print("----- Session info saved at:", path)
 
     Model.save_model(path)
-
-    copyfile(src='settings/training_settings.ini', dst=os.path.join(path, 'training_settings.ini'))
+    if experience is not None:
+        experience.close()
+    if checkpointer is not None:
+        checkpointer.close()
+    if telemetry is not None:
+        telemetry.close()
 
     # Visualization.save_data_and_plot(data=Simulation.reward_store, filename='reward', xlabel='Episode',
     #                                  ylabel='Cumulative negative reward')
@@ -0,0 +1,189 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import multiprocessing
+import os
+import queue
+import time
+import timeit
+
+import numpy as np
+
+from src.memory import Memory
+from src.shared_transport import TransitionRing, WeightsBroadcast
+from src.utils import import_train_configuration
+
+
+def produce(put, rate, duration, num_states, num_actions, seed=0):
+    """
+    Puts random binary transitions at 'rate' transitions per second for 'duration' seconds, the states drawn
+    from a pool so that the generator costs little next to the transport
+    """
+    rng = np.random.RandomState(seed)
+    pool = (rng.uniform(size=(1024, num_states)) < 0.2).astype(float)
+    n_total = int(rate * duration)
+    start_time = timeit.default_timer()
+    for i in range(n_total):
+        while i > rate * (timeit.default_timer() - start_time):  # ahead of the schedule
+            time.sleep(0.0005)
+        put((pool[i % 1024], i % num_actions, -float(i % 100), pool[(i + 1) % 1024]))
+
+
+def queue_worker(transitions, rate, duration, num_states, num_actions):
+    produce(transitions.put, rate, duration, num_states, num_actions)
+    transitions.put(None)
+
+
+def ring_worker(ring_name, done, rate, duration, num_states, num_actions, capacity):
+    ring = TransitionRing(num_states, capacity, name=ring_name)
+    produce(lambda transition: ring.put(*transition), rate, duration, num_states, num_actions)
+    done.set()
+    ring.close()
+
+
+def weight_shapes(config):
+    """
+    Returns the shapes of the weights of the network of TrainModel for 'config', without building it
+    """
+    widths = [config['num_states']] + [config['width_layers']] * (config['num_layers'] + 1) + [config['num_actions']]
+    shapes = []
+    for n_in, n_out in zip(widths[:-1], widths[1:]):
+        shapes += [(n_in, n_out), (n_out,)]
+    return shapes
+
+
+def weights_reader(weights_name, shapes, stop, results):
+    """
+    Reads the weights whenever a new version is published, checking that no read mixes two versions
+    """
+    weights = WeightsBroadcast(shapes, name=weights_name)
+    reads, torn, read_time = 0, 0, 0.0
+    while not stop.is_set():
+        start_time = timeit.default_timer()
+        latest = weights.read()
+        if latest is None:
+            time.sleep(0.0001)
+            continue
+        read_time += timeit.default_timer() - start_time
+        reads += 1
+        torn += len({float(w.flat[0]) for w in latest} | {float(w.flat[-1]) for w in latest}) != 1
+    results.put((reads, torn, read_time / max(reads, 1)))
+    weights.close()
+
+
+def queue_weights_reader(weights_queue, results):
+    """
+    Reads the weights pickled through 'weights_queue' until None
+    """
+    reads, read_time = 0, 0.0
+    while True:
+        start_time = timeit.default_timer()
+        try:
+            latest = weights_queue.get_nowait()
+        except queue.Empty:
+            time.sleep(0.0001)
+            continue
+        if latest is None:
+            break
+        read_time += timeit.default_timer() - start_time
+        reads += 1
+    results.put((reads, 0, read_time / max(reads, 1)))
+
+
+def measure_weights(transport, config, n_versions=200, interval=0.01):
+    """
+    Returns the learner cpu time per published version, the versions a worker read, the reads mixing two versions
+    and the worker time per read, 'n_versions' published every 'interval' seconds
+    """
+    shapes = weight_shapes(config)
+    versions = [[np.full(shape, float(version), dtype=np.float32) for shape in shapes] for version in range(1, 3)]
+    if transport == 'queue':  # pickled to the worker, which only unpickles them
+        weights_queue = multiprocessing.Queue()
+        results = multiprocessing.Queue()
+        worker = multiprocessing.Process(target=queue_weights_reader, args=(weights_queue, results))
+        worker.start()
+        start_cpu = time.process_time()  # with the pickling, in a thread of the queue
+        for version in range(n_versions):
+            weights_queue.put(versions[version % 2])
+            time.sleep(interval)
+        weights_queue.put(None)
+    else:
+        weights = WeightsBroadcast(shapes)
+        stop = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        worker = multiprocessing.Process(target=weights_reader, args=(weights.name, shapes, stop, results))
+        worker.start()
+        start_cpu = time.process_time()
+        for version in range(n_versions):
+            weights.publish(versions[version % 2])
+            time.sleep(interval)
+        stop.set()
+    reads, torn, read_time = results.get()
+    publish_cpu = time.process_time() - start_cpu
+    worker.join()
+    if transport != 'queue':
+        weights.close()
+    return publish_cpu / n_versions, reads, torn, read_time
+
+
+def measure(transport, rate, duration, config, capacity=2**16):
+    """
+    Returns the transitions per second that reached the memory of the learner, and the learner cpu time per transition
+    """
+    memory = Memory(config['memory_size_max'], config['memory_size_min'])
+    num_states, num_actions = config['num_states'], config['num_actions']
+    start_time = timeit.default_timer()
+    start_cpu = time.process_time()
+    received = 0
+    if transport == 'queue':
+        transitions = multiprocessing.Queue()
+        worker = multiprocessing.Process(target=queue_worker,
+                                         args=(transitions, rate, duration, num_states, num_actions))
+        worker.start()
+        while True:
+            transition = transitions.get()
+            if transition is None:
+                break
+            memory.add_sample(transition)
+            received += 1
+    else:
+        ring = TransitionRing(num_states, capacity)
+        done = multiprocessing.Event()
+        worker = multiprocessing.Process(target=ring_worker,
+                                         args=(ring.name, done, rate, duration, num_states, num_actions, capacity))
+        worker.start()
+        while True:
+            finished = done.is_set()
+            n = ring.drain_into(memory)
+            received += n
+            if finished and ring.pending == 0:
+                break
+            if n == 0:
+                time.sleep(0.001)
+        ring.close()
+    worker.join()
+    elapsed = timeit.default_timer() - start_time
+    return received / elapsed, (time.process_time() - start_cpu) / received
+
+
+if __name__ == "__main__":
+    config = import_train_configuration(config_file='settings/training_settings.ini')
+    duration = 5
+    print("num_states: {}, {} s per run".format(config['num_states'], duration))
+
+    os.makedirs('benchmark', exist_ok=True)
+    with open("benchmark/shared_transport.txt", 'a') as f:
+        for rate in [10000, 100000]:
+            for transport in ['queue', 'shared memory']:
+                throughput, cpu = measure(transport, rate, duration, config)
+                print("{} transitions/s, {}: {:.0f} transitions/s received, learner {:.1f} us cpu per transition"
+                      .format(rate, transport, throughput, cpu * 1e6))
+                f.write("{}, {}, {}: {:.0f} transitions/s, {:.1f} us/transition\n".format(
+                    config['num_states'], rate, transport, throughput, cpu * 1e6))
+        for transport in ['queue', 'shared memory']:
+            publish, reads, torn, read = measure_weights(transport, config)
+            line = ("weights of {} floats, {}: learner {:.3f} ms cpu per version, {} of 200 versions read, {} torn reads, "
+                    "read in {:.3f} ms").format(sum(int(np.prod(shape)) for shape in weight_shapes(config)),
+                                                transport, publish * 1000, reads, torn, read * 1000)
+            print(line)
+            f.write(line + "\n")
@@ -0,0 +1,78 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import subprocess
+import timeit
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+from src.benchmark_stl import Simulation
+from src.generator import TrafficGenerator
+from src.trip_output import TripLog
+from src.utils import import_test_configuration, set_sumo
+
+
+def run_episode(config, sumo_cmd, n_cars, trip_output, traced=False):
+    """
+    Runs the STL episode phase by phase, returns its wall time, peak python memory if 'traced', delay and trips
+    """
+    simulation = Simulation(TrafficGenerator(config['max_steps'], n_cars), sumo_cmd, config['max_steps'],
+                            config['green_duration'], config['yellow_duration'], config['num_states'],
+                            config['num_actions'], False, trip_output)
+    if traced:
+        tracemalloc.start()
+    start_time = timeit.default_timer()
+    simulation.run(config['episode_seed'])
+    elapsed = timeit.default_timer() - start_time
+    peak = 0
+    if traced:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return elapsed, peak, simulation.cumulative_total_wait(), simulation.trip_stats
+
+
+def parse_peaks(config, sumo_cmd, n_cars):
+    """
+    Returns the size of the tripinfo output of an episode and the peak python memory of streaming it with TripLog
+    and of parsing it whole
+    """
+    TrafficGenerator(config['max_steps'], n_cars).generate_routefile(seed=config['episode_seed'])
+    trip_log = TripLog(config['max_steps'])
+    subprocess.run(trip_log.add_output(sumo_cmd) + ["--end", str(config['max_steps'])], check=True,
+                   stdout=subprocess.DEVNULL)
+    peaks = []
+    for parse in [trip_log.read, lambda: ET.parse(trip_log.path)]:
+        tracemalloc.start()
+        parse()
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    size = os.path.getsize(trip_log.path)
+    trip_log.close()
+    return size, peaks[0], peaks[1]
+
+
+if __name__ == "__main__":
+    # the STL benchmark episode polling every vehicle and edge through TraCI against sumo writing the trips and queues
+    config = import_test_configuration(config_file='settings/testing_settings.ini')
+    sumo_cmd = set_sumo(False, config['sumocfg_file_name'], config['max_steps'])
+    os.makedirs('benchmark', exist_ok=True)
+
+    with open(os.path.join('benchmark', 'trip_output.txt'), 'a') as f:
+        for n_cars in [1000, 2500, 3500, 5000]:
+            for trip_output in [False, True]:
+                elapsed, _, delay, trips = run_episode(config, sumo_cmd, n_cars, trip_output)
+                _, peak, _, _ = run_episode(config, sumo_cmd, n_cars, trip_output, traced=True)
+                line = "{} cars, {}: {:.1f} s, python peak {:.0f} KiB, total delay {}".format(
+                    n_cars, "trip output" if trip_output else "polling", elapsed, peak / 2**10, delay)
+                print(line)
+                f.write(line + "\n")
+                if trips:
+                    line = "{} cars, trips: {}".format(n_cars, {key: round(value, 1) for key, value in trips.items()})
+                    print(line)
+                    f.write(line + "\n")
+            size, streamed, whole = parse_peaks(config, sumo_cmd, n_cars)
+            line = "{} cars, tripinfo of {:.0f} KiB: streamed peak {:.0f} KiB, whole parse peak {:.0f} KiB".format(
+                n_cars, size / 2**10, streamed / 2**10, whole / 2**10)
+            print(line)
+            f.write(line + "\n")